@@ -0,0 +1,189 @@
+# cSpell:disable
+import os
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from dataclasses import dataclass
+
+from telegram import Bot
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+
+from metrics import ADMIN_BACKLOG, ADMIN_NOTIFY_SECONDS, RATE_LIMITED
+
+log = logging.getLogger("admin-notifier")
+
+# حد تيليغرام للقروبات ~20 رسالة بالدقيقة
+ADMIN_RATE_PER_MINUTE = float(os.getenv("ADMIN_RATE_PER_MINUTE", "20"))
+ADMIN_BURST = int(os.getenv("ADMIN_BURST", "5"))
+# لما يتراكم هالعدد بالطابور نجمعهم برسالة وحدة
+DIGEST_THRESHOLD = int(os.getenv("ADMIN_DIGEST_THRESHOLD", "3"))
+DIGEST_MAX_ITEMS = 10
+MESSAGE_LIMIT = 4096
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # بعد 429: ولا رسالة قبل ما تخلص المدة اللي طلبها تيليغرام
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+@dataclass(frozen=True)
+class AdminNotice:
+    text: str
+    from_chat_id: int | None = None
+    message_ids: tuple[int, ...] = ()
+
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    delay = e.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class AdminNotifier:
+    """Per-destination queues of admin notifications, each drained by its own
+    worker under a token bucket. When a queue backs up, pending summaries are
+    merged into one digest and their forwards sent with `forward_messages`."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate_per_minute: float = ADMIN_RATE_PER_MINUTE,
+        burst: int = ADMIN_BURST,
+        digest_threshold: int = DIGEST_THRESHOLD,
+        max_attempts: int = 5,
+    ):
+        self.bot = bot
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.digest_threshold = digest_threshold
+        self.max_attempts = max_attempts
+        self._queues: dict[int, asyncio.Queue[AdminNotice]] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+
+    def notify(
+        self,
+        chat_id: int,
+        text: str,
+        from_chat_id: int | None = None,
+        message_id: int | None = None,
+        message_ids: tuple[int, ...] = (),
+    ) -> None:
+        """Queue `text` for `chat_id`, followed by a forward of `message_id`
+        (or all of `message_ids`) from `from_chat_id`."""
+        if message_id is not None:
+            message_ids = (*message_ids, message_id)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            self._buckets[chat_id] = TokenBucket(self.rate_per_minute / 60, self.burst)
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._worker(chat_id))
+        queue.put_nowait(AdminNotice(text, from_chat_id, message_ids if from_chat_id is not None else ()))
+        ADMIN_BACKLOG.labels(chat_id).inc()
+
+    def backlog(self) -> dict[int, int]:
+        return {chat_id: q.qsize() for chat_id, q in self._queues.items()}
+
+    async def _call(self, chat_id: int, fn, **kwargs) -> None:
+        bucket = self._buckets[chat_id]
+        timer = ADMIN_NOTIFY_SECONDS.labels(fn.__name__)
+        for attempt in range(self.max_attempts):
+            await bucket.acquire()
+            try:
+                with timer.time():
+                    await fn(chat_id=chat_id, **kwargs)
+                return
+            except RetryAfter as e:
+                RATE_LIMITED.labels("telegram").inc()
+                delay = retry_after_seconds(e)
+                log.warning("Admin chat %s rate limited, retrying in %.0fs", chat_id, delay)
+                bucket.pause(delay)
+            except (TimedOut, NetworkError) as e:
+                log.warning("Admin notification to %s failed (%s), retrying", chat_id, e)
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                log.warning("Failed to notify admin: %s", e)
+                return
+        log.warning("Giving up on admin notification to %s after %d attempts", chat_id, self.max_attempts)
+
+    def _take_batch(self, queue: asyncio.Queue, first: AdminNotice) -> list[AdminNotice]:
+        batch = [first]
+        if queue.qsize() + 1 >= self.digest_threshold:
+            while not queue.empty() and len(batch) < DIGEST_MAX_ITEMS:
+                batch.append(queue.get_nowait())
+        return batch
+
+    async def _send_batch(self, chat_id: int, batch: list[AdminNotice]) -> None:
+        if len(batch) == 1:
+            text = batch[0].text
+        else:
+            # كل ملخّص ياخذ حصته من حد الـ 4096 حرف
+            share = MESSAGE_LIMIT // len(batch) - 40
+            text = f"📬 {len(batch)} مشاركات جديدة\n\n" + "\n\n— — —\n\n".join(
+                n.text if len(n.text) <= share else n.text[:share] + "…" for n in batch
+            )
+        await self._call(chat_id, self.bot.send_message, text=text[:MESSAGE_LIMIT])
+
+        # Forward للرسائل الأصلية: طلب واحد لكل محادثة مصدر
+        by_source: dict[int, list[int]] = {}
+        for n in batch:
+            if n.message_ids:
+                by_source.setdefault(n.from_chat_id, []).extend(n.message_ids)
+        for from_chat_id, ids in by_source.items():
+            if len(ids) == 1:
+                await self._call(chat_id, self.bot.forward_message, from_chat_id=from_chat_id, message_id=ids[0])
+            else:
+                await self._call(
+                    chat_id, self.bot.forward_messages, from_chat_id=from_chat_id, message_ids=sorted(ids)
+                )
+
+    async def _worker(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        while True:
+            first = await queue.get()
+            batch = self._take_batch(queue, first)
+            try:
+                await self._send_batch(chat_id, batch)
+            except Exception:
+                log.exception("Admin notification worker for %s failed", chat_id)
+            finally:
+                ADMIN_BACKLOG.labels(chat_id).dec(len(batch))
+                for _ in batch:
+                    queue.task_done()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        pending = [q.join() for q in self._queues.values()]
+        if pending:
+            try:
+                await asyncio.wait_for(asyncio.gather(*pending), timeout=timeout)
+            except asyncio.TimeoutError:
+                log.warning("Dropping %d undelivered admin notifications", sum(self.backlog().values()))
+        for chat_id in self._queues:
+            ADMIN_BACKLOG.labels(chat_id).set(0)
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+        self._buckets.clear()
@@ -0,0 +1,67 @@
+# cSpell:disable
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from telegram import Message
+
+log = logging.getLogger("album-collector")
+
+ALBUM_DEBOUNCE = float(os.getenv("ALBUM_DEBOUNCE_SECONDS", "1.5"))
+# تيليغرام ما بيبعت أكثر من 10 عناصر بالألبوم الواحد
+ALBUM_MAX_ITEMS = 10
+
+AlbumCallback = Callable[[list[Message]], Awaitable[None]]
+
+
+class AlbumCollector:
+    """Groups messages by (chat_id, media_group_id) and hands each album to
+    its callback once no new part has arrived for `delay` seconds, or as soon
+    as it has ALBUM_MAX_ITEMS parts."""
+
+    def __init__(self, delay: float = ALBUM_DEBOUNCE):
+        self.delay = delay
+        self._albums: dict[tuple[int, str], tuple[list[Message], asyncio.TimerHandle, AlbumCallback]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, m: Message, on_complete: AlbumCallback) -> None:
+        key = (m.chat_id, m.media_group_id)
+        entry = self._albums.get(key)
+        if entry is None:
+            messages = []
+        else:
+            messages, timer, _ = entry
+            timer.cancel()
+        messages.append(m)
+        timer = asyncio.get_running_loop().call_later(self.delay, self._complete, key)
+        self._albums[key] = (messages, timer, on_complete)
+        if len(messages) >= ALBUM_MAX_ITEMS:
+            self._complete(key)
+
+    def _complete(self, key: tuple[int, str]) -> None:
+        entry = self._albums.pop(key, None)
+        if entry is None:
+            return
+        messages, timer, on_complete = entry
+        timer.cancel()
+        messages.sort(key=lambda x: x.message_id)
+        task = asyncio.get_running_loop().create_task(self._run(on_complete, messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(on_complete: AlbumCallback, messages: list[Message]) -> None:
+        try:
+            await on_complete(messages)
+        except Exception:
+            log.exception("Handling album of %d messages failed", len(messages))
+
+    def pending(self) -> int:
+        return len(self._albums)
+
+    async def flush(self) -> None:
+        for key in list(self._albums):
+            self._complete(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,72 @@
+# cSpell:disable
+"""Micro-benchmark: keyboards rebuilt per callback vs. the precomputed cache.
+
+    python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+import warnings
+import tracemalloc
+import importlib.util
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_bot():
+    warnings.simplefilter("ignore")
+    spec = importlib.util.spec_from_file_location("registration_bot", os.path.join(ROOT, "class_4-6_male.py"))
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
+
+
+def allocations(fn, calls: int = 1000) -> tuple[float, float]:
+    """Average (blocks, bytes) allocated per call."""
+    fn()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [fn() for _ in range(calls)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    del keep
+    return blocks / calls, size / calls
+
+
+def main():
+    bot = load_bot()
+    context = SimpleNamespace(user_data={"gender_key": "m", "grade_key": "g5"})
+
+    def rebuild():
+        # المسار القديم: كل ضغطة تبني القائمة من جديد
+        tracks = bot.get_tracks_for_user(context)
+        return (
+            bot._build_grades_keyboard(),
+            bot._build_tracks_keyboard(tracks),
+            bot._build_options_keyboard(bot.CATALOG.by_key["m46_t2"]),
+            bot._build_confirm_keyboard(),
+        )
+
+    def cached():
+        return (
+            bot.grades_keyboard(),
+            bot.tracks_keyboard_for(context),
+            bot.options_keyboard("m46_t2", context),
+            bot.confirm_keyboard(),
+        )
+
+    print(f"{'path':<10}{'µs/callback':>14}{'blocks/callback':>18}{'bytes/callback':>17}")
+    for name, fn in (("rebuild", rebuild), ("cached", cached)):
+        n = 2000
+        per_call = min(timeit.repeat(fn, number=n, repeat=5)) / n * 1e6
+        blocks, size = allocations(fn)
+        print(f"{name:<10}{per_call:>14.2f}{blocks:>18.1f}{size:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
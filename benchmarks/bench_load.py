@@ -0,0 +1,373 @@
+# cSpell:disable
+"""Offline load test: simulated students driven through the real Application.
+
+Every bot API call is answered in-process by `FakeBotAPI`, and sheet appends
+go to `FakeSheetClient`; both sleep for a configurable latency instead of
+touching the network. SQLite files (registrations, outbox, state) live in a
+throwaway directory.
+
+    python benchmarks/bench_load.py --users 1000
+    python benchmarks/bench_load.py --bot contribution --users 20000 --api-latency-ms 80 --sheets-latency-ms 800
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import warnings
+import importlib.util
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOKEN = "123456:LOAD-TEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# ---- Fakes ----
+
+class FakeSheetClient:
+    """Stands in for sheets_client.SheetClient; `append_rows` runs in a worker
+    thread (via BatchedSheetWriter) so a blocking sleep mimics the HTTP call."""
+
+    def __init__(self, latency: float, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rows = 0
+        self.calls = 0
+        self.wanted: set[str] = set()
+
+    def warm(self) -> None:
+        pass
+
+    def append_rows(self, worksheet_name: str, rows: list[list[str]]) -> None:
+        time.sleep(self.latency)
+        self.calls += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("fake sheets failure")
+        self.rows += len(rows)
+
+    def append_row(self, worksheet_name: str, values: list[str]) -> None:
+        self.append_rows(worksheet_name, [values])
+
+
+def make_fake_bot_api(latency: float):
+    from telegram.request import BaseRequest
+
+    class FakeBotAPI(BaseRequest):
+        """BaseRequest that answers Bot API methods locally after `latency`
+        seconds, returning just enough of each object for PTB to parse."""
+
+        def __init__(self):
+            self.latency = latency
+            self.calls: Counter[str] = Counter()
+            self._message_ids = 10 ** 6
+
+        @property
+        def read_timeout(self) -> float | None:
+            return None
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        def _message(self, params: dict) -> dict:
+            self._message_ids += 1
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": params.get("message_id") or self._message_ids,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+
+        def _result(self, method: str, params: dict):
+            if method == "getMe":
+                return BOT_USER
+            if method in ("sendMessage", "editMessageText", "forwardMessage", "copyMessage", "sendDocument"):
+                return self._message(params)
+            if method in ("forwardMessages", "copyMessages"):
+                return [{"message_id": self._message(params)["message_id"]} for _ in params.get("message_ids", ())]
+            return True
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit("/", 1)[-1]
+            self.calls[api_method] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            params = request_data.parameters if request_data else {}
+            body = {"ok": True, "result": self._result(api_method, params)}
+            return 200, json.dumps(body).encode()
+
+    return FakeBotAPI()
+
+
+# ---- Synthetic updates ----
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = 0
+        self._message_ids: Counter[int] = Counter()
+
+    def _next_update_id(self) -> int:
+        self._update_ids += 1
+        return self._update_ids
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Student{user_id}", "username": f"student{user_id}"}
+
+    def message(self, user_id: int, text: str | None = None, **extra):
+        from telegram import Update
+
+        self._message_ids[user_id] += 1
+        message = {
+            "message_id": self._message_ids[user_id],
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **extra,
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": self._next_update_id(), "message": message}, self.bot)
+
+    def callback(self, user_id: int, data: str):
+        from telegram import Update
+
+        update_id = self._next_update_id()
+        query = {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "…",
+            },
+        }
+        return Update.de_json({"update_id": update_id, "callback_query": query}, self.bot)
+
+
+def registration_flow(bot_module, updates: UpdateFactory, user_id: int, rng: random.Random):
+    gender = rng.choice(("m", "f"))
+    grade = rng.choice(tuple(bot_module.GRADES))
+    tracks = bot_module.CATALOG.for_group(gender, bot_module.GRADE_TO_GROUP[grade])
+    track = rng.choice(tracks)
+
+    yield "start", updates.message(user_id, "/start")
+    yield "name", updates.message(user_id, f"طالب تجريبي {user_id}")
+    yield "gender", updates.callback(user_id, f"gender:{gender}")
+    yield "grade", updates.callback(user_id, f"grade:{grade}")
+    yield "track", updates.callback(user_id, track.callback_data)
+    if track.options:
+        yield "option", updates.callback(user_id, rng.choice(track.options).callback_data)
+    yield "confirm", updates.callback(user_id, "confirm")
+
+
+def contribution_flow(bot_module, updates: UpdateFactory, user_id: int, rng: random.Random):
+    yield "start", updates.message(user_id, "/start")
+    yield "name", updates.message(user_id, f"طالب تجريبي {user_id}")
+    if rng.random() < 0.5:
+        yield "submission", updates.message(user_id, "مشاركتي " * rng.randint(1, 50))
+    else:
+        photo = [{"file_id": f"photo-{user_id}", "file_unique_id": f"u{user_id}", "width": 1280, "height": 720}]
+        yield "submission", updates.message(user_id, photo=photo, caption="صورة المشروع")
+
+
+# ---- Harness ----
+
+class Recorder:
+    """Times each update twice: from enqueue to the last handler group
+    ("e2e", what the student waits) and from dequeue to the last handler
+    group ("handler")."""
+
+    def __init__(self):
+        self.pending: dict[int, tuple[str, float, asyncio.Future]] = {}
+        self.handler_started: dict[int, float] = {}
+        self.e2e: dict[str, list[float]] = defaultdict(list)
+        self.handler: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+
+    async def send(self, app, step: str, update) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[update.update_id] = (step, time.perf_counter(), fut)
+        await app.update_queue.put(update)
+        await fut
+
+    async def on_begin(self, update, context) -> None:
+        self.handler_started[update.update_id] = time.perf_counter()
+
+    async def on_end(self, update, context) -> None:
+        now = time.perf_counter()
+        step, queued_at, fut = self.pending.pop(update.update_id)
+        self.e2e[step].append(now - queued_at)
+        self.handler[step].append(now - self.handler_started.pop(update.update_id, queued_at))
+        if not fut.done():
+            fut.set_result(None)
+
+    async def on_error(self, update, context) -> None:
+        self.errors += 1
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.01) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+def load_modules(bot: str):
+    warnings.simplefilter("ignore")
+    if bot == "registration":
+        spec = importlib.util.spec_from_file_location("registration_bot", os.path.join(ROOT, "class_4-6_male.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module, module.build_application, module.CREDS_FILE, module.SPREADSHEET_ID, registration_flow
+
+    import contribution_bot
+    import contribution_giras
+
+    # إشعارات الأدمن تمر على نفس FakeBotAPI فتنحسب ضمن الـ API calls
+    config = contribution_giras.DEFAULTS
+
+    def build(token, request):
+        return contribution_bot.build_application(config, token, request)
+
+    return contribution_bot, build, contribution_bot.CREDS_FILE, config.spreadsheet_id, contribution_flow
+
+
+async def run(args) -> int:
+    from telegram.ext import TypeHandler
+    from telegram import Update
+
+    import sheets_client
+    from sheets_writer import close_sheet_writers
+
+    module, build, creds_file, spreadsheet_id, flow = load_modules(args.bot)
+    sheet = FakeSheetClient(args.sheets_latency_ms / 1000, args.sheets_failure_rate)
+    sheets_client._clients[(creds_file, spreadsheet_id)] = sheet
+    api = make_fake_bot_api(args.api_latency_ms / 1000)
+
+    app = build(TOKEN, api)
+    recorder = Recorder()
+    app.add_handler(TypeHandler(Update, recorder.on_begin), group=-(10 ** 6))
+    app.add_handler(TypeHandler(Update, recorder.on_end), group=10 ** 6)
+    app.add_error_handler(recorder.on_error)
+    updates = UpdateFactory(app.bot)
+
+    lag: list[float] = []
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    lag_task = asyncio.get_running_loop().create_task(monitor_loop_lag(lag))
+
+    async def student(index: int) -> None:
+        await asyncio.sleep(args.ramp * index / args.users)
+        rng = random.Random(args.seed + index)
+        user_id = 10 ** 9 + index
+        for step, update in flow(module, updates, user_id, rng):
+            await recorder.send(app, step, update)
+            if args.think_ms:
+                await asyncio.sleep(rng.uniform(0, 2 * args.think_ms / 1000))
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(student(i) for i in range(args.users)), return_exceptions=True), timeout=args.timeout
+        )
+    except asyncio.TimeoutError:
+        results = []
+        print(f"timed out after {args.timeout:.0f}s with {len(recorder.pending)} updates in flight")
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    await close_sheet_writers()
+
+    finished = sum(1 for r in results if r is None)
+    total_updates = sum(len(v) for v in recorder.e2e.values())
+
+    print(f"bot={args.bot} users={args.users} api={args.api_latency_ms}ms sheets={args.sheets_latency_ms}ms")
+    print(f"elapsed {elapsed:.2f}s  flows {finished}/{args.users}  errors {recorder.errors}")
+    print(f"throughput {total_updates / elapsed:.1f} updates/s  {finished / elapsed:.1f} flows/s")
+    print()
+    print(f"{'step':<12}{'count':>8}{'e2e p50':>10}{'e2e p99':>10}{'hdl p50':>10}{'hdl p99':>10}   (ms)")
+    for step in recorder.e2e:
+        e2e, hdl = recorder.e2e[step], recorder.handler[step]
+        print(
+            f"{step:<12}{len(e2e):>8}"
+            f"{percentile(e2e, 0.5) * 1e3:>10.1f}{percentile(e2e, 0.99) * 1e3:>10.1f}"
+            f"{percentile(hdl, 0.5) * 1e3:>10.1f}{percentile(hdl, 0.99) * 1e3:>10.1f}"
+        )
+    print()
+    print(
+        f"event-loop lag  p50 {percentile(lag, 0.5) * 1e3:.1f}ms  p99 {percentile(lag, 0.99) * 1e3:.1f}ms"
+        f"  max {max(lag, default=0) * 1e3:.1f}ms"
+    )
+    print(f"bot API calls   {dict(api.calls)}")
+    print(f"sheet appends   {sheet.calls} calls, {sheet.rows} rows")
+
+    all_e2e = [v for values in recorder.e2e.values() for v in values]
+    if args.max_p99_ms and percentile(all_e2e, 0.99) * 1e3 > args.max_p99_ms:
+        print(f"FAIL: e2e p99 above {args.max_p99_ms}ms")
+        return 1
+    return 0 if finished == args.users else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bot", choices=("registration", "contribution"), default="registration")
+    parser.add_argument("--users", type=int, default=1000, help="concurrent simulated students")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which students start")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a student's steps")
+    parser.add_argument("--api-latency-ms", type=float, default=50)
+    parser.add_argument("--sheets-latency-ms", type=float, default=300)
+    parser.add_argument("--sheets-failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrent-updates", type=int, default=1, help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="exit 1 if the e2e p99 is above this")
+    args = parser.parse_args()
+
+    # كل تشغيل بقاعدة بيانات فاضية؛ المسارات تنقرأ من env وقت الاستيراد
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    os.environ["OUTBOX_DB_PATH"] = os.path.join(workdir, "outbox.sqlite3")
+    os.environ["STATE_DB_PATH"] = os.path.join(workdir, "state.sqlite3")
+    os.environ["CONCURRENT_UPDATES"] = str(args.concurrent_updates)
+    os.chdir(workdir)
+    print(f"workdir {workdir}")
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# cSpell:disable
+import os
+import re
+import hmac
+import json
+import time
+import signal
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+import tornado.web
+import tornado.httpserver
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, HTTPXRequest
+
+from sheets_client import warm_sheet_clients
+from sheets_writer import close_sheet_writers
+from metrics import CONTENT_TYPE, REGISTRY, STARTUP_SECONDS, UPDATE_QUEUE, WEBHOOK_UPDATES
+
+log = logging.getLogger("bot-host")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "64"))
+# /metrics على بورت خاص، مش على الـ listener العام تبع الـ webhook؛ بدونه ما في metrics
+METRICS_PORT = os.getenv("METRICS_PORT")
+# افتراضياً بس من نفس الجهاز؛ 0.0.0.0 للشبكة الداخلية (ومعها METRICS_TOKEN)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# إذا انحط: لازم "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# أقصى عدد updates ناطرة لكل بوت قبل ما نبلّش نرفض
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "1000"))
+# "retry": نرد 503 وتيليغرام بيعيد الإرسال لاحقاً؛ "drop": نرد 200 ونرمي الـ update
+WEBHOOK_SHED = os.getenv("WEBHOOK_SHED", "retry")
+WEBHOOK_DEDUPE_WINDOW = 10_000
+
+
+@dataclass(frozen=True)
+class BotSpec:
+    """One bot hosted by `serve`: `build(token, request)` returns its
+    Application with handlers and post_init/post_shutdown hooks attached."""
+
+    name: str
+    build: Callable[[str, BaseRequest | None], Application]
+    token: str
+    webhook_path: str
+    secret_token: str | None = None
+
+
+def _process_age() -> float | None:
+    """Seconds since this process started (Linux only), so the startup
+    breakdown includes interpreter start-up and imports."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Times the phases of `serve` and logs them as one line; also logs
+    when the first webhook update is acknowledged."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: list[tuple[str, float]] = []
+        age = _process_age()
+        if age is not None:
+            # قبل serve: تشغيل المفسّر والاستيرادات وبناء الـ handlers
+            self.phases.append(("imports", age))
+        self._acked = False
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        STARTUP_SECONDS.labels(phase).set(now - self._last)
+        self._last = now
+
+    def since_process_start(self) -> float:
+        before = self.phases[0][1] if self.phases and self.phases[0][0] == "imports" else 0.0
+        return before + time.perf_counter() - self.started
+
+    def report(self) -> None:
+        if self.phases and self.phases[0][0] == "imports":
+            STARTUP_SECONDS.labels("imports").set(self.phases[0][1])
+        log.info(
+            "Startup %.2fs: %s",
+            sum(seconds for _, seconds in self.phases),
+            ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases),
+        )
+
+    def acked(self) -> None:
+        if not self._acked:
+            self._acked = True
+            log.info("First webhook update acknowledged %.3fs after process start", self.since_process_start())
+
+
+def update_backlog(app: Application) -> int:
+    """Updates received but not finished: still in the update queue, or
+    (with a concurrent update processor) taken off it and not done yet."""
+    processor = getattr(app, "update_processor", None)
+    return app.update_queue.qsize() + getattr(processor, "pending", 0)
+
+
+class RecentUpdateIds:
+    """The last `size` accepted update_ids, to drop Telegram redeliveries."""
+
+    def __init__(self, size: int = WEBHOOK_DEDUPE_WINDOW):
+        self._order: deque[int] = deque()
+        self._ids: set[int] = set()
+        self.size = size
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._ids
+
+    def add(self, update_id: int) -> None:
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    """Checks the secret, drops redeliveries and sheds load when the bot is
+    behind; otherwise queues the update and answers 200 right away. The
+    update is handled later by the Application, never inside the request."""
+
+    def initialize(
+        self,
+        app: Application,
+        bot_name: str,
+        secret_token: str | None,
+        seen: RecentUpdateIds,
+        timer: StartupTimer | None = None,
+    ):
+        self.app = app
+        self.bot_name = bot_name
+        self.secret_token = secret_token
+        self.seen = seen
+        self.timer = timer
+
+    def _count(self, result: str) -> None:
+        WEBHOOK_UPDATES.labels(self.bot_name, result).inc()
+
+    async def post(self):
+        if self.secret_token and not hmac.compare_digest(
+            self.request.headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            self._count("forbidden")
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+            update_id = data["update_id"]
+        except Exception:
+            self._count("malformed")
+            log.warning("Dropping malformed webhook payload on %s", self.request.path)
+            raise tornado.web.HTTPError(400)
+
+        if update_id in self.seen:
+            self._count("duplicate")
+            self.set_status(200)
+            return
+        if update_backlog(self.app) >= WEBHOOK_MAX_QUEUE:
+            self._count("shed")
+            if WEBHOOK_SHED == "drop":
+                self.set_status(200)
+                return
+            # مش HTTPError: send_error بيمسح Retry-After
+            self.set_status(503)
+            self.set_header("Retry-After", "5")
+            return
+
+        try:
+            update = Update.de_json(data, self.app.bot)
+        except Exception:
+            self._count("malformed")
+            log.warning("Dropping malformed webhook payload on %s", self.request.path)
+            raise tornado.web.HTTPError(400)
+        self.seen.add(update_id)
+        # ينحط بالطابور حتى لو البوت لسه عم يقلع؛ بيتعالج أول ما يخلص app.start()
+        self.app.update_queue.put_nowait(update)
+        self._count("accepted")
+        self.set_status(200)
+        if self.timer is not None:
+            self.timer.acked()
+
+
+class _MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, token: str | None = None):
+        self.token = token
+
+    async def get(self):
+        if self.token and not hmac.compare_digest(
+            self.request.headers.get("Authorization", "").encode(), f"Bearer {self.token}".encode()
+        ):
+            # مش HTTPError: send_error بيمسح الـ headers
+            self.set_status(401)
+            self.set_header("WWW-Authenticate", "Bearer")
+            return
+        body = await REGISTRY.render()
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(body)
+
+
+class _HttpServer:
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._routes: list = []
+        self._server: tornado.httpserver.HTTPServer | None = None
+
+    def application(self) -> tornado.web.Application:
+        return tornado.web.Application(self._routes)
+
+    def start(self) -> None:
+        self._server = tornado.httpserver.HTTPServer(self.application())
+        self._server.listen(self.port, self.listen)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+
+class WebhookServer(_HttpServer):
+    """One public HTTP listener for all bots; each bot gets its own path.
+    Nothing else is served on it."""
+
+    def __init__(self, listen: str, port: int, timer: StartupTimer | None = None):
+        super().__init__(listen, port)
+        self.timer = timer
+
+    def add_bot(self, name: str, path: str, app: Application, secret_token: str | None) -> None:
+        pattern = rf"/{re.escape(path.strip('/'))}/?"
+        self._routes.append((pattern, _WebhookHandler, {
+            "app": app,
+            "bot_name": name,
+            "secret_token": secret_token,
+            "seen": RecentUpdateIds(),
+            "timer": self.timer,
+        }))
+
+
+class MetricsServer(_HttpServer):
+    """/metrics (Prometheus text exposition) on its own, internal listener,
+    optionally behind a bearer token."""
+
+    def __init__(self, listen: str, port: int, token: str | None = None):
+        super().__init__(listen, port)
+        self._routes.append((r"/metrics", _MetricsHandler, {"token": token}))
+
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    return stop
+
+
+async def serve(
+    specs: list[BotSpec],
+    webhook_base_url: str | None = None,
+    listen: str = "0.0.0.0",
+    port: int = 10000,
+    request: BaseRequest | None = None,
+    stop: asyncio.Event | None = None,
+    metrics_port: int | None = None,
+    metrics_listen: str = METRICS_LISTEN,
+    metrics_token: str | None = METRICS_TOKEN,
+) -> None:
+    """Run every bot in `specs` on the current event loop, sharing one HTTP
+    connection pool and, in webhook mode, one listener.
+
+    Without `webhook_base_url` each bot long-polls instead. /metrics is
+    only served if `metrics_port` is given, on `metrics_listen` (localhost
+    by default), never on the public webhook listener.
+
+    The listener is bound before the bots initialize, so on a cold start
+    Telegram's first webhook request gets its 200 as soon as the process
+    is up; updates wait in the queue until their Application has started.
+    The Sheets clients are warmed in the background afterwards."""
+    timer = StartupTimer()
+    request = request or HTTPXRequest(connection_pool_size=HTTP_POOL_SIZE)
+    apps = [(spec, spec.build(spec.token, request)) for spec in specs]
+    stop = stop or _stop_event()
+    server = WebhookServer(listen, port, timer) if webhook_base_url else None
+    metrics_server = MetricsServer(metrics_listen, metrics_port, metrics_token) if metrics_port else None
+    timer.mark("build")
+
+    async def collect_queue_sizes() -> None:
+        for spec, app in apps:
+            UPDATE_QUEUE.labels(spec.name).set(update_backlog(app))
+
+    REGISTRY.add_collector(collect_queue_sizes)
+
+    async def initialize(app: Application) -> None:
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+
+    started: list[Application] = []
+    warm: asyncio.Task | None = None
+    try:
+        if metrics_server:
+            metrics_server.start()
+        if server:
+            for spec, app in apps:
+                server.add_bot(spec.name, spec.webhook_path, app, spec.secret_token)
+            server.start()
+            timer.mark("listen")
+
+        # getMe وpost_init لكل البوتات بنفس الوقت
+        await asyncio.gather(*(initialize(app) for _, app in apps))
+        timer.mark("initialize")
+
+        for spec, app in apps:
+            await app.start()
+            started.append(app)
+        timer.mark("start")
+
+        for spec, app in apps:
+            if webhook_base_url:
+                webhook_url = f"{webhook_base_url}/{spec.webhook_path}"
+                log.info("%s webhook URL: %s", spec.name, webhook_url)
+                await app.bot.set_webhook(
+                    url=webhook_url,
+                    secret_token=spec.secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            else:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                log.info("%s polling", spec.name)
+        timer.mark("set_webhook" if webhook_base_url else "start_polling")
+        timer.report()
+
+        warm = asyncio.get_running_loop().create_task(warm_sheet_clients())
+        await stop.wait()
+    finally:
+        if warm is not None:
+            warm.cancel()
+        REGISTRY.remove_collector(collect_queue_sizes)
+        if server:
+            await server.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        for app in started:
+            if app.updater and app.updater.running:
+                await app.updater.stop()
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        # الـ HTTP pool مشترك، فنسكّر كل البوتات بعد ما توقف كلها
+        for _, app in apps:
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+        await close_sheet_writers()
+
+
+def run_bots(specs: list[BotSpec]) -> None:
+    render_url = os.getenv("RENDER_EXTERNAL_URL")  # Render بيعطيك رابط الخدمة تلقائياً
+    port = int(os.getenv("PORT", "10000"))  # لازم تسمع على PORT في Render
+    asyncio.run(serve(
+        specs,
+        webhook_base_url=render_url.rstrip("/") if render_url else None,
+        port=port,
+        metrics_port=int(METRICS_PORT) if METRICS_PORT else None,
+    ))
@@ -0,0 +1,225 @@
+# cSpell:disable
+import os
+import asyncio
+import logging
+
+from telegram import Bot
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+
+from admin_notifier import TokenBucket, retry_after_seconds
+from metrics import BROADCAST_MESSAGES, RATE_LIMITED
+from registration_store import (
+    BLOCKED, CANCELLED, DONE, FAILED, QUEUED, RUNNING, SENT, UNKNOWN, RegistrationStore,
+)
+from replica_lease import REPLICA_ID, Lease, hold_lease
+
+log = logging.getLogger("broadcast")
+
+# حد تيليغرام ~30 رسالة/ثانية للبوت كله؛ نترك مجال لردود البوت العادية
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE_PER_SECOND", "20"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_CHUNK = 200
+MAX_ATTEMPTS = 5
+# كل قديش النسخ اللي ما معها الـ lease بتشيّك إذا في بث لازم حدا يبعته
+BROADCAST_POLL_SECONDS = float(os.getenv("BROADCAST_POLL_SECONDS", "10"))
+LEASE_NAME = "broadcast"
+
+
+def format_progress(broadcast_id: int, progress: dict[str, int], status: str) -> str:
+    labels = (
+        (SENT, "✅ وصلت"), (BLOCKED, "🚫 حاظرين البوت"), (FAILED, "❌ فشلت"),
+        (UNKNOWN, "❔ غير مؤكدة"), (QUEUED, "⏸ ما انبعتت"),
+    )
+    lines = [f"📣 البث #{broadcast_id} ({status})"]
+    lines += [f"{label}: {progress[key]}" for key, label in labels if progress.get(key)]
+    return "\n".join(lines)
+
+
+class Broadcaster:
+    """Sends copies of an admin's message to every student matching a
+    broadcast's filters, one message per chat.
+
+    Only the replica holding the shared "broadcast" lease sends, one
+    broadcast at a time, so the bot never runs two senders against
+    Telegram's limit. Every replica polls for RUNNING broadcasts and tries
+    to take the lease; whoever gets it first marks recipients left pending
+    by an earlier holder unknown and sends until nothing is RUNNING.
+
+    Recipients are claimed from the store BROADCAST_CHUNK at a time and sent
+    by BROADCAST_WORKERS workers sharing one token bucket. A 429 pauses
+    the whole bucket for its retry_after. Claimed recipients are stored
+    as pending before anything is sent. A graceful stop puts the ones not
+    yet attempted back as queued; anything else still pending after an
+    interruption is marked unknown rather than sent again, so delivery is
+    at most once."""
+
+    def __init__(
+        self,
+        store: RegistrationStore,
+        bot: Bot,
+        rate_per_second: float = BROADCAST_RATE,
+        workers: int = BROADCAST_WORKERS,
+        poll_seconds: float = BROADCAST_POLL_SECONDS,
+        owner: str = REPLICA_ID,
+    ):
+        self.store = store
+        self.bot = bot
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.owner = owner
+        self.bucket = TokenBucket(rate_per_second, max(1, int(rate_per_second)))
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+        self._loop_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        # البث اللي انقطع بإعادة التشغيل بيكمل من الـ cursor تبعه
+        if self._loop_task is None:
+            self._loop_task = asyncio.get_running_loop().create_task(self._loop())
+
+    def wake(self) -> None:
+        """Look for RUNNING broadcasts now instead of at the next poll."""
+        self._wake.set()
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        cancelled = await self.store.set_broadcast_status(broadcast_id, CANCELLED, (RUNNING,))
+        # إذا كان عم ينبعت من نسخة ثانية، بتوقف لما تشوف الحالة بعد الدفعة
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if cancelled:
+            await self.store.abandon_pending_deliveries(broadcast_id)
+        return cancelled
+
+    async def stop(self) -> None:
+        # الحالة بتضل RUNNING والـ lease بيتحرر، فأي نسخة بتكمّل من الـ cursor
+        if self._loop_task is None:
+            return
+        self._loop_task.cancel()
+        await asyncio.gather(self._loop_task, return_exceptions=True)
+        self._loop_task = None
+
+    async def _loop(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                if await self.store.broadcasts_with_status(RUNNING):
+                    await self._send_running()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Broadcast loop failed; retrying in %.0fs", self.poll_seconds)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_running(self) -> None:
+        async with hold_lease(self.store, LEASE_NAME, owner=self.owner) as lease:
+            if not lease.held:
+                return
+            running = await self.store.broadcasts_with_status(RUNNING)
+            # ما حدا غيرنا عم يبعت، فاللي لسا pending انقطع عند اللي كان معه الـ lease
+            for broadcast_id in running:
+                abandoned = await self.store.abandon_pending_deliveries(broadcast_id)
+                if abandoned:
+                    log.info("Broadcast %d: %d in-flight deliveries marked unknown", broadcast_id, abandoned)
+            tried: set[int] = set()
+            while not lease.lost:
+                todo = [b for b in await self.store.broadcasts_with_status(RUNNING) if b not in tried]
+                if not todo:
+                    return
+                broadcast_id = todo[0]
+                tried.add(broadcast_id)
+                task = asyncio.get_running_loop().create_task(self._run(broadcast_id, lease))
+                self._tasks[broadcast_id] = task
+                try:
+                    # cancel() بيوقف هالبث لحاله؛ إيقاف الـ loop بيوقفه كمان
+                    await asyncio.gather(task, return_exceptions=True)
+                finally:
+                    self._tasks.pop(broadcast_id, None)
+
+    async def _send(self, from_chat_id: int, message_id: int, user_id: int) -> tuple[str, str | None]:
+        for attempt in range(MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.copy_message(chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
+                return SENT, None
+            except RetryAfter as e:
+                RATE_LIMITED.labels("telegram").inc()
+                delay = retry_after_seconds(e)
+                log.warning("Broadcast rate limited, pausing %.0fs", delay)
+                self.bucket.pause(delay)
+            except Forbidden as e:
+                # حاظر البوت أو الحساب محذوف
+                return BLOCKED, str(e)
+            except TimedOut as e:
+                # ممكن تكون وصلت؛ ما نعيد حتى ما تنبعت مرتين
+                return UNKNOWN, str(e)
+            except NetworkError as e:
+                log.warning("Broadcast to %s failed (%s), retrying", user_id, e)
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                return FAILED, str(e)
+        return FAILED, f"gave up after {MAX_ATTEMPTS} attempts"
+
+    async def _send_chunk(self, broadcast: dict, users: list[int]) -> list[tuple[int, str, str | None]]:
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for user_id in users:
+            queue.put_nowait(user_id)
+        results = []
+        in_flight: set[int] = set()
+
+        async def worker():
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                in_flight.add(user_id)
+                status, error = await self._send(broadcast["from_chat_id"], broadcast["message_id"], user_id)
+                in_flight.discard(user_id)
+                BROADCAST_MESSAGES.labels(status).inc()
+                results.append((user_id, status, error))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(users)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+            # انقطعنا بالنص: اللي كان عم ينبعت مش مضمون، والباقي يرجع للدور
+            results += [(user_id, UNKNOWN, "interrupted") for user_id in in_flight]
+            while not queue.empty():
+                results.append((queue.get_nowait(), QUEUED, None))
+            if results:
+                await asyncio.shield(self.store.record_broadcast_deliveries(broadcast["id"], results))
+        return results
+
+    async def _run(self, broadcast_id: int, lease: Lease) -> None:
+        broadcast = await self.store.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast["status"] != RUNNING:
+            return
+        try:
+            while True:
+                users = await self.store.claim_broadcast_recipients(broadcast_id, broadcast["filters"], BROADCAST_CHUNK)
+                if not users:
+                    break
+                await self._send_chunk(broadcast, users)
+                if lease.lost:
+                    log.warning("Broadcast %d paused: lease lost to another replica", broadcast_id)
+                    return
+                # ممكن ينلغى من نسخة ثانية
+                if (await self.store.get_broadcast(broadcast_id))["status"] != RUNNING:
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Broadcast %d stopped; it resumes on the next poll", broadcast_id)
+            return
+        if not await self.store.set_broadcast_status(broadcast_id, DONE, (RUNNING,)):
+            return
+        progress = await self.store.broadcast_progress(broadcast_id)
+        log.info("Broadcast %d done: %s", broadcast_id, progress)
+        try:
+            await self.bot.send_message(broadcast["created_by"], format_progress(broadcast_id, progress, "انتهى"))
+        except TelegramError as e:
+            log.warning("Failed to report broadcast %d: %s", broadcast_id, e)
@@ -1,12 +1,10 @@
 # cSpell:disable
 
 import os
-import sqlite3
 import logging
-from datetime import datetime
 import asyncio
-import gspread
-from google.oauth2.service_account import Credentials
+import tempfile
+from functools import lru_cache
 
 from telegram import (
     Update,
@@ -14,6 +12,7 @@ from telegram import (
     InlineKeyboardMarkup,
 )
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -22,7 +21,24 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
+from telegram.request import BaseRequest
 from dotenv import load_dotenv
+
+from sheets_writer import get_sheet_writer
+from sheets_client import get_sheet_client
+from sheet_reconcile import SheetReconciler
+from bot_host import BotSpec, run_bots
+from outbox import OutboxDrainer, get_outbox
+from registration_store import (
+    CREATED, DRAFT, FULL, RUNNING, CANCELLED, UNCHANGED, open_registration_store, registration_sheet_row,
+)
+from broadcast import Broadcaster, format_progress
+from registration_export import FORMATS, ExportFilters, export_errors, export_registrations
+from track_catalog import Track, load_catalog
+from sqlite_persistence import SQLitePersistence
+from update_processor import update_processor
+from metrics import HANDLER_SECONDS, OUTCOMES, timed
+
 load_dotenv()
 
 logging.basicConfig(
@@ -30,7 +46,14 @@ logging.basicConfig(
     level=logging.INFO,
 )
 log = logging.getLogger("contest-bot")
+BOT_NAME = "registration"
 DB_PATH = "registrations.sqlite3"
+# postgres://... لقاعدة مشتركة بين أكثر من نسخة (ديسك Render بينمسح مع كل deploy)؛ بدونه SQLite محلي
+DATABASE_URL = os.getenv("DATABASE_URL") or DB_PATH
+
+# أوامر الإدارة (/export و /stats و /reconcile و /broadcast) مسموحة بس لهدول، مثلاً ADMIN_USER_IDS=123,456
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip()}
+ADMIN_ONLY = filters.User(user_id=ADMIN_USER_IDS)
 
 
 TRACKS_MATRIX = {
@@ -81,7 +104,6 @@ TRACKS_MATRIX = {
 NAME, USER, GENDER, GRADE, TRACK, OPTION, CONFIRM = range(7)
 
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SPREADSHEET_ID = "1di3hHm23biLNOuM8dMmn9Bv_oS0VVsRWfuNh-_XlgZs"
 WORKSHEET_NAME = "Sheet1"
 
@@ -92,35 +114,62 @@ if not CREDS_FILE:
     CREDS_FILE = local if os.path.exists(local) else "/etc/secrets/gcp_service_account.json"
 
 
-def _append_row_blocking(values: list[str]):
-    creds = Credentials.from_service_account_file(CREDS_FILE, scopes=SCOPES)
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(WORKSHEET_NAME)
-    ws.append_row(values)
+OUTBOX = get_outbox()
 
-async def append_row_async(values: list[str]):
-    await asyncio.to_thread(_append_row_blocking, values)
+# الصف ينحفظ محلياً أولاً، والـ drainer يرفعه للشيت بالخلفية. sheet_pending بالقاعدة المشتركة
+# بيخبّر المطابقة (من أي نسخة) إنو الصف بالطريق، فما تضيفه مرة ثانية
+async def enqueue_sheet_row(key: str, reg_id: int, values: list[str]):
+    await STORE.mark_sheet_pending(key, reg_id)
+    await OUTBOX.enqueue(SPREADSHEET_ID, WORKSHEET_NAME, key, values)
 
 GENDERS = {
     "m": "ذكر",
     "f": "أنثى",
 }
 
-def gender_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("ذكر", callback_data="gender:m")],
-        [InlineKeyboardButton("أنثى", callback_data="gender:f")],
-        [InlineKeyboardButton("إلغاء", callback_data="cancel")],
-    ])
-
 GRADES = {
     "g1":"الصف الأول","g2":"الصف الثاني","g3":"الصف الثالث",
     "g4":"الصف الرابع","g5":"الصف الخامس","g6":"الصف السادس",
     "g7":"الصف السابع","g8":"الصف الثامن","g9":"الصف التاسع",
 }
 
-def grades_keyboard():
+GRADE_TO_GROUP = {
+    "g1":"grp_1_3","g2":"grp_1_3","g3":"grp_1_3",
+    "g4":"grp_4_6","g5":"grp_4_6","g6":"grp_4_6",
+    "g7":"grp_7_9","g8":"grp_7_9","g9":"grp_7_9",
+}
+
+# TRACKS_MATRIX هو الافتراضي؛ TRACKS_FILE (JSON/YAML) يبدّله بدون تعديل الكود.
+# حدود المقاعد: "capacity" بالمسابقة/الخيار بالـ matrix، أو TRACK_CAPACITIES فوقه، مثلاً
+# TRACK_CAPACITIES=m46_t2=40,f46_t2=40,m46_t2:o3=10 ؛ بدونها كل المسابقات بلا حد
+CATALOG = load_catalog(TRACKS_MATRIX)
+# بتنفحص بنفس transaction التسجيل
+STORE = open_registration_store(DATABASE_URL, capacities=CATALOG.capacities())
+log.info("Seat limits: %s", CATALOG.capacities() or "none (set TRACK_CAPACITIES)")
+
+def user_group(context: ContextTypes.DEFAULT_TYPE) -> tuple[str | None, str | None]:
+    gender_key = context.user_data.get("gender_key")   # "m" / "f"
+    grade_key  = context.user_data.get("grade_key")    # "g1".."g9"
+    return gender_key, GRADE_TO_GROUP.get(grade_key)
+
+def get_tracks_for_user(context: ContextTypes.DEFAULT_TYPE) -> tuple[Track, ...]:
+    return CATALOG.for_group(*user_group(context))
+
+def track_for_user(track: Track | None, context: ContextTypes.DEFAULT_TYPE) -> Track | None:
+    if track is not None and (track.gender, track.group) == user_group(context):
+        return track
+    return None
+
+# ---- بناء القوائم (مرة وحدة عند الإقلاع) ----
+
+def _build_gender_keyboard():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("ذكر", callback_data="gender:m")],
+        [InlineKeyboardButton("أنثى", callback_data="gender:f")],
+        [InlineKeyboardButton("إلغاء", callback_data="cancel")],
+    ])
+
+def _build_grades_keyboard():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton(GRADES["g1"], callback_data="grade:g1"),
             InlineKeyboardButton(GRADES["g2"], callback_data="grade:g2"),
@@ -134,130 +183,85 @@ def grades_keyboard():
         [InlineKeyboardButton("إلغاء", callback_data="cancel")],
     ])
 
-GRADE_TO_GROUP = {
-    "g1":"grp_1_3","g2":"grp_1_3","g3":"grp_1_3",
-    "g4":"grp_4_6","g5":"grp_4_6","g6":"grp_4_6",
-    "g7":"grp_7_9","g8":"grp_7_9","g9":"grp_7_9",
-}
-
-def get_tracks_for_user(context: ContextTypes.DEFAULT_TYPE) -> dict:
-    gender_key = context.user_data.get("gender_key")   # "m" / "f"
-    grade_key  = context.user_data.get("grade_key")    # "g1".."g9"
-    group_key  = GRADE_TO_GROUP.get(grade_key)
-    return TRACKS_MATRIX.get(gender_key, {}).get(group_key, {})
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS registrations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tg_user_id INTEGER NOT NULL,
-            tg_username TEXT,
-            full_name TEXT NOT NULL,
-            gender TEXT,
-            grade TEXT,
-            track_key TEXT NOT NULL,
-            track_title TEXT NOT NULL,
-            option_key TEXT,
-            option_title TEXT,
-            created_at TEXT NOT NULL
-        )
-        """
-    )
-
-    cur.execute("PRAGMA table_info(registrations)")
-    cols = {row[1] for row in cur.fetchall()}
-    if "grade" not in cols:
-        cur.execute("ALTER TABLE registrations ADD COLUMN grade TEXT")
-    if "gender" not in cols:
-        cur.execute("ALTER TABLE registrations ADD COLUMN gender TEXT")
-
-    conn.commit()
-    conn.close()
-
-
-
-def insert_registration(
-    user_id: int,
-    username: str | None,
-    full_name: str,
-    gender: str,
-    grade: str,
-    track_key: str,
-    track_title: str,
-    option_key: str | None,
-    option_title: str | None,
-) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO registrations (
-            tg_user_id, tg_username, full_name, gender, grade,
-            track_key, track_title, option_key, option_title, created_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            user_id,
-            username,
-            full_name,
-            gender,
-            grade,
-            track_key,
-            track_title,
-            option_key,
-            option_title,
-            datetime.utcnow().isoformat(),
-        ),
-    )
-    reg_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return reg_id
-
-
-def get_registration(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, full_name, gender, grade, track_title, option_title, created_at
-        FROM registrations
-        WHERE tg_user_id = ?
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+FULL_MARK = "🔒 "
+FULL_SUFFIX = " (اكتمل العدد)"
 
+def _full_title(title: str) -> str:
+    return f"{FULL_MARK}{title}{FULL_SUFFIX}"
 
-def tracks_keyboard_for(context):
-    tracks = get_tracks_for_user(context)
-    rows = [[InlineKeyboardButton(v["title"], callback_data=f"track:{k}")] for k, v in tracks.items()]
+def _build_tracks_keyboard(tracks: tuple[Track, ...], full_keys: frozenset[str] = frozenset()):
+    rows = [
+        [InlineKeyboardButton(_full_title(t.title) if t.key in full_keys else t.title, callback_data=t.callback_data)]
+        for t in tracks
+    ]
     rows.append([InlineKeyboardButton("إلغاء", callback_data="cancel")])
     return InlineKeyboardMarkup(rows)
 
-def options_keyboard(track_key: str, context):
-    tracks = get_tracks_for_user(context)
-    opts = tracks[track_key]["options"]
-    rows = [[InlineKeyboardButton(title, callback_data=f"opt:{track_key}:{ok}")] for ok, title in opts.items()]
+def _build_options_keyboard(track: Track, full_keys: frozenset[str] = frozenset()):
+    rows = [
+        [InlineKeyboardButton(_full_title(o.title) if o.key in full_keys else o.title, callback_data=o.callback_data)]
+        for o in track.options
+    ]
     rows.append([InlineKeyboardButton("رجوع للمسابقات", callback_data="back_to_tracks")])
     rows.append([InlineKeyboardButton("إلغاء", callback_data="cancel")])
     return InlineKeyboardMarkup(rows)
 
-
-def confirm_keyboard():
+def _build_confirm_keyboard(label: str = "✅ تأكيد التسجيل"):
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ تأكيد التسجيل", callback_data="confirm")],
+        [InlineKeyboardButton(label, callback_data="confirm")],
         [InlineKeyboardButton("🔁 تعديل", callback_data="edit")],
         [InlineKeyboardButton("إلغاء", callback_data="cancel")],
     ])
 
+# InlineKeyboardMarkup غير قابل للتعديل، فنفس الكائن ينرسل لكل المستخدمين
+GENDER_KEYBOARD = _build_gender_keyboard()
+GRADES_KEYBOARD = _build_grades_keyboard()
+CONFIRM_KEYBOARD = _build_confirm_keyboard()
+UPDATE_CONFIRM_KEYBOARD = _build_confirm_keyboard("🔄 تحديث تسجيلي")
+EMPTY_TRACKS_KEYBOARD = _build_tracks_keyboard(())
+
+# (gender_key, group_key) -> قائمة المسابقات
+TRACKS_KEYBOARDS = {group: _build_tracks_keyboard(tracks) for group, tracks in CATALOG.by_group.items()}
+
+# track_key -> قائمة الخيارات
+OPTIONS_KEYBOARDS = {t.key: _build_options_keyboard(t) for t in CATALOG.tracks if t.options}
+
+def gender_keyboard():
+    return GENDER_KEYBOARD
+
+def grades_keyboard():
+    return GRADES_KEYBOARD
+
+def track_is_full(track: Track) -> bool:
+    # مسابقة بلا حد عام بتكمل إذا كل خياراتها المحدودة كملت
+    if STORE.is_full(track.key):
+        return True
+    return bool(track.options) and all(STORE.is_full(track.key, o.key) for o in track.options)
+
+# القوائم مع علامة "اكتمل العدد" تنبنى مرة لكل حالة امتلاء (STORE.full بيتبدل بس لما شي يكمل)
+@lru_cache(maxsize=256)
+def _marked_tracks_keyboard(group: tuple[str | None, str | None], full: frozenset):
+    tracks = CATALOG.for_group(*group)
+    return _build_tracks_keyboard(tracks, frozenset(t.key for t in tracks if track_is_full(t)))
+
+@lru_cache(maxsize=256)
+def _marked_options_keyboard(track_key: str, full: frozenset):
+    track = CATALOG.by_key[track_key]
+    return _build_options_keyboard(track, frozenset(o.key for o in track.options if STORE.is_full(track.key, o.key)))
+
+def tracks_keyboard_for(context):
+    group = user_group(context)
+    if not STORE.full or group not in TRACKS_KEYBOARDS:
+        return TRACKS_KEYBOARDS.get(group, EMPTY_TRACKS_KEYBOARD)
+    return _marked_tracks_keyboard(group, STORE.full)
+
+def options_keyboard(track_key: str, context):
+    if not STORE.full:
+        return OPTIONS_KEYBOARDS[track_key]
+    return _marked_options_keyboard(track_key, STORE.full)
+
+def confirm_keyboard(already_registered: bool = False):
+    return UPDATE_CONFIRM_KEYBOARD if already_registered else CONFIRM_KEYBOARD
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("حياك الله عزيزي الطالب! اكتب اسمك الكامل للتسجيل في المسابقة:")
@@ -325,21 +329,22 @@ async def track_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("تم الإلغاء.")
         return ConversationHandler.END
 
-    if not q.data.startswith("track:"):
+    track = track_for_user(CATALOG.track_from_callback(q.data), context)
+    if track is None:
+        await q.edit_message_text("اختيار غير صحيح. اختر:", reply_markup=tracks_keyboard_for(context))
         return TRACK
 
-    tracks = get_tracks_for_user(context)
-
-    track_key = q.data.split("track:", 1)[1]
-    if track_key not in tracks:
-        await q.edit_message_text("اختيار غير صحيح. اختر:", reply_markup=tracks_keyboard_for(context))
+    # المسجّل من قبل بيقدر يعدّل تسجيله حتى لو المسابقة كملت
+    if track_is_full(track) and not STORE.is_registered(q.from_user.id, track.key):
+        await q.edit_message_text("😔 هالمسابقة اكتمل عددها. اختر غيرها:", reply_markup=tracks_keyboard_for(context))
         return TRACK
 
-    context.user_data["track_key"] = track_key
+    context.user_data["track_key"] = track.key
+    context.user_data.pop("option_key", None)
 
     # إذا المسار فيه خيارات → نعرض submenu
-    if tracks[track_key]["options"]:
-        await q.edit_message_text("اختر أحد الخيارات:", reply_markup=options_keyboard(track_key, context))
+    if track.options:
+        await q.edit_message_text("اختر أحد الخيارات:", reply_markup=options_keyboard(track.key, context))
         return OPTION
 
     return await show_summary(q, context)
@@ -353,41 +358,48 @@ async def option_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("تم الإلغاء.")
         return ConversationHandler.END
 
-    tracks = get_tracks_for_user(context)
     if q.data == "back_to_tracks":
         await q.edit_message_text("اختر المسابقة:", reply_markup=tracks_keyboard_for(context))
         return TRACK
 
-    if not q.data.startswith("opt:"):
-        return OPTION
+    track, option = CATALOG.option_from_callback(q.data)
+    if track_for_user(track, context) is None:
+        await q.edit_message_text("اختيار غير صحيح. اختر:", reply_markup=tracks_keyboard_for(context))
+        return TRACK
 
-    _, track_key, opt_key = q.data.split(":", 2)
-    if track_key not in tracks or opt_key not in tracks[track_key]["options"]:
-        await q.edit_message_text("خيار غير صحيح. اختر:", reply_markup=options_keyboard(track_key, context))
+    if STORE.is_full(track.key, option.key) and not STORE.is_registered(q.from_user.id, track.key):
+        await q.edit_message_text(
+            "😔 هالخيار اكتمل عدده. اختر خيار ثاني:", reply_markup=options_keyboard(track.key, context)
+        )
         return OPTION
 
-    context.user_data["track_key"] = track_key
-    context.user_data["option_key"] = opt_key
+    context.user_data["track_key"] = track.key
+    context.user_data["option_key"] = option.key
     return await show_summary(q, context)
 
 
 async def show_summary(q, context: ContextTypes.DEFAULT_TYPE):
-    tracks = get_tracks_for_user(context)
     full_name = context.user_data.get("full_name")
     gender = context.user_data.get("gender","")
     grade  = context.user_data.get("grade","")
-    track_key = context.user_data.get("track_key")
-    option_key = context.user_data.get("option_key")
-    track_title = tracks[track_key]["title"]
-    option_title = tracks[track_key]["options"].get(option_key) if option_key else None
+    track = CATALOG.by_key[context.user_data.get("track_key")]
+    option = track.options_by_key.get(context.user_data.get("option_key"))
+    track_title = track.title
+    option_title = option.title if option else None
 
 
     txt = f"راجع معلوماتك:\n\n👤 الاسم: {full_name}\n⚧ الجنس: {gender}\n🏫 الصف: {grade}\n🏆 المسابقة: {track_title}"
     if option_title:
         txt += f"\n🎯 المستوى/الخيار: {option_title}"
-    txt += "\n\nتأكيد التسجيل؟"
 
-    await q.edit_message_text(txt, reply_markup=confirm_keyboard())
+    # فحص بالذاكرة، بدون query
+    already_registered = STORE.is_registered(q.from_user.id, track.key)
+    if already_registered:
+        txt += "\n\n⚠️ أنت مسجّل بهالمسابقة من قبل. بدك تحدّث تسجيلك بهالمعلومات؟"
+    else:
+        txt += "\n\nتأكيد التسجيل؟"
+
+    await q.edit_message_text(txt, reply_markup=confirm_keyboard(already_registered))
     return CONFIRM
 
 
@@ -396,10 +408,12 @@ async def confirm_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     if q.data == "cancel":
+        OUTCOMES.labels(BOT_NAME, "cancelled").inc()
         await q.edit_message_text("تم الإلغاء.")
         return ConversationHandler.END
 
     if q.data == "edit":
+        OUTCOMES.labels(BOT_NAME, "edited").inc()
         context.user_data.pop("track_key", None)
         context.user_data.pop("option_key", None)
         await q.edit_message_text("اختر المسابقة:", reply_markup=tracks_keyboard_for(context))
@@ -412,14 +426,14 @@ async def confirm_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     full_name = context.user_data["full_name"]
     gender = context.user_data.get("gender", "")
     grade = context.user_data.get("grade", "")
-    track_key = context.user_data["track_key"]
-    option_key = context.user_data.get("option_key")
-
-    tracks = get_tracks_for_user(context)
-    track_title = tracks[track_key]["title"]
-    option_title = tracks[track_key]["options"].get(option_key) if option_key else ""
-
-    reg_id = insert_registration(
+    track = CATALOG.by_key[context.user_data["track_key"]]
+    option = track.options_by_key.get(context.user_data.get("option_key"))
+    track_key = track.key
+    option_key = option.key if option else None
+    track_title = track.title
+    option_title = option.title if option else ""
+
+    reg_id, status = await STORE.upsert(
         user_id=user.id,
         username=user.username,
         full_name=full_name,
@@ -430,22 +444,30 @@ async def confirm_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         option_key=option_key,
         option_title=option_title,
     )
-    tracks = get_tracks_for_user(context)
-    track_title = tracks[track_key]["title"]
-    option_title = tracks[track_key]["options"].get(option_key) if option_key else ""
-    grade = context.user_data.get("grade", "")
-    
-    await append_row_async([
-    str(reg_id),  
-    user.username or "",
-    full_name,
-    gender,
-    grade,
-    track_title,
-    option_title, 
-    ])
+    OUTCOMES.labels(BOT_NAME, "registered" if status == CREATED else status).inc()
+    if status == FULL:
+        # آخر مقعد راح لغيرك بين عرض الملخص والتأكيد
+        context.user_data.pop("track_key", None)
+        context.user_data.pop("option_key", None)
+        await q.edit_message_text(
+            "😔 للأسف اكتمل العدد بهالمسابقة/الخيار قبل تأكيدك. اختر مسابقة ثانية:",
+            reply_markup=tracks_keyboard_for(context),
+        )
+        return TRACK
+    if status == UNCHANGED:
+        # ضغطة تأكيد ثانية / نفس المعلومات: ولا صف جديد بالقاعدة ولا بالشيت
+        await q.edit_message_text(f"✅ أنت مسجّل مسبقاً بـ {track_title} بنفس المعلومات.")
+        return ConversationHandler.END
+
+    # التحديث ينضاف كصف جديد بنفس reg_id (آخر صف هو المعتمد)؛ q.id يخلي المفتاح ثابت لو انعاد التحديث
+    await enqueue_sheet_row(
+        f"reg:{reg_id}" if status == CREATED else f"reg:{reg_id}:upd:{q.id}",
+        reg_id,
+        registration_sheet_row(reg_id, user.username, full_name, gender, grade, track_title, option_title),
+    )
+    header = "✅ تم تسجيلك بنجاح!" if status == CREATED else "✅ تم تحديث تسجيلك!"
     txt = (
-    f"✅ تم تسجيلك بنجاح!\n\n"
+    f"{header}\n\n"
     
     f"👤 الاسم: {full_name}\n"
     f"🏫 الصف: {grade}\n"
@@ -457,73 +479,329 @@ async def confirm_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
-async def my_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    row = get_registration(update.effective_user.id)
-    if not row:
-        await update.message.reply_text("ما عندك تسجيل حالياً. اكتب /start للتسجيل.")
-        return
-    
+MY_PAGE_SIZE = 5
+
+def _format_registration(row) -> str:
     reg_id, full_name, gender, grade, track_title, option_title, created_at = row
-    msg = f"آخر تسجيل لك:\n\n🆔 {reg_id}\n👤 {full_name}\n⚧ {gender}\n🏫 {grade}\n🏆 {track_title}"
+    msg = f"🆔 {reg_id}\n👤 {full_name}\n⚧ {gender}\n🏫 {grade}\n🏆 {track_title}"
     if option_title:
         msg += f"\n🎯 {option_title}"
     msg += f"\n🕒 {created_at} (UTC)"
-    await update.message.reply_text(msg)
+    return msg
+
+async def _my_page(user_id: int, before_id: int | None = None):
+    rows, next_before_id = await STORE.history_for_user(user_id, before_id, MY_PAGE_SIZE)
+    if not rows:
+        return None, None
+
+    header = "آخر تسجيل لك:" if before_id is None and next_before_id is None and len(rows) == 1 else "تسجيلاتك:"
+    msg = header + "\n\n" + "\n\n".join(_format_registration(row) for row in rows)
+    markup = None
+    if next_before_id is not None:
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("المزيد ⬇️", callback_data=f"my:{next_before_id}")]])
+    return msg, markup
+
+async def my_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg, markup = await _my_page(update.effective_user.id)
+    if not msg:
+        await update.message.reply_text("ما عندك تسجيل حالياً. اكتب /start للتسجيل.")
+        return
+    await update.message.reply_text(msg, reply_markup=markup)
+
+async def my_registration_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    before_id = int(q.data.split("my:", 1)[1])
+    msg, markup = await _my_page(q.from_user.id, before_id)
+    if msg:
+        await q.edit_message_text(msg, reply_markup=markup)
+
+# حد رفع الملفات للبوت 50MB
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+EXPORT_USAGE = (
+    "الاستخدام: /export [csv|xlsx|parquet] [gender=m|f] [grade=g1..g9] [track=<track_key>] "
+    "[from=YYYY-MM-DD] [to=YYYY-MM-DD]"
+)
+
+def _parse_export_args(args: list[str]) -> tuple[str, ExportFilters] | None:
+    fmt = "csv"
+    rest = []
+    for arg in args:
+        if arg.lower() in FORMATS:
+            fmt = arg.lower()
+        else:
+            rest.append(arg)
+    export_filters = _parse_filter_args(rest)
+    return None if export_filters is None else (fmt, export_filters)
+
+def _parse_filter_args(args: list[str]) -> ExportFilters | None:
+    opts = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or key not in ("gender", "grade", "track", "from", "to"):
+            return None
+        opts[key] = value
+    if opts.get("gender") and opts["gender"] not in GENDERS:
+        return None
+    if opts.get("grade") and opts["grade"] not in GRADES:
+        return None
+    if opts.get("track") and opts["track"] not in CATALOG.by_key:
+        return None
+    return ExportFilters(
+        # بالقاعدة الجنس والصف محفوظين بالاسم العربي
+        gender=GENDERS.get(opts.get("gender")),
+        grade=GRADES.get(opts.get("grade")),
+        track_key=opts.get("track"),
+        since=opts.get("from"),
+        until=opts.get("to"),
+    )
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    parsed = _parse_export_args(context.args or [])
+    if parsed is None:
+        await update.message.reply_text(EXPORT_USAGE)
+        return
+    fmt, export_filters = parsed
+
+    path = None
+    try:
+        fd, path = tempfile.mkstemp(prefix="registrations-", suffix=f".{fmt}")
+        os.close(fd)
+        count = await asyncio.to_thread(export_registrations, DATABASE_URL, path, fmt, export_filters)
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            await update.message.reply_text(
+                f"الملف ({count} صف) أكبر من حد تيليغرام. جرّب parquet أو فلتر أضيق، أو cli.py export على السيرفر."
+            )
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"registrations.{fmt}",
+                caption=f"عدد التسجيلات: {count}",
+                read_timeout=120,
+                write_timeout=120,
+            )
+    except export_errors() as e:
+        log.exception("Export failed")
+        await update.message.reply_text(f"ما قدرت أصدّر: {e}")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+BROADCASTER_KEY = "broadcaster"
+BROADCAST_USAGE = (
+    "الاستخدام: ردّ على الرسالة اللي بدك تبعتها بـ /broadcast [gender=m|f] [grade=g1..g9] "
+    "[track=<track_key>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"
+)
+
+def _broadcast_keyboard(broadcast_id: int, status: str):
+    if status == DRAFT:
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton("📣 ابعت", callback_data=f"bc:go:{broadcast_id}"),
+            InlineKeyboardButton("إلغاء", callback_data=f"bc:drop:{broadcast_id}"),
+        ]])
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⏹ وقّف البث", callback_data=f"bc:stop:{broadcast_id}")]])
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    m = update.message
+    if m.reply_to_message is None:
+        lines = [BROADCAST_USAGE]
+        # ممكن يكون عم ينبعت من نسخة ثانية
+        for broadcast_id in await STORE.broadcasts_with_status(RUNNING):
+            progress = await STORE.broadcast_progress(broadcast_id)
+            lines.append(format_progress(broadcast_id, progress, "شغّال"))
+        await m.reply_text("\n\n".join(lines))
+        return
+
+    recipients = _parse_filter_args(context.args or [])
+    if recipients is None:
+        await m.reply_text(BROADCAST_USAGE)
+        return
+    count = await STORE.count_broadcast_recipients(recipients)
+    if not count:
+        await m.reply_text("ما في طلاب بهالفلتر.")
+        return
+    # مسودة أول؛ ما في إرسال قبل ضغطة التأكيد
+    broadcast_id = await STORE.create_broadcast(m.chat_id, m.reply_to_message.message_id, recipients, m.from_user.id)
+    await m.reply_text(
+        f"📣 البث #{broadcast_id}: الرسالة رح توصل لـ {count} طالب. أكيد؟",
+        reply_markup=_broadcast_keyboard(broadcast_id, DRAFT),
+    )
+
+async def broadcast_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if q.from_user.id not in ADMIN_USER_IDS:
+        await q.answer("للإدارة فقط", show_alert=True)
+        return
+    await q.answer()
+    _, action, broadcast_id = q.data.split(":")
+    broadcast_id = int(broadcast_id)
+    broadcaster: Broadcaster = context.application.bot_data[BROADCASTER_KEY]
+
+    if action == "go":
+        if not await STORE.set_broadcast_status(broadcast_id, RUNNING, (DRAFT,)):
+            await q.edit_message_text(f"البث #{broadcast_id} انبعت أو انلغى من قبل.")
+            return
+        broadcaster.wake()
+        await q.edit_message_text(
+            f"📣 بدأ البث #{broadcast_id}. رح يوصلك ملخّص لما يخلص.",
+            reply_markup=_broadcast_keyboard(broadcast_id, RUNNING),
+        )
+    elif action == "drop":
+        await STORE.set_broadcast_status(broadcast_id, CANCELLED, (DRAFT,))
+        await q.edit_message_text(f"انلغى البث #{broadcast_id}.")
+    elif action == "stop":
+        stopped = await broadcaster.cancel(broadcast_id)
+        progress = await STORE.broadcast_progress(broadcast_id)
+        await q.edit_message_text(format_progress(broadcast_id, progress, "توقّف" if stopped else "انتهى"))
+
+def _format_stats(counts) -> str:
+    total = 0
+    by_gender: dict[str, int] = {}
+    by_grade: dict[str, int] = {}
+    by_track: dict[str, int] = {}
+    by_option: dict[tuple[str, str], int] = {}
+    for gender, grade, track_key, option_key, n in counts:
+        total += n
+        by_gender[gender] = by_gender.get(gender, 0) + n
+        by_grade[grade] = by_grade.get(grade, 0) + n
+        by_track[track_key] = by_track.get(track_key, 0) + n
+        if option_key:
+            by_option[(track_key, option_key)] = by_option.get((track_key, option_key), 0) + n
+
+    lines = [f"📊 عدد التسجيلات: {total}", "", "⚧ حسب الجنس:"]
+    lines += [f"• {label}: {by_gender[label]}" for label in GENDERS.values() if label in by_gender]
+    lines += ["", "🏫 حسب الصف:"]
+    lines += [f"• {label}: {by_grade[label]}" for label in GRADES.values() if label in by_grade]
+    lines += ["", "🏆 حسب المسابقة:"]
+    for track in CATALOG.tracks:
+        if track.key not in by_track:
+            continue
+        lines.append(f"• {track.title} ({GENDERS.get(track.gender, track.gender)}): {by_track[track.key]}")
+        for option in track.options:
+            n = by_option.get((track.key, option.key))
+            if n:
+                lines.append(f"   ◦ {option.title}: {n}")
+    return "\n".join(lines)
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # العدّادات من جدول registration_counts ومحفوظة بالذاكرة لحد أول تسجيل جديد
+    await update.message.reply_text(_format_stats(await STORE.counts()))
+
+async def reconcile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("🔎 جاري مطابقة الشيت...")
+    try:
+        report = await context.application.bot_data["reconciler"].run_once()
+    except Exception as e:
+        log.exception("Manual reconciliation failed")
+        await update.message.reply_text(f"فشلت المطابقة: {e}")
+        return
+    await update.message.reply_text(report.summary())
 
 async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("تم الإلغاء.")
     return ConversationHandler.END
 
+def _timed(handler):
+    return timed(HANDLER_SECONDS.labels(BOT_NAME, handler.__name__), handler)
+
 conv = ConversationHandler(
-    entry_points=[CommandHandler("start", start)],
+    entry_points=[CommandHandler("start", _timed(start))],
     states={
-        NAME:   [MessageHandler(filters.TEXT & ~filters.COMMAND, name_step)],
-        GENDER: [CallbackQueryHandler(gender_step)],
-        GRADE:  [CallbackQueryHandler(grade_step)],
-        TRACK:  [CallbackQueryHandler(track_step)],
-        OPTION: [CallbackQueryHandler(option_step)],
-        CONFIRM:[CallbackQueryHandler(confirm_step)],
+        NAME:   [MessageHandler(filters.TEXT & ~filters.COMMAND, _timed(name_step))],
+        GENDER: [CallbackQueryHandler(_timed(gender_step))],
+        GRADE:  [CallbackQueryHandler(_timed(grade_step))],
+        TRACK:  [CallbackQueryHandler(_timed(track_step))],
+        OPTION: [CallbackQueryHandler(_timed(option_step))],
+        CONFIRM:[CallbackQueryHandler(_timed(confirm_step))],
     },
     fallbacks=[CommandHandler("cancel", cancel_cmd)],
     allow_reentry=True,
+    # الحالة والـ user_data محفوظين، فالطالب يكمل من نفس الخطوة بعد إعادة التشغيل
+    name="registration",
+    persistent=True,
 )
 
-def main():
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        raise RuntimeError("Missing BOT_TOKEN env var")
-
-    init_db()
-    app = ApplicationBuilder().token(token).build()
+async def on_startup(app):
+    await STORE.init()
+    await OUTBOX.init()
+    # صفوف كانت بالـ outbox قبل ما يصير في sheet_pending (أو قبل ما تنسجل فيه)
+    for key in await OUTBOX.pending_keys(SPREADSHEET_ID, WORKSHEET_NAME, "reg:"):
+        await STORE.mark_sheet_pending(key, int(key.split(":")[1]))
+    drainer = OutboxDrainer(
+        OUTBOX, get_sheet_writer(CREDS_FILE, SPREADSHEET_ID), SPREADSHEET_ID, WORKSHEET_NAME,
+        on_sent=STORE.clear_sheet_pending,
+    )
+    drainer.start()
+    app.bot_data["outbox_drainer"] = drainer
+    # كل RECONCILE_INTERVAL_MINUTES: الصفوف اللي ما وصلت للشيت تنضاف من جديد
+    reconciler = SheetReconciler(STORE, get_sheet_client(CREDS_FILE, SPREADSHEET_ID), SPREADSHEET_ID, WORKSHEET_NAME)
+    reconciler.start()
+    app.bot_data["reconciler"] = reconciler
+    # البث بينبعت من نسخة وحدة بس، اللي معها الـ lease
+    broadcaster = Broadcaster(STORE, app.bot)
+    app.bot_data[BROADCASTER_KEY] = broadcaster
+    broadcaster.start()
+
+async def on_stop(app):
+    # قبل ما يتسكّر الـ HTTP client
+    broadcaster = app.bot_data.pop(BROADCASTER_KEY, None)
+    if broadcaster:
+        await broadcaster.stop()
+
+async def on_shutdown(app):
+    reconciler = app.bot_data.pop("reconciler", None)
+    if reconciler:
+        await reconciler.stop()
+    drainer = app.bot_data.pop("outbox_drainer", None)
+    if drainer:
+        await drainer.stop()
+    await STORE.close()
+
+def build_application(token: str, request: BaseRequest | None = None) -> Application:
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .persistence(SQLitePersistence("registration"))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    processor = update_processor()
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    app = builder.build()
 
     # handlers...
+    # صفحات /my قبل الـ conv حتى ما تلتقطها CallbackQueryHandler تبع الخطوات
+    app.add_handler(CallbackQueryHandler(_timed(my_registration_page), pattern=r"^my:\d+$"))
+    app.add_handler(CallbackQueryHandler(broadcast_button, pattern=r"^bc:(go|drop|stop):\d+$"))
     app.add_handler(conv)
-    app.add_handler(CommandHandler("my", my_registration))
-    
-    render_url = os.getenv("RENDER_EXTERNAL_URL")  # Render بيعطيك رابط الخدمة تلقائياً
-    if render_url:
-        port = int(os.getenv("PORT", "10000"))  # لازم تسمع على PORT في Render
-        render_url = render_url.rstrip("/")
-
-        # سرّ للحماية (Telegram رح يبعت هالسر بالهيدر)
-        secret_token = os.getenv("WEBHOOK_SECRET_TOKEN", "CHANGE_ME")
+    app.add_handler(CommandHandler("my", _timed(my_registration)))
+    app.add_handler(CommandHandler("export", export_cmd, filters=ADMIN_ONLY))
+    app.add_handler(CommandHandler("stats", stats_cmd, filters=ADMIN_ONLY))
+    app.add_handler(CommandHandler("reconcile", reconcile_cmd, filters=ADMIN_ONLY))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd, filters=ADMIN_ONLY))
+    return app
 
-        # مسار webhook (خليه صعب التخمين)
-        webhook_path = os.getenv("WEBHOOK_PATH", "tg-webhook")
-
-        webhook_url = f"{render_url}/{webhook_path}"
-
-        log.info("Bot webhook URL: %s", webhook_url)
+def main():
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("Missing BOT_TOKEN env var")
 
-        app.run_webhook(
-            listen="0.0.0.0",
-            port=port,
-            url_path=webhook_path,
-            webhook_url=webhook_url,
-            secret_token=secret_token,
+    run_bots([
+        BotSpec(
+            name=BOT_NAME,
+            build=build_application,
+            token=token,
+            # مسار webhook (خليه صعب التخمين)
+            webhook_path=os.getenv("WEBHOOK_PATH", "tg-webhook"),
+            # سرّ للحماية (Telegram رح يبعت هالسر بالهيدر)
+            secret_token=os.getenv("WEBHOOK_SECRET_TOKEN", "CHANGE_ME"),
         )
-    else:
-        app.run_polling()
+    ])
 
 
 
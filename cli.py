@@ -0,0 +1,119 @@
+# cSpell:disable
+"""Offline admin commands that work on the local databases.
+
+    python cli.py export --format csv --out registrations.csv --track-key m46_t2 --since 2026-01-01
+    python cli.py reconcile --creds gcp_service_account.json
+    python cli.py media <file_id from the sheet row> [...]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+from registration_export import FORMATS, ExportFilters, export_registrations
+
+DB_PATH = "registrations.sqlite3"
+SPREADSHEET_ID = "1di3hHm23biLNOuM8dMmn9Bv_oS0VVsRWfuNh-_XlgZs"
+WORKSHEET_NAME = "Sheet1"
+
+
+def cmd_export(args) -> int:
+    filters = ExportFilters(
+        gender=args.gender,
+        grade=args.grade,
+        track_key=args.track_key,
+        since=args.since,
+        until=args.until,
+    )
+    out = args.out or f"registrations.{args.format}"
+    started = time.perf_counter()
+    count = export_registrations(args.db, out, args.format, filters)
+    print(f"exported {count} rows to {out} in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+async def _reconcile(args):
+    # استيراد متأخر: export ما بيحتاج مكتبات جوجل
+    from registration_store import open_registration_store
+    from sheet_reconcile import SheetReconciler
+    from sheets_client import get_sheet_client
+
+    store = open_registration_store(args.db)
+    await store.init()
+    try:
+        reconciler = SheetReconciler(
+            store, get_sheet_client(args.creds, args.spreadsheet_id), args.spreadsheet_id, args.worksheet
+        )
+        return await reconciler.run_once()
+    finally:
+        await store.close()
+
+
+def cmd_reconcile(args) -> int:
+    report = asyncio.run(_reconcile(args))
+    print(report.summary())
+    return 0 if report.clean else 1
+
+
+async def _media(args):
+    # استيراد متأخر: بيحتاج telegram و httpx
+    from media_archive import get_media_archive
+
+    archive = get_media_archive(args.archive_db)
+    try:
+        return await archive.locate(args.file_ids)
+    finally:
+        await archive.close()
+
+
+def cmd_media(args) -> int:
+    rows = asyncio.run(_media(args))
+    for file_id, msg_key, status, path, size, error in rows:
+        detail = f"{path}\t{size} bytes" if status == "done" else (error or "")
+        print(f"{file_id}\t{msg_key}\t{status}\t{detail}")
+    missing = [file_id for file_id in args.file_ids if file_id not in {row[0] for row in rows}]
+    for file_id in missing:
+        print(f"{file_id}\t-\tnot archived")
+    return 1 if missing else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    logging.basicConfig(
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="Giras bot admin commands")
+    parser.add_argument(
+        "--db", default=os.getenv("DATABASE_URL") or DB_PATH, help="registrations SQLite file or postgres:// URL"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="dump registrations to CSV/XLSX/Parquet")
+    export.add_argument("--format", choices=FORMATS, default="csv")
+    export.add_argument("--out", help="output file (default registrations.<format>)")
+    export.add_argument("--gender", help="stored gender label, e.g. ذكر")
+    export.add_argument("--grade", help="stored grade label, e.g. الصف الخامس")
+    export.add_argument("--track-key")
+    export.add_argument("--since", help="ISO date/datetime, inclusive")
+    export.add_argument("--until", help="ISO date/datetime, exclusive")
+    export.set_defaults(func=cmd_export)
+
+    reconcile = sub.add_parser("reconcile", help="diff the registrations sheet against the database and fix gaps")
+    reconcile.add_argument("--creds", default=os.getenv("CREDS_FILE", "gcp_service_account.json"))
+    reconcile.add_argument("--spreadsheet-id", default=os.getenv("SPREADSHEET_ID", SPREADSHEET_ID))
+    reconcile.add_argument("--worksheet", default=WORKSHEET_NAME)
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    media = sub.add_parser("media", help="show where the files of a submission row were archived")
+    media.add_argument("file_ids", nargs="+", help="file_id(s) from the submission's sheet row")
+    media.add_argument("--archive-db", default=os.getenv("MEDIA_ARCHIVE_DB_PATH", "media_archive.sqlite3"))
+    media.set_defaults(func=cmd_media)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+# cSpell:disable
+import os
+import logging
+from dataclasses import dataclass, replace
+from datetime import datetime
+
+from telegram import Message, Update, User
+from telegram.ext import (
+    Application,
+    ApplicationBuilder,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+    ContextTypes,
+    filters,
+)
+from telegram.request import BaseRequest
+
+from sheets_writer import get_sheet_writer
+from admin_notifier import AdminNotifier
+from album_collector import AlbumCollector
+from flood_control import FloodGuard, flood_filter
+from media_archive import MEDIA_ARCHIVE_DIR, MediaArchiver, get_media_archive, media_ref
+from outbox import OutboxDrainer, get_outbox
+from sqlite_persistence import SQLitePersistence
+from update_processor import update_processor
+from metrics import HANDLER_SECONDS, OUTCOMES, timed
+
+log = logging.getLogger("replies-bot")
+
+SPREADSHEET_ID = os.getenv("SPREADSHEET_ID", "1di3hHm23biLNOuM8dMmn9Bv_oS0VVsRWfuNh-_XlgZs")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CREDS_FILE = os.getenv("CREDS_FILE")
+if not CREDS_FILE:
+    local = os.path.join(BASE_DIR, "gcp_service_account.json")
+    CREDS_FILE = local if os.path.exists(local) else "/etc/secrets/gcp_service_account.json"
+
+CONFIG_KEY = "contribution_config"
+NOTIFIER_KEY = "admin_notifier"
+ARCHIVER_KEY = "media_archiver"
+ALBUMS_KEY = "album_collector"
+
+OUTBOX = get_outbox()
+
+
+@dataclass(frozen=True)
+class ContributionBotConfig:
+    """Everything that differs between the contribution bots."""
+
+    name: str                   # namespace للـ persistence واللوغ
+    worksheet_name: str
+    admin_chat_id: str
+    greeting: str
+    name_ack: str               # فيه {student_name}
+    include_telegram_name: bool = True
+    spreadsheet_id: str = SPREADSHEET_ID
+
+
+def env_config(config: ContributionBotConfig, prefix: str = "") -> ContributionBotConfig:
+    """Override the sheet/admin settings from <prefix>WORKSHEET_NAME etc."""
+    return replace(
+        config,
+        worksheet_name=os.getenv(f"{prefix}WORKSHEET_NAME", config.worksheet_name),
+        admin_chat_id=os.getenv(f"{prefix}ADMIN_CHAT_ID", config.admin_chat_id),  # ضع chat id للمسؤول هنا عبر env
+        spreadsheet_id=os.getenv(f"{prefix}SPREADSHEET_ID", config.spreadsheet_id),
+    )
+
+def _message_type(m: Message | None) -> str:
+    if not m:
+        return "unknown"
+    if m.text:
+        return "text"
+    if m.photo:
+        return "photo"
+    if m.document:
+        return "document"
+    if m.voice:
+        return "voice"
+    if m.audio:
+        return "audio"
+    if m.video:
+        return "video"
+    if m.video_note:
+        return "video_note"
+    if m.sticker:
+        return "sticker"
+    if m.contact:
+        return "contact"
+    if m.location:
+        return "location"
+    return "other"
+
+def _extract_content(m: Message | None) -> tuple[str, str]:
+    if not m:
+        return ("", "")
+
+    if m.text:
+        return (m.text, "")
+
+    caption = m.caption or ""
+
+    if m.photo:
+        return (caption, m.photo[-1].file_id)
+
+    if m.document:
+        return (caption, m.document.file_id)
+    if m.voice:
+        return (caption, m.voice.file_id)
+    if m.audio:
+        return (caption, m.audio.file_id)
+    if m.video:
+        return (caption, m.video.file_id)
+    if m.video_note:
+        return (caption, m.video_note.file_id)
+    if m.sticker:
+        return (caption, m.sticker.file_id)
+
+    return (caption, "")
+
+def _clip(s: str, limit: int = 15000) -> str:
+    s = s or ""
+    return s if len(s) <= limit else (s[:limit] + "…")
+
+def _config(context: ContextTypes.DEFAULT_TYPE) -> ContributionBotConfig:
+    return context.application.bot_data[CONFIG_KEY]
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["awaiting_name"] = True
+    await update.message.reply_text(_config(context).greeting)
+
+async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # يفيدك لتجيب ADMIN_CHAT_ID
+    await update.message.reply_text(f"chat_id: {update.effective_chat.id}\nuser_id: {update.effective_user.id}")
+
+async def handle_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    m = update.effective_message
+    user = update.effective_user
+    chat = update.effective_chat
+    if not m or not user or not chat:
+        return
+
+    if chat.type != "private":
+        return
+    config = _config(context)
+    # 1) إذا لسه ما سجل الاسم: خذ الرسالة كنص اسم
+    if context.user_data.get("awaiting_name") or not context.user_data.get("student_name"):
+        if not m.text:
+            OUTCOMES.labels(config.name, "name_rejected").inc()
+            await m.reply_text("لو سمحت ابعت اسمك كنص (مو ملف/صورة).")
+            return
+
+        student_name = (m.text or "").strip()
+        if len(student_name) < 3:
+            OUTCOMES.labels(config.name, "name_rejected").inc()
+            await m.reply_text("الاسم قصير. اكتب اسمك الكامل مرة ثانية:")
+            return
+
+        context.user_data["student_name"] = student_name
+        context.user_data["awaiting_name"] = False
+        OUTCOMES.labels(config.name, "name_set").inc()
+        await m.reply_text(config.name_ack.format(student_name=student_name))
+        return
+
+    # 2) إذا الاسم موجود → اعتبر الرسالة مشاركة
+    student_name = context.user_data.get("student_name", "")
+    app = context.application
+
+    # أجزاء الألبوم توصل كرسائل منفصلة؛ نجمعها ونسجلها كمشاركة وحدة
+    if m.media_group_id:
+        app.bot_data[ALBUMS_KEY].add(
+            m, lambda messages: _submit(app, config, user, chat.id, student_name, messages)
+        )
+        return
+
+    await _submit(app, config, user, chat.id, student_name, [m])
+
+
+async def _submit(
+    app: Application,
+    config: ContributionBotConfig,
+    user: User,
+    chat_id: int,
+    student_name: str,
+    messages: list[Message],
+) -> None:
+    """Queue one sheet row and one admin notice for a submission, then
+    confirm to the student. An album arrives here as all its messages."""
+    m = messages[0]
+    if len(messages) == 1:
+        msg_type = _message_type(m)
+        content, file_id = _extract_content(m)
+        msg_key = f"msg:{chat_id}:{m.message_id}"
+    else:
+        parts = [_extract_content(x) for x in messages]
+        types = dict.fromkeys(_message_type(x) for x in messages)
+        msg_type = f"album:{'+'.join(types)} ({len(messages)})"
+        content = "\n".join(c for c, _ in parts if c)
+        file_id = "\n".join(f for _, f in parts if f)
+        # أول message_id بالمفتاح: إذا وصل جزء متأخر (بعد الـ debounce أو restart) بينسجل كصف ثاني بدل ما ينرمى
+        msg_key = f"album:{chat_id}:{m.media_group_id}:{m.message_id}"
+    ts = datetime.utcnow().isoformat()
+
+    # سجل بالشيت (أضفت عمود للاسم الذي أدخله المستخدم)
+    row = [
+        ts,                      # الوقت UTC
+        str(user.id),            # user_id
+        user.username or "",     # username
+        user.full_name or "",    # اسم تيليغرام
+        student_name,            # الاسم الذي أدخله المستخدم ✅
+        msg_type,                # نوع الرسالة
+        _clip(content),          # النص/الكابشن
+        file_id or "",           # file_id للمرفقات (سطر لكل ملف بالألبوم)
+    ]
+    if not config.include_telegram_name:
+        del row[3]
+
+    try:
+        added = await OUTBOX.enqueue(config.spreadsheet_id, config.worksheet_name, msg_key, row)
+    except Exception:
+        log.exception("Failed to queue submission for the sheet")
+        OUTCOMES.labels(config.name, "sheet_error").inc()
+        await m.reply_text("وصلتني مشاركتك ✅ بس صار خطأ بالتخزين على الشيت. بلغ الإدارة.")
+        return
+
+    if not added:
+        # نفس الرسالة انعالجت قبل (redelivery)؛ الصف موجود والإدارة وصلها الإشعار
+        log.info("Submission %s already queued, not notifying admins again", msg_key)
+        OUTCOMES.labels(config.name, "duplicate").inc()
+    elif config.admin_chat_id:
+        # إرسال للمسؤول + فورورد الرسالة كما هي — بالطابور، فالطالب ما ينتظر
+        try:
+            admin_id = int(config.admin_chat_id)
+
+            # رسالة ملخّص (مثل ما هي) + إضافة الاسم
+            app.bot_data[NOTIFIER_KEY].notify(
+                admin_id,
+                (
+                    f"📩 مشاركة جديدة\n"
+                    f"👤 {user.full_name} (@{user.username or '-'})\n"
+                    f"🧾 الاسم المُدخل: {student_name}\n"   # ✅ الإضافة المطلوبة
+                    f"🧾 النوع: {msg_type}\n"
+                    f"🕒 {ts} UTC\n"
+                    f"✍️ {(_clip(content, 2000) or '[بدون نص]')}"
+                ),
+                # Forward للرسائل الأصلية (كما هي) — الألبوم كله بطلب واحد
+                from_chat_id=chat_id,
+                message_ids=tuple(x.message_id for x in messages),
+            )
+        except Exception as e:
+            log.warning("Failed to notify admin: %s", e)
+
+    if added:
+        OUTCOMES.labels(config.name, "submitted").inc()
+    await m.reply_text("تم استلام مشروعك بنجاح ✅")
+
+    # الملفات تنزل بالخلفية بعد الرد؛ المسار والحجم يتسجلوا بـ media_archive بمفتاح صف الشيت
+    # (وللألبوم: مفتاح الصف + رقم الجزء)، ومن file_id بالشيت: python cli.py media <file_id>
+    archiver = app.bot_data.get(ARCHIVER_KEY)
+    if archiver:
+        for i, x in enumerate(messages):
+            ref = media_ref(x)
+            if not ref:
+                continue
+            key = msg_key if len(messages) == 1 else f"{msg_key}:{i}"
+            try:
+                await archiver.submit(key, user.id, ref)
+            except Exception:
+                log.exception("Failed to queue %s for archiving", key)
+
+
+async def on_startup(app):
+    config: ContributionBotConfig = app.bot_data[CONFIG_KEY]
+    if not config.spreadsheet_id:
+        raise RuntimeError("Missing SPREADSHEET_ID env var")
+
+    await OUTBOX.init()
+    drainer = OutboxDrainer(
+        OUTBOX,
+        get_sheet_writer(CREDS_FILE, config.spreadsheet_id),
+        config.spreadsheet_id,
+        config.worksheet_name,
+    )
+    drainer.start()
+    app.bot_data["outbox_drainer"] = drainer
+    app.bot_data[NOTIFIER_KEY] = AdminNotifier(app.bot)
+    app.bot_data[ALBUMS_KEY] = AlbumCollector()
+
+    if MEDIA_ARCHIVE_DIR:
+        archive = get_media_archive()
+        await archive.init()
+        archiver = MediaArchiver(archive, app.bot, config.name, MEDIA_ARCHIVE_DIR)
+        await archiver.start()
+        app.bot_data[ARCHIVER_KEY] = archiver
+
+async def on_stop(app):
+    # قبل ما يتسكّر الـ HTTP client: نحاول نوصّل اللي بالطابور
+    albums = app.bot_data.pop(ALBUMS_KEY, None)
+    if albums:
+        await albums.flush()
+    notifier = app.bot_data.pop(NOTIFIER_KEY, None)
+    if notifier:
+        await notifier.stop()
+    archiver = app.bot_data.pop(ARCHIVER_KEY, None)
+    if archiver:
+        await archiver.stop()
+
+async def on_shutdown(app):
+    drainer = app.bot_data.pop("outbox_drainer", None)
+    if drainer:
+        await drainer.stop()
+
+
+def build_application(config: ContributionBotConfig, token: str, request: BaseRequest | None = None) -> Application:
+    # awaiting_name / student_name تبقى بعد إعادة التشغيل
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .persistence(SQLitePersistence(config.name))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    processor = update_processor()
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    app = builder.build()
+    app.bot_data[CONFIG_KEY] = config
+
+    # قبل أي handler: الرسائل الزايدة والستيكرات ما توصل للشيت ولا للإدارة
+    app.add_handler(TypeHandler(Update, flood_filter(FloodGuard(), config.name, _message_type)), group=-1)
+    app.add_handler(CommandHandler("start", timed(HANDLER_SECONDS.labels(config.name, "start"), start)))
+    app.add_handler(CommandHandler("id", get_id))
+    app.add_handler(MessageHandler(
+        filters.ALL & ~filters.COMMAND,
+        timed(HANDLER_SECONDS.labels(config.name, "handle_reply"), handle_reply),
+    ))
+    return app
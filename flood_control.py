@@ -0,0 +1,196 @@
+# cSpell:disable
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from telegram import Message, Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from metrics import OUTCOMES
+
+log = logging.getLogger("flood-control")
+
+FLOOD_WINDOW = float(os.getenv("FLOOD_WINDOW_SECONDS", "10"))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "5"))
+# بعد هالمدة بدون رسائل ننسى المستخدم
+FLOOD_IDLE = float(os.getenv("FLOOD_IDLE_SECONDS", "600"))
+FLOOD_MAX_USERS = 100_000
+# أنواع ما بنقبلها كمشاركة (أسماء _message_type)
+REJECTED_TYPES = frozenset(
+    t.strip() for t in os.getenv("FLOOD_REJECT_TYPES", "sticker,location,contact").split(",") if t.strip()
+)
+# أنواع بتنضم بدل ما تنرمى: آخر رسالة زايدة من المستخدم بتنحفظ وبتتعالج لما يصير في مجال.
+# الباقي (صور، ملفات...) بينرمى: كل وحدة مشاركة مستقلة وما منعرف أي وحدة هي "الأخيرة" المقصودة
+COALESCED_TYPES = frozenset(
+    t.strip() for t in os.getenv("FLOOD_COALESCE_TYPES", "text").split(",") if t.strip()
+)
+
+# الرد للمستخدم مرة وحدة بكل نافذة، الباقي ينرمى بصمت
+FLOOD_WARNING = "⏳ عم تبعت بسرعة كتير. استنى شوي وبعدين ابعت مشاركتك."
+REJECTED_WARNING = "هالنوع من الرسائل ما بينقبل كمشاركة. ابعت نص أو صورة أو ملف أو تسجيل صوتي."
+
+
+class _Window:
+    """Sliding-window counter: the previous and current fixed windows,
+    weighted by how much of the previous one still overlaps."""
+
+    __slots__ = ("start", "prev", "curr", "last_seen", "last_group", "warned")
+
+    def __init__(self, now: float):
+        self.start = now
+        self.prev = 0
+        self.curr = 0
+        self.last_seen = now
+        self.last_group: str | None = None
+        self.warned = -1.0
+
+
+class FloodGuard:
+    """Per-user rate limit plus a message-type policy, checked before any
+    handler that touches the sheet or the admin chat.
+
+    Over the limit, messages of `coalesced_types` are coalesced (the
+    latest one per user is held and replayed by flood_filter once
+    retry_in() allows it); other types are dropped.
+
+    Memory is one small _Window per user seen in the last `idle` seconds;
+    the dict is kept in last-seen order so eviction pops from the front."""
+
+    def __init__(
+        self,
+        window: float = FLOOD_WINDOW,
+        burst: int = FLOOD_BURST,
+        idle: float = FLOOD_IDLE,
+        rejected_types: frozenset[str] = REJECTED_TYPES,
+        max_users: int = FLOOD_MAX_USERS,
+        coalesced_types: frozenset[str] = COALESCED_TYPES,
+    ):
+        self.window = window
+        self.burst = burst
+        self.idle = max(idle, window * 2)
+        self.rejected_types = rejected_types
+        self.coalesced_types = coalesced_types
+        self.max_users = max_users
+        self._users: OrderedDict[int, _Window] = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        users = self._users
+        while users:
+            user_id, w = next(iter(users.items()))
+            # قبل ما ينضاف الجديد: نترك محل إله
+            if now - w.last_seen < self.idle and len(users) < self.max_users:
+                break
+            del users[user_id]
+
+    def _entry(self, user_id: int, now: float) -> _Window:
+        w = self._users.get(user_id)
+        if w is None:
+            w = self._users[user_id] = _Window(now)
+        else:
+            self._users.move_to_end(user_id)
+        elapsed = now - w.start
+        if elapsed >= self.window:
+            # نافذة أو أكثر مرقت: الحالية بتصير السابقة (أو صفر إذا مرق أكثر من نافذتين)
+            w.prev = w.curr if elapsed < 2 * self.window else 0
+            w.curr = 0
+            w.start = now - (elapsed % self.window)
+        w.last_seen = now
+        return w
+
+    def allow(self, user_id: int, media_group_id: str | None = None, now: float | None = None) -> bool:
+        """Count one message; False when it is over the limit. Parts of the
+        same album count once."""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        w = self._entry(user_id, now)
+        if media_group_id is not None:
+            if media_group_id == w.last_group:
+                return True
+            w.last_group = media_group_id
+        overlap = 1.0 - (now - w.start) / self.window
+        if w.prev * overlap + w.curr >= self.burst:
+            return False
+        w.curr += 1
+        return True
+
+    def retry_in(self, user_id: int, now: float | None = None) -> float:
+        """Seconds until allow() would let the user's next message through."""
+        now = time.monotonic() if now is None else now
+        w = self._users.get(user_id)
+        if w is None:
+            return 0.0
+        elapsed = now - w.start
+        if elapsed >= self.window:
+            return 0.0
+        room = self.burst - w.curr
+        if room > 0:
+            # بس لازم يقل وزن النافذة السابقة
+            return 0.0 if w.prev == 0 else max(0.0, self.window * (1 - room / w.prev) - elapsed)
+        # بعد ما تبلش نافذة جديدة، الحالية بتصير السابقة ووزنها بينقص
+        return self.window - elapsed + self.window * (1 - self.burst / w.curr)
+
+    def should_warn(self, user_id: int, now: float | None = None) -> bool:
+        """True at most once per window per user."""
+        now = time.monotonic() if now is None else now
+        w = self._users.get(user_id)
+        if w is None or now - w.warned < self.window:
+            return False
+        w.warned = now
+        return True
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+def flood_filter(guard: FloodGuard, bot_name: str, message_type):
+    """Build a TypeHandler callback for group -1: raises ApplicationHandlerStop
+    for updates that must not reach the real handlers. `message_type` maps a
+    Message to the names used in REJECTED_TYPES/COALESCED_TYPES.
+
+    A held (coalesced) update is put back on the application's update_queue
+    when the user has room again, and goes through this check once more."""
+    # user_id -> آخر update زايد ناطر دوره؛ وحدة بس لكل مستخدم
+    held: dict[int, Update] = {}
+
+    def replay(user_id: int, application) -> None:
+        update = held.pop(user_id, None)
+        if update is not None:
+            application.update_queue.put_nowait(update)
+
+    def hold(user_id: int, update: Update, application) -> None:
+        if user_id in held:
+            # في وحدة أقدم ناطرة: الأحدث بتاخذ مكانها، والتوقيت نفسه
+            OUTCOMES.labels(bot_name, "flood_dropped").inc()
+        else:
+            delay = guard.retry_in(user_id) + 0.05
+            asyncio.get_running_loop().call_later(delay, replay, user_id, application)
+        held[user_id] = update
+        OUTCOMES.labels(bot_name, "flood_coalesced").inc()
+
+    async def check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        m: Message | None = update.effective_message
+        user = update.effective_user
+        chat = update.effective_chat
+        if not m or not user or not chat or chat.type != "private":
+            return
+
+        is_command = bool(m.text and m.text.startswith("/"))
+        kind = message_type(m)
+        if not guard.allow(user.id, m.media_group_id):
+            if not is_command and kind in guard.coalesced_types:
+                hold(user.id, update, context.application)
+            else:
+                OUTCOMES.labels(bot_name, "flood_dropped").inc()
+            if guard.should_warn(user.id):
+                await m.reply_text(FLOOD_WARNING)
+            raise ApplicationHandlerStop
+
+        if not is_command and kind in guard.rejected_types:
+            OUTCOMES.labels(bot_name, "type_rejected").inc()
+            if guard.should_warn(user.id):
+                await m.reply_text(REJECTED_WARNING)
+            raise ApplicationHandlerStop
+
+    return check
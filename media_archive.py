@@ -0,0 +1,419 @@
+# cSpell:disable
+import os
+import uuid
+import random
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from telegram import Bot, Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from admin_notifier import retry_after_seconds
+from sqlite_db import SQLiteDatabase
+from metrics import MEDIA_ARCHIVED, MEDIA_ARCHIVED_BYTES
+
+log = logging.getLogger("media-archive")
+
+# بدون MEDIA_ARCHIVE_DIR الأرشفة مطفية
+MEDIA_ARCHIVE_DIR = os.getenv("MEDIA_ARCHIVE_DIR")
+MEDIA_ARCHIVE_DB_PATH = os.getenv("MEDIA_ARCHIVE_DB_PATH", "media_archive.sqlite3")
+MEDIA_ARCHIVE_CONCURRENCY = int(os.getenv("MEDIA_ARCHIVE_CONCURRENCY", "4"))
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_EXTENSIONS = {
+    "photo": ".jpg",
+    "voice": ".ogg",
+    "audio": ".mp3",
+    "video": ".mp4",
+    "video_note": ".mp4",
+    "document": "",
+}
+
+
+class MediaRef(NamedTuple):
+    kind: str
+    file_id: str
+    file_unique_id: str
+    file_name: str | None = None
+
+
+def media_ref(m: Message) -> MediaRef | None:
+    if m.photo:
+        p = m.photo[-1]
+        return MediaRef("photo", p.file_id, p.file_unique_id)
+    for kind in ("document", "video", "audio", "voice", "video_note"):
+        media = getattr(m, kind)
+        if media:
+            return MediaRef(kind, media.file_id, media.file_unique_id, getattr(media, "file_name", None))
+    return None
+
+
+class DownloadFailed(Exception):
+    """The file server answered with a non-200 status."""
+
+    def __init__(self, status: int):
+        # رابط الملف فيه الـ token، فما نحطه بالرسالة
+        super().__init__(f"file download returned HTTP {status}")
+        self.status = status
+
+
+def is_transient(e: BaseException) -> bool:
+    """Whether archiving may succeed if tried again later: network trouble,
+    Telegram flood control, or a 5xx/429 from the file server. Anything
+    else (e.g. BadRequest "file is too big" from getFile) won't change."""
+    if isinstance(e, BadRequest):
+        # BadRequest صنف من NetworkError بـ PTB
+        return False
+    if isinstance(e, (NetworkError, RetryAfter, httpx.TransportError)):
+        return True
+    return isinstance(e, DownloadFailed) and (e.status >= 500 or e.status == 429)
+
+
+class ArchiveJob(NamedTuple):
+    msg_key: str
+    user_id: int
+    kind: str
+    file_id: str
+    file_unique_id: str
+    file_name: str | None
+    attempts: int
+
+
+class MediaArchive(SQLiteDatabase):
+    """Index of archived submission files, keyed by the same msg key as the
+    submission's outbox row (plus ":<part index>" for each file of an
+    album). Rows start as 'pending' and are filled in with
+    the local path, size and sha256 once the download finishes.
+
+    The sheet row itself isn't rewritten (it may be appended long before
+    the download ends); its file_id column is the link, see locate()."""
+
+    def __init__(self, db_path: str = MEDIA_ARCHIVE_DB_PATH):
+        super().__init__(db_path, name="media-archive-db")
+
+    @staticmethod
+    def _init(conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_archive (
+                msg_key TEXT PRIMARY KEY,
+                bot_name TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT NOT NULL,
+                file_name TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                path TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                created_at TEXT NOT NULL,
+                archived_at TEXT
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_media_archive_unique ON media_archive (file_unique_id) WHERE status = 'done'"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_media_archive_sha ON media_archive (sha256) WHERE status = 'done'"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_media_archive_pending ON media_archive (bot_name) WHERE status = 'pending'"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_archive_file_id ON media_archive (file_id)")
+        conn.commit()
+
+    async def init(self) -> None:
+        await self.run(self._init)
+
+    @staticmethod
+    def _add(conn, bot_name, msg_key, user_id, ref: MediaRef) -> bool:
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO media_archive
+                (msg_key, bot_name, user_id, kind, file_id, file_unique_id, file_name, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (msg_key, bot_name, user_id, ref.kind, ref.file_id, ref.file_unique_id, ref.file_name,
+             datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+
+    @staticmethod
+    def _pending(conn, bot_name):
+        rows = conn.execute(
+            """
+            SELECT msg_key, user_id, kind, file_id, file_unique_id, file_name, attempts
+            FROM media_archive WHERE bot_name = ? AND status = 'pending'
+            """,
+            (bot_name,),
+        ).fetchall()
+        return [ArchiveJob(*row) for row in rows]
+
+    @staticmethod
+    def _find(conn, column, value):
+        # column ثابت من الكود (file_unique_id / sha256)، مش من المستخدم
+        return conn.execute(
+            f"SELECT path, size, sha256 FROM media_archive WHERE {column} = ? AND status = 'done' LIMIT 1",
+            (value,),
+        ).fetchone()
+
+    @staticmethod
+    def _locate(conn, file_ids):
+        marks = ",".join("?" * len(file_ids))
+        return conn.execute(
+            f"""
+            SELECT file_id, msg_key, status, path, size, last_error
+            FROM media_archive WHERE file_id IN ({marks}) ORDER BY msg_key
+            """,
+            file_ids,
+        ).fetchall()
+
+    @staticmethod
+    def _mark_done(conn, msg_key, path, size, sha256):
+        conn.execute(
+            """
+            UPDATE media_archive SET status = 'done', path = ?, size = ?, sha256 = ?, last_error = NULL,
+                archived_at = ?
+            WHERE msg_key = ?
+            """,
+            (path, size, sha256, datetime.utcnow().isoformat(), msg_key),
+        )
+        conn.commit()
+
+    @staticmethod
+    def _mark_failed(conn, msg_key, error, give_up):
+        conn.execute(
+            "UPDATE media_archive SET attempts = attempts + 1, last_error = ?, status = ? WHERE msg_key = ?",
+            (error, "failed" if give_up else "pending", msg_key),
+        )
+        conn.commit()
+
+    async def add(self, bot_name: str, msg_key: str, user_id: int, ref: MediaRef) -> bool:
+        return await self.run(self._add, bot_name, msg_key, user_id, ref)
+
+    async def pending(self, bot_name: str) -> list[ArchiveJob]:
+        return await self.run(self._pending, bot_name)
+
+    async def find_by_unique_id(self, file_unique_id: str):
+        return await self.run(self._find, "file_unique_id", file_unique_id)
+
+    async def find_by_sha256(self, sha256: str):
+        return await self.run(self._find, "sha256", sha256)
+
+    async def locate(self, file_ids: list[str]) -> list[tuple]:
+        """(file_id, msg_key, status, path, size, last_error) for the file
+        ids in a submission's sheet row."""
+        if not file_ids:
+            return []
+        return await self.run(self._locate, list(file_ids))
+
+    async def mark_done(self, msg_key: str, path: str, size: int, sha256: str) -> None:
+        await self.run(self._mark_done, msg_key, path, size, sha256)
+
+    async def mark_failed(self, msg_key: str, error: str, give_up: bool) -> None:
+        await self.run(self._mark_failed, msg_key, error, give_up)
+
+
+def _link(src: str, dest: str) -> str:
+    """Hard-link `src` to `dest` and return the path to record; falls back to
+    `src` itself when linking isn't possible (e.g. another filesystem)."""
+    if os.path.exists(dest):
+        return dest
+    try:
+        os.link(src, dest)
+        return dest
+    except OSError:
+        return src
+
+
+class MediaArchiver:
+    """Downloads one bot's submission files to <root>/<bot>/<user_id>/ with a
+    fixed number of workers. Files are streamed to disk in CHUNK_SIZE pieces
+    and named by their sha256, so a re-sent file is stored once; a
+    file_unique_id that is already archived isn't downloaded again at all.
+
+    Disk writes and hashing run on a thread pool of the same size, never on
+    the event loop. Only transient failures (see is_transient) are retried
+    with backoff; anything else marks the file failed right away."""
+
+    def __init__(
+        self,
+        archive: MediaArchive,
+        bot: Bot,
+        bot_name: str,
+        root: str,
+        concurrency: int = MEDIA_ARCHIVE_CONCURRENCY,
+        max_attempts: int = 5,
+    ):
+        self.archive = archive
+        self.bot = bot
+        self.bot_name = bot_name
+        self.root = os.path.join(root, bot_name)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue[ArchiveJob] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._retries: set[asyncio.TimerHandle] = set()
+        self._http: httpx.AsyncClient | None = None
+        self._io = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"media-archive-{bot_name}")
+
+    async def submit(self, msg_key: str, user_id: int, ref: MediaRef) -> None:
+        if await self.archive.add(self.bot_name, msg_key, user_id, ref):
+            self._queue.put_nowait(ArchiveJob(msg_key, user_id, ref.kind, ref.file_id, ref.file_unique_id, ref.file_name, 0))
+
+    async def start(self) -> None:
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, read=120.0),
+            limits=httpx.Limits(max_connections=self.concurrency),
+        )
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        # اللي ما خلص قبل آخر إيقاف
+        for job in await self.archive.pending(self.bot_name):
+            self._queue.put_nowait(job)
+
+    async def stop(self) -> None:
+        # الشغل الناقص يبقى pending بالقاعدة ويكمل بعد الإقلاع
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self._io.shutdown(wait=False)
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._archive(job)
+            except Exception as e:
+                transient = is_transient(e)
+                give_up = not transient or job.attempts + 1 >= self.max_attempts
+                log.warning(
+                    "Archiving %s failed (attempt %d, %s): %s",
+                    job.msg_key, job.attempts + 1, "retrying" if not give_up else "giving up", e,
+                )
+                MEDIA_ARCHIVED.labels(self.bot_name, "failed").inc()
+                try:
+                    await self.archive.mark_failed(job.msg_key, repr(e)[:500], give_up)
+                except Exception:
+                    log.exception("Recording the failure of %s failed", job.msg_key)
+                if not give_up:
+                    min_delay = retry_after_seconds(e) if isinstance(e, RetryAfter) else 0.0
+                    self._retry_later(job._replace(attempts=job.attempts + 1), min_delay)
+            finally:
+                self._queue.task_done()
+
+    def _retry_later(self, job: ArchiveJob, min_delay: float = 0.0) -> None:
+        delay = max(min(5 * 2 ** job.attempts, 600) * random.uniform(0.5, 1.0), min_delay)
+
+        def requeue():
+            self._retries.discard(handle)
+            self._queue.put_nowait(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retries.add(handle)
+
+    async def _in_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    async def _archive(self, job: ArchiveJob) -> None:
+        user_dir = os.path.join(self.root, str(job.user_id))
+        await self._in_thread(lambda: os.makedirs(user_dir, exist_ok=True))
+
+        known = await self.archive.find_by_unique_id(job.file_unique_id)
+        if known and await self._in_thread(os.path.exists, known[0]):
+            src, size, sha256 = known
+            path = await self._in_thread(_link, src, os.path.join(user_dir, sha256[:16] + os.path.splitext(src)[1]))
+            await self.archive.mark_done(job.msg_key, path, size, sha256)
+            MEDIA_ARCHIVED.labels(self.bot_name, "deduplicated").inc()
+            return
+
+        tg_file = await self.bot.get_file(job.file_id)
+        ext = (
+            os.path.splitext(job.file_name or "")[1]
+            or os.path.splitext(tg_file.file_path or "")[1]
+            or DEFAULT_EXTENSIONS.get(job.kind, "")
+        )
+        tmp = os.path.join(user_dir, f".{uuid.uuid4().hex}.part")
+        size, sha256 = await self._stream_to(tg_file.file_path, tmp)
+
+        path = os.path.join(user_dir, sha256[:16] + ext)
+        same = await self.archive.find_by_sha256(sha256)
+        path, result = await self._in_thread(_place, tmp, path, same[0] if same else None)
+        if result == "downloaded":
+            MEDIA_ARCHIVED_BYTES.labels(self.bot_name).inc(size)
+        await self.archive.mark_done(job.msg_key, path, size, sha256)
+        MEDIA_ARCHIVED.labels(self.bot_name, result).inc()
+
+    async def _stream_to(self, url: str, tmp: str) -> tuple[int, str]:
+        """Stream `url` into `tmp` chunk by chunk; return (size, sha256)."""
+        digest = hashlib.sha256()
+        size = 0
+        f = None
+        try:
+            async with self._http.stream("GET", url) as resp:
+                if resp.status_code != 200:
+                    raise DownloadFailed(resp.status_code)
+                f = await self._in_thread(open, tmp, "wb")
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    await self._in_thread(_write_chunk, f, digest, chunk)
+                    size += len(chunk)
+            await self._in_thread(f.close)
+        except BaseException:
+            await asyncio.shield(self._in_thread(_discard, f, tmp))
+            raise
+        return size, digest.hexdigest()
+
+
+def _write_chunk(f, digest, chunk: bytes) -> None:
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def _discard(f, tmp: str) -> None:
+    if f is not None:
+        f.close()
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+
+def _place(tmp: str, path: str, same: str | None) -> tuple[str, str]:
+    """Move a finished download to `path`, or drop it when the same content
+    is already archived; return (path to record, result label)."""
+    if os.path.exists(path):
+        os.remove(tmp)
+        return path, "deduplicated"
+    if same and os.path.exists(same):
+        os.remove(tmp)
+        return _link(same, path), "deduplicated"
+    os.replace(tmp, path)
+    return path, "downloaded"
+
+
+_archives: dict[str, MediaArchive] = {}
+
+
+def get_media_archive(db_path: str = MEDIA_ARCHIVE_DB_PATH) -> MediaArchive:
+    archive = _archives.get(db_path)
+    if archive is None:
+        archive = _archives[db_path] = MediaArchive(db_path)
+    return archive
@@ -0,0 +1,261 @@
+# cSpell:disable
+import time
+import bisect
+import logging
+import functools
+from typing import Awaitable, Callable
+
+log = logging.getLogger("metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: "_HistogramChild"):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # آخر خانة هي +Inf؛ العدّ تراكمي وقت العرض بس
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _render_child(self, labels: tuple[str, ...], child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(child.value)}"]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in list(self._children.items()):
+            lines.extend(self._render_child(labels, child))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def reset(self) -> None:
+        for child in self._children.values():
+            child.set(0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, labels, child: _HistogramChild) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*map(_format_value, self.buckets), "+Inf"), child.counts):
+            cumulative += count
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        suffix = _format_labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{suffix} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{suffix} {child.count}")
+        return lines
+
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text format.
+
+    Recording is a dict lookup plus a few integer adds on the event loop;
+    gauges that need I/O (outbox backlog, queue sizes) are refreshed by
+    collectors only when /metrics is scraped."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    async def render(self) -> str:
+        for collector in list(self._collectors):
+            try:
+                await collector()
+            except Exception as e:
+                log.warning("Metrics collector %r failed: %s", collector, e)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed(child: _HistogramChild, fn):
+    """Wrap an async handler so each call is observed on `child`."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Time spent in each update handler.", ("bot", "handler")
+)
+OUTCOMES = REGISTRY.counter(
+    "bot_outcomes_total", "Finished conversation steps by result.", ("bot", "outcome")
+)
+SQLITE_SECONDS = REGISTRY.histogram(
+    "sqlite_query_seconds", "SQLite write latency, including the wait for the database thread.", ("op",)
+)
+POSTGRES_SECONDS = REGISTRY.histogram(
+    "postgres_query_seconds", "PostgreSQL write latency, including the wait for a pooled connection.", ("op",)
+)
+SHEETS_APPEND_SECONDS = REGISTRY.histogram(
+    "sheets_append_seconds", "Latency of one append_rows call.", ("worksheet",)
+)
+SHEETS_ROWS = REGISTRY.counter(
+    "sheets_rows_total", "Rows handed to append_rows by result.", ("worksheet", "result")
+)
+ADMIN_NOTIFY_SECONDS = REGISTRY.histogram(
+    "admin_notify_seconds", "Latency of one admin notification API call.", ("method",)
+)
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited_total", "HTTP 429 / RetryAfter responses received.", ("source",)
+)
+ADMIN_BACKLOG = REGISTRY.gauge(
+    "admin_notify_backlog", "Admin notifications waiting to be sent.", ("chat_id",)
+)
+OUTBOX_PENDING = REGISTRY.gauge(
+    "sheet_outbox_pending", "Outbox rows not yet appended to the sheet.", ("worksheet",)
+)
+UPDATE_QUEUE = REGISTRY.gauge(
+    "bot_update_queue_size", "Updates received but not finished (queued or in flight).", ("bot",)
+)
+MEDIA_ARCHIVED = REGISTRY.counter(
+    "media_archived_total", "Submission files archived by result.", ("bot", "result")
+)
+MEDIA_ARCHIVED_BYTES = REGISTRY.counter(
+    "media_archived_bytes_total", "Bytes written to the media archive.", ("bot",)
+)
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "broadcast_messages_total", "Broadcast deliveries by result.", ("result",)
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "bot_startup_seconds", "Duration of each cold-start phase of the last start.", ("phase",)
+)
+WEBHOOK_UPDATES = REGISTRY.counter(
+    "webhook_updates_total", "Webhook requests by how they were handled.", ("bot", "result")
+)
@@ -0,0 +1,73 @@
+# cSpell:disable
+import os
+import logging
+import importlib.util
+
+from dotenv import load_dotenv
+
+from bot_host import BotSpec, run_bots
+from contribution_bot import build_application as build_contribution_application, env_config
+import contribution_giras
+import contribution_giras_girl
+
+load_dotenv()
+
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    level=logging.INFO,
+)
+log = logging.getLogger("multi-bot")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_registration_bot():
+    # اسم الملف فيه "-" فما بينفع import عادي
+    spec = importlib.util.spec_from_file_location("registration_bot", os.path.join(BASE_DIR, "class_4-6_male.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _contribution_builder(config):
+    return lambda token, request: build_contribution_application(config, token, request)
+
+
+# كل بوت: (اسم، بادئة متغيرات البيئة، المسار الافتراضي، الدالة اللي تبني الـ Application)
+# مثلاً REGISTRATION_BOT_TOKEN و REGISTRATION_WEBHOOK_PATH؛ البوت اللي ما إله token ما بيشتغل
+BOTS = [
+    ("registration", "REGISTRATION_", "tg-webhook", lambda: _load_registration_bot().build_application),
+    ("replies", "REPLIES_", "replies-hook",
+        lambda: _contribution_builder(env_config(contribution_giras.DEFAULTS, "REPLIES_"))),
+    ("replies-girls", "REPLIES_GIRLS_", "replies-girls-hook",
+        lambda: _contribution_builder(env_config(contribution_giras_girl.DEFAULTS, "REPLIES_GIRLS_"))),
+]
+
+
+def bot_specs() -> list[BotSpec]:
+    default_secret = os.getenv("WEBHOOK_SECRET_TOKEN", "CHANGE_ME")
+    specs = []
+    for name, prefix, default_path, builder in BOTS:
+        token = os.getenv(f"{prefix}BOT_TOKEN")
+        if not token:
+            log.info("%sBOT_TOKEN not set, skipping %s", prefix, name)
+            continue
+        specs.append(BotSpec(
+            name=name,
+            build=builder(),
+            token=token,
+            webhook_path=os.getenv(f"{prefix}WEBHOOK_PATH", default_path),
+            secret_token=os.getenv(f"{prefix}WEBHOOK_SECRET_TOKEN", default_secret),
+        ))
+    return specs
+
+
+def main():
+    specs = bot_specs()
+    if not specs:
+        raise RuntimeError("No bot tokens configured (REGISTRATION_BOT_TOKEN / REPLIES_BOT_TOKEN / REPLIES_GIRLS_BOT_TOKEN)")
+    run_bots(specs)
+
+
+if __name__ == "__main__":
+    main()
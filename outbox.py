@@ -0,0 +1,274 @@
+# cSpell:disable
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from sheets_writer import BatchedSheetWriter
+from sqlite_db import SQLiteDatabase
+from metrics import OUTBOX_PENDING, REGISTRY, SQLITE_SECONDS
+
+log = logging.getLogger("sheet-outbox")
+
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "outbox.sqlite3")
+
+# الصفوف المرسلة تبقى فترة حتى ما ينعاد إرسال نفس المفتاح لو Telegram أعاد التحديث
+SENT_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class SheetOutbox(SQLiteDatabase):
+    """Durable queue of rows waiting to be appended to a worksheet.
+
+    Rows are keyed by (spreadsheet_id, worksheet, idem_key), so enqueueing the
+    same registration/message twice is a no-op."""
+
+    def __init__(self, db_path: str = OUTBOX_DB_PATH):
+        super().__init__(db_path, name="outbox-db")
+        self._waiters: set[asyncio.Event] = set()
+
+    @staticmethod
+    def _init(conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sheet_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                spreadsheet_id TEXT NOT NULL,
+                worksheet TEXT NOT NULL,
+                idem_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at REAL,
+                UNIQUE (spreadsheet_id, worksheet, idem_key)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_sheet_outbox_pending
+            ON sheet_outbox (spreadsheet_id, worksheet, next_attempt_at)
+            WHERE sent_at IS NULL
+            """
+        )
+        conn.commit()
+
+    async def init(self) -> None:
+        await self.run(self._init)
+
+    @staticmethod
+    def _enqueue(conn, spreadsheet_id, worksheet, key, values) -> bool:
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO sheet_outbox (spreadsheet_id, worksheet, idem_key, payload, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (spreadsheet_id, worksheet, key, json.dumps(values, ensure_ascii=False), datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+
+    async def enqueue(self, spreadsheet_id: str, worksheet: str, key: str, values: list[str]) -> bool:
+        with SQLITE_SECONDS.labels("outbox_enqueue").time():
+            added = await self.run(self._enqueue, spreadsheet_id, worksheet, key, values)
+        for event in self._waiters:
+            event.set()
+        return added
+
+    @staticmethod
+    def _due(conn, spreadsheet_id, worksheet, limit):
+        rows = conn.execute(
+            """
+            SELECT id, payload, attempts, idem_key FROM sheet_outbox
+            WHERE spreadsheet_id = ? AND worksheet = ? AND sent_at IS NULL AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (spreadsheet_id, worksheet, time.time(), limit),
+        ).fetchall()
+        return [(row_id, json.loads(payload), attempts, key) for row_id, payload, attempts, key in rows]
+
+    @staticmethod
+    def _next_due_at(conn, spreadsheet_id, worksheet):
+        row = conn.execute(
+            """
+            SELECT MIN(next_attempt_at) FROM sheet_outbox
+            WHERE spreadsheet_id = ? AND worksheet = ? AND sent_at IS NULL
+            """,
+            (spreadsheet_id, worksheet),
+        ).fetchone()
+        return row[0]
+
+    @staticmethod
+    def _mark_sent(conn, ids):
+        now = time.time()
+        conn.executemany("UPDATE sheet_outbox SET sent_at = ?, last_error = NULL WHERE id = ?", [(now, i) for i in ids])
+        conn.execute("DELETE FROM sheet_outbox WHERE sent_at < ?", (now - SENT_RETENTION_SECONDS,))
+        conn.commit()
+
+    @staticmethod
+    def _mark_failed(conn, failures):
+        conn.executemany(
+            "UPDATE sheet_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            failures,
+        )
+        conn.commit()
+
+    @staticmethod
+    def _pending_counts(conn):
+        return conn.execute(
+            "SELECT worksheet, COUNT(*) FROM sheet_outbox WHERE sent_at IS NULL GROUP BY worksheet"
+        ).fetchall()
+
+    async def collect_metrics(self) -> None:
+        counts = await self.run(self._pending_counts)
+        OUTBOX_PENDING.reset()
+        for worksheet, count in counts:
+            OUTBOX_PENDING.labels(worksheet).set(count)
+
+    @staticmethod
+    def _pending_keys(conn, spreadsheet_id, worksheet, prefix):
+        rows = conn.execute(
+            """
+            SELECT idem_key FROM sheet_outbox
+            WHERE spreadsheet_id = ? AND worksheet = ? AND sent_at IS NULL AND idem_key LIKE ? || '%'
+            """,
+            (spreadsheet_id, worksheet, prefix),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    async def pending_keys(self, spreadsheet_id: str, worksheet: str, prefix: str = "") -> set[str]:
+        """Keys of rows for this worksheet that are still waiting to be sent."""
+        return await self.run(self._pending_keys, spreadsheet_id, worksheet, prefix)
+
+    async def due(self, spreadsheet_id: str, worksheet: str, limit: int) -> list[tuple[int, list[str], int, str]]:
+        return await self.run(self._due, spreadsheet_id, worksheet, limit)
+
+    async def next_due_at(self, spreadsheet_id: str, worksheet: str) -> float | None:
+        return await self.run(self._next_due_at, spreadsheet_id, worksheet)
+
+    async def mark_sent(self, ids: list[int]) -> None:
+        await self.run(self._mark_sent, ids)
+
+    async def mark_failed(self, failures: list[tuple[float, str, int]]) -> None:
+        await self.run(self._mark_failed, failures)
+
+
+class OutboxDrainer:
+    """Background task that pushes pending outbox rows of one worksheet through
+    a BatchedSheetWriter, backing off exponentially per row on failure.
+
+    `on_sent`, if given, is awaited with the keys of each delivered batch."""
+
+    def __init__(
+        self,
+        outbox: SheetOutbox,
+        writer: BatchedSheetWriter,
+        spreadsheet_id: str,
+        worksheet: str,
+        batch_size: int = 50,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        idle_interval: float = 60.0,
+        on_sent: Callable[[list[str]], Awaitable[None]] | None = None,
+    ):
+        self.outbox = outbox
+        self.writer = writer
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet
+        writer.client.wanted.add(worksheet)
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_interval = idle_interval
+        self.on_sent = on_sent
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.base_delay * 2 ** attempts, self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def drain_once(self) -> float:
+        """Send one batch; return how long to sleep before the next pass."""
+        due = await self.outbox.due(self.spreadsheet_id, self.worksheet, self.batch_size)
+        if not due:
+            next_at = await self.outbox.next_due_at(self.spreadsheet_id, self.worksheet)
+            if next_at is None:
+                return self.idle_interval
+            return max(0.0, next_at - time.time())
+
+        futures = [self.writer.submit(self.worksheet, values) for _, values, _, _ in due]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        sent, sent_keys, failed = [], [], []
+        now = time.time()
+        for (row_id, _, attempts, key), result in zip(due, results):
+            if isinstance(result, BaseException):
+                failed.append((now + self._backoff(attempts), repr(result)[:500], row_id))
+            else:
+                sent.append(row_id)
+                sent_keys.append(key)
+        if sent:
+            await self.outbox.mark_sent(sent)
+            if self.on_sent is not None:
+                try:
+                    await self.on_sent(sent_keys)
+                except Exception:
+                    log.exception("on_sent hook for %r failed", self.worksheet)
+        if failed:
+            log.warning("%d outbox rows for %r failed, retrying later", len(failed), self.worksheet)
+            await self.outbox.mark_failed(failed)
+            return 0.0 if sent else min(t for t, _, _ in failed) - now
+        return 0.0
+
+    async def _loop(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                delay = await self.drain_once()
+            except Exception:
+                log.exception("Outbox drain pass failed")
+                delay = self.base_delay
+            if delay <= 0 or self._stopping:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self.outbox._waiters.add(self._wakeup)
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        if self._task is None:
+            return
+        # نخلّي الدفعة الحالية تكمل حتى تتسجل كـ sent وما تنبعت مرة ثانية بعد الإقلاع
+        self._stopping = True
+        self.outbox._waiters.discard(self._wakeup)
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("Outbox drainer for %r did not stop in %.0fs", self.worksheet, timeout)
+        self._task = None
+
+
+_outboxes: dict[str, SheetOutbox] = {}
+
+
+def get_outbox(db_path: str = OUTBOX_DB_PATH) -> SheetOutbox:
+    outbox = _outboxes.get(db_path)
+    if outbox is None:
+        outbox = _outboxes[db_path] = SheetOutbox(db_path)
+        REGISTRY.add_collector(outbox.collect_metrics)
+    return outbox
@@ -0,0 +1,177 @@
+# cSpell:disable
+import os
+import csv
+import asyncio
+import sqlite3
+import logging
+from dataclasses import dataclass
+
+log = logging.getLogger("registration-export")
+
+EXPORT_CHUNK_ROWS = 5000
+FORMATS = ("csv", "xlsx", "parquet")
+
+EXPORT_COLUMNS = (
+    "id", "created_at", "tg_user_id", "tg_username", "full_name", "gender", "grade",
+    "track_key", "track_title", "option_key", "option_title",
+)
+
+
+@dataclass(frozen=True)
+class ExportFilters:
+    """Matches the values stored in `registrations` (gender/grade are the
+    Arabic labels); `since`/`until` are ISO dates or datetimes, `until`
+    exclusive."""
+
+    gender: str | None = None
+    grade: str | None = None
+    track_key: str | None = None
+    since: str | None = None
+    until: str | None = None
+
+    def where(self) -> tuple[str, list]:
+        clauses, params = [], []
+        for column, value in (("gender", self.gender), ("grade", self.grade), ("track_key", self.track_key)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if self.since:
+            clauses.append("created_at >= ?")
+            params.append(self.since)
+        if self.until:
+            clauses.append("created_at < ?")
+            params.append(self.until)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _iter_chunks_postgres(dsn: str, filters: ExportFilters, chunk_rows: int):
+    # الـ writers متزامنين وبيشتغلوا بـ thread؛ فهون event loop خاص بالتصدير
+    from registration_store_pg import _asyncpg, pg_sql
+
+    asyncpg = _asyncpg()
+    where, params = filters.where()
+    loop = asyncio.new_event_loop()
+    conn = loop.run_until_complete(asyncpg.connect(dsn))
+    try:
+        # snapshot ثابت لكل التصدير، وسيرفر cursor حتى ما ينحمل الجدول كله
+        loop.run_until_complete(conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY"))
+        cur = loop.run_until_complete(
+            conn.cursor(pg_sql(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM registrations{where} ORDER BY id"), *params)
+        )
+        while True:
+            rows = loop.run_until_complete(cur.fetch(chunk_rows))
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+    finally:
+        loop.run_until_complete(conn.close())
+        loop.close()
+
+
+def iter_chunks(db_path: str, filters: ExportFilters, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Yield lists of at most `chunk_rows` rows in id order. `db_path` may
+    also be a postgres:// URL.
+
+    Uses its own read-only connection: under WAL it reads a consistent
+    snapshot without holding up the bot's writer thread."""
+    if db_path.startswith(("postgres://", "postgresql://")):
+        yield from _iter_chunks_postgres(db_path, filters, chunk_rows)
+        return
+    where, params = filters.where()
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        cur = conn.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM registrations{where} ORDER BY id", params)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+    finally:
+        conn.close()
+
+
+def _write_csv(chunks, out_path: str) -> int:
+    count = 0
+    # utf-8-sig حتى Excel يفتح العربي صح
+    with open(out_path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_xlsx(chunks, out_path: str) -> int:
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise RuntimeError("openpyxl is required for XLSX export") from e
+    # write_only يكتب الصفوف للملف أول بأول بدل ما يحتفظ بالورقة كاملة
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("registrations")
+    ws.append(EXPORT_COLUMNS)
+    count = 0
+    for rows in chunks:
+        for row in rows:
+            ws.append(row)
+        count += len(rows)
+    wb.save(out_path)
+    return count
+
+
+def _write_parquet(chunks, out_path: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("pyarrow is required for Parquet export") from e
+    schema = pa.schema([
+        ("id", pa.int64()), ("created_at", pa.string()), ("tg_user_id", pa.int64()),
+        *((name, pa.string()) for name in EXPORT_COLUMNS[3:]),
+    ])
+    count = 0
+    # كل chunk بيصير row group
+    with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+            ))
+            count += len(rows)
+    return count
+
+
+_WRITERS = {"csv": _write_csv, "xlsx": _write_xlsx, "parquet": _write_parquet}
+
+
+def export_errors() -> tuple[type[Exception], ...]:
+    """What a failed export raises: a missing writer library (RuntimeError),
+    a database error, or an I/O error writing the file."""
+    errors = (RuntimeError, OSError, sqlite3.Error)
+    try:
+        import asyncpg
+    except ImportError:
+        return errors
+    return errors + (asyncpg.PostgresError, asyncpg.InterfaceError)
+
+
+def export_registrations(
+    db_path: str,
+    out_path: str,
+    fmt: str = "csv",
+    filters: ExportFilters = ExportFilters(),
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> int:
+    """Write the matching registrations to `out_path`; return the row count.
+    Memory stays at about one chunk of rows whatever the table size.
+
+    Blocking; call it through asyncio.to_thread from the bot."""
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {FORMATS}")
+    try:
+        return _WRITERS[fmt](iter_chunks(db_path, filters, chunk_rows), out_path)
+    except BaseException:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
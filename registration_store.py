@@ -0,0 +1,830 @@
+# cSpell:disable
+import json
+from datetime import datetime
+from dataclasses import asdict
+
+from sqlite_db import SQLiteDatabase
+from metrics import SQLITE_SECONDS
+from registration_export import ExportFilters
+
+# طالب واحد = تسجيل واحد لكل مسابقة. إعادة التأكيد تحدّث نفس الصف، وإذا ما تغيّر شي
+# ما بيرجع ولا صف (RETURNING فاضي)
+UPSERT_REGISTRATION = """
+    INSERT INTO registrations (
+        tg_user_id, tg_username, full_name, gender, grade,
+        track_key, track_title, option_key, option_title, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (tg_user_id, track_key) DO UPDATE SET
+        tg_username = excluded.tg_username,
+        full_name = excluded.full_name,
+        gender = excluded.gender,
+        grade = excluded.grade,
+        track_title = excluded.track_title,
+        option_key = excluded.option_key,
+        option_title = excluded.option_title,
+        updated_at = excluded.created_at
+    WHERE (registrations.full_name, registrations.gender, registrations.grade, registrations.option_key)
+        IS NOT (excluded.full_name, excluded.gender, excluded.grade, excluded.option_key)
+    RETURNING id, updated_at
+"""
+
+SELECT_ID = "SELECT id FROM registrations WHERE tg_user_id = ? AND track_key = ?"
+
+# المقعد الحالي للطالب بالمسابقة (قبل الكتابة)؛ الحد بينفحص بس إذا المقعد تغيّر
+SELECT_SEAT = "SELECT COALESCE(option_key, '') FROM registrations WHERE tg_user_id = ? AND track_key = ?"
+
+SELECT_USER_TRACKS = "SELECT tg_user_id, track_key FROM registrations"
+
+CREATED, UPDATED, UNCHANGED, FULL = "created", "updated", "unchanged", "full"
+
+# المقاعد المحجوزة لمسابقة، لكل خيار ('' = بدون خيار)
+SELECT_TRACK_TAKEN = """
+    SELECT option_key, SUM(count)
+    FROM registration_counts
+    WHERE track_key = ?
+    GROUP BY option_key
+"""
+
+SELECT_ALL_TAKEN = """
+    SELECT track_key, option_key, SUM(count)
+    FROM registration_counts
+    GROUP BY track_key, option_key
+"""
+
+
+def _over_capacity(seat, option_key, taken, track_cap, option_cap) -> bool:
+    """Whether a write that moved the student to `option_key` (seat is the
+    row's (option_key,) before it, None for a new registration) overfilled
+    a limit, given the seats `taken` after it."""
+    if seat is None and track_cap is not None and sum(taken.values()) > track_cap:
+        return True
+    moved = seat is None or seat[0] != option_key
+    return moved and option_cap is not None and taken.get(option_key, 0) > option_cap
+
+
+class _SeatsFull(Exception):
+    pass
+
+
+# حالات البث ومستلميه
+DRAFT, RUNNING, DONE, CANCELLED = "draft", "running", "done", "cancelled"
+PENDING, SENT, BLOCKED, FAILED, UNKNOWN = "pending", "sent", "blocked", "failed", "unknown"
+# ما انبعتلهم بعد لما وقف البث بشكل طبيعي؛ بيرجعوا أول الدور بالتشغيل الجاي
+QUEUED = "queued"
+
+
+def _recipients_query(filters: ExportFilters, select: str, tail: str = "") -> tuple[str, list]:
+    where, params = filters.where()
+    sql = (
+        f"SELECT {select} FROM registrations{where}{' AND' if where else ' WHERE'}"
+        " tg_user_id NOT IN (SELECT tg_user_id FROM blocked_users)" + tail
+    )
+    return sql, params
+
+SHEET_ROW_COLUMNS = "id, tg_username, full_name, gender, grade, track_title, option_title, created_at"
+
+SELECT_AFTER = f"""
+    SELECT {SHEET_ROW_COLUMNS}
+    FROM registrations
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+
+def registration_sheet_row(
+    reg_id: int,
+    username: str | None,
+    full_name: str,
+    gender: str,
+    grade: str,
+    track_title: str,
+    option_title: str | None,
+) -> list[str]:
+    """The row appended to the registrations worksheet; column A is reg_id."""
+    return [str(reg_id), username or "", full_name, gender or "", grade or "", track_title, option_title or ""]
+
+SELECT_LATEST = """
+    SELECT id, full_name, gender, grade, track_title, option_title, created_at
+    FROM registrations
+    WHERE tg_user_id = ?
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+# keyset pagination: كل صفحة تبدأ من آخر id بالصفحة السابقة، فتبقى O(log n) على الـ index
+SELECT_HISTORY = """
+    SELECT id, full_name, gender, grade, track_title, option_title, created_at
+    FROM registrations
+    WHERE tg_user_id = ? AND id < ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+
+def _migrate_base_schema(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_user_id INTEGER NOT NULL,
+            tg_username TEXT,
+            full_name TEXT NOT NULL,
+            gender TEXT,
+            grade TEXT,
+            track_key TEXT NOT NULL,
+            track_title TEXT NOT NULL,
+            option_key TEXT,
+            option_title TEXT,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+
+    cur.execute("PRAGMA table_info(registrations)")
+    cols = {row[1] for row in cur.fetchall()}
+    if "grade" not in cols:
+        cur.execute("ALTER TABLE registrations ADD COLUMN grade TEXT")
+    if "gender" not in cols:
+        cur.execute("ALTER TABLE registrations ADD COLUMN gender TEXT")
+
+
+def _migrate_user_index(cur):
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_registrations_user ON registrations (tg_user_id, id DESC)"
+    )
+
+
+def _migrate_counters(cur):
+    # عدّادات جاهزة لـ /stats؛ الـ triggers تحدّثها مع كل insert/delete بنفس الـ transaction
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registration_counts (
+            gender TEXT NOT NULL,
+            grade TEXT NOT NULL,
+            track_key TEXT NOT NULL,
+            option_key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (gender, grade, track_key, option_key)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO registration_counts (gender, grade, track_key, option_key, count)
+        SELECT IFNULL(gender, ''), IFNULL(grade, ''), track_key, IFNULL(option_key, ''), COUNT(*)
+        FROM registrations
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_insert AFTER INSERT ON registrations
+        BEGIN
+            INSERT INTO registration_counts (gender, grade, track_key, option_key, count)
+            VALUES (IFNULL(NEW.gender, ''), IFNULL(NEW.grade, ''), NEW.track_key, IFNULL(NEW.option_key, ''), 1)
+            ON CONFLICT (gender, grade, track_key, option_key) DO UPDATE SET count = count + 1;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_delete AFTER DELETE ON registrations
+        BEGIN
+            UPDATE registration_counts SET count = count - 1
+            WHERE gender = IFNULL(OLD.gender, '') AND grade = IFNULL(OLD.grade, '')
+              AND track_key = OLD.track_key AND option_key = IFNULL(OLD.option_key, '');
+        END
+        """
+    )
+
+
+def _migrate_unique_user_track(cur):
+    # التكرارات القديمة (تأكيد مرتين / إعادة /start): نخلي آخر تسجيل لكل طالب ومسابقة.
+    # المحذوف بينسخ أول لـ registrations_duplicates (مع id الصف اللي ضل)، بنفس الـ transaction
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registrations_duplicates AS
+        SELECT r.*, r.id AS kept_id, r.created_at AS removed_at FROM registrations r WHERE 0
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO registrations_duplicates
+        SELECT r.*, k.kept_id, ? FROM registrations r
+        JOIN (SELECT tg_user_id, track_key, MAX(id) AS kept_id FROM registrations GROUP BY tg_user_id, track_key) k
+          ON k.tg_user_id = r.tg_user_id AND k.track_key = r.track_key
+        WHERE r.id <> k.kept_id
+        """,
+        (datetime.utcnow().isoformat(),),
+    )
+    # trigger الحذف بينقّص العدّادات
+    cur.execute(
+        """
+        DELETE FROM registrations
+        WHERE id IN (SELECT id FROM registrations_duplicates)
+        """
+    )
+    cur.execute("ALTER TABLE registrations ADD COLUMN updated_at TEXT")
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_user_track ON registrations (tg_user_id, track_key)"
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_update
+        AFTER UPDATE OF gender, grade, track_key, option_key ON registrations
+        BEGIN
+            UPDATE registration_counts SET count = count - 1
+            WHERE gender = IFNULL(OLD.gender, '') AND grade = IFNULL(OLD.grade, '')
+              AND track_key = OLD.track_key AND option_key = IFNULL(OLD.option_key, '');
+            INSERT INTO registration_counts (gender, grade, track_key, option_key, count)
+            VALUES (IFNULL(NEW.gender, ''), IFNULL(NEW.grade, ''), NEW.track_key, IFNULL(NEW.option_key, ''), 1)
+            ON CONFLICT (gender, grade, track_key, option_key) DO UPDATE SET count = count + 1;
+        END
+        """
+    )
+
+
+def _migrate_checkpoints(cur):
+    # حالة الشغلات الطويلة (مطابقة الشيت...) حتى تكمل من مكانها
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _migrate_broadcasts(cur):
+    # البث: الرسالة الأصلية (copy_message) + فلاتر المستلمين + cursor على tg_user_id
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            filters TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            finished_at TEXT,
+            status TEXT NOT NULL,
+            cursor INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # صف لكل مستلم ينكتب "pending" قبل الإرسال، فبعد إعادة التشغيل ما حدا ياخذ الرسالة مرتين
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            tg_user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, tg_user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            tg_user_id INTEGER PRIMARY KEY,
+            blocked_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _migrate_replica_state(cur):
+    # حالة لازم تكون مشتركة بين النسخ: صفوف الشيت اللي لسه بـ outbox نسخة ما،
+    # والـ leases اللي بتضمن إنو نسخة وحدة بس عم تعمل مطابقة أو بث
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sheet_pending (
+            idem_key TEXT PRIMARY KEY,
+            reg_id INTEGER NOT NULL,
+            queued_at TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+
+
+# كل migration تنفّذ مرة وحدة؛ رقم النسخة محفوظ في PRAGMA user_version
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_user_index,
+    _migrate_counters,
+    _migrate_unique_user_track,
+    _migrate_checkpoints,
+    _migrate_broadcasts,
+    _migrate_replica_state,
+]
+
+# الـ lease إلنا إذا ما حدا ماسكه، أو ماسكينه نحنا (تجديد)، أو خلصت مدته
+# الوقت من ساعة القاعدة، مش من ساعة كل نسخة، حتى فرق الساعات بين الأجهزة ما يعطي
+# الـ lease لنسختين؛ {now} تعبير الوقت (ثواني unix) بكل backend
+LEASE_SQL = """
+    INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, {now} + ?)
+    ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+    WHERE leases.owner = excluded.owner OR leases.expires_at < {now}
+    RETURNING owner
+"""
+# unixepoch('subsec') بدها SQLite 3.42
+ACQUIRE_LEASE = LEASE_SQL.format(now="((julianday('now') - 2440587.5) * 86400.0)")
+
+RELEASE_LEASE = "DELETE FROM leases WHERE name = ? AND owner = ?"
+
+MARK_SHEET_PENDING = """
+    INSERT INTO sheet_pending (idem_key, reg_id, queued_at) VALUES (?, ?, ?)
+    ON CONFLICT (idem_key) DO NOTHING
+"""
+
+SELECT_SHEET_PENDING = "SELECT idem_key, reg_id, queued_at FROM sheet_pending"
+
+
+SELECT_COUNTS = """
+    SELECT gender, grade, track_key, option_key, count
+    FROM registration_counts
+    WHERE count > 0
+"""
+
+
+def is_postgres_url(location: str) -> bool:
+    return location.startswith(("postgres://", "postgresql://"))
+
+
+def open_registration_store(location: str, capacities: dict[tuple[str, str], int] | None = None):
+    """RegistrationStore for a SQLite path, PostgresRegistrationStore for a
+    postgres:// URL (needs asyncpg). Both have the same async API."""
+    if is_postgres_url(location):
+        from registration_store_pg import PostgresRegistrationStore
+
+        return PostgresRegistrationStore(location, capacities)
+    return RegistrationStore(location, capacities)
+
+
+class RegistrationIndex:
+    """In-memory state shared by the storage backends, so summaries and
+    menus render without a query: which (user, track) pairs are registered
+    and, for limited tracks, how many seats are taken. The database stays
+    the authority; seat limits are enforced in the write transaction."""
+
+    def __init__(self, capacities: dict[tuple[str, str], int] | None = None):
+        # {(track_key, option_key): مقاعد}؛ option_key "" = حد للمسابقة كلها
+        self.capacities = dict(capacities or {})
+        # نسخة بالذاكرة من registration_counts للمسابقات المحدودة: track_key -> {option_key: n}
+        self._taken: dict[str, dict[str, int]] = {}
+        # (track_key, option_key) الممتلئة؛ frozenset جديد مع كل تغيير حتى ينفع كمفتاح cache
+        self.full: frozenset[tuple[str, str]] = frozenset()
+        # (tg_user_id, track_key) المسجلين، كـ int واحد لكل زوج حتى يبقى الـ set خفيف
+        self._registered: set[int] = set()
+        self._track_codes: dict[str, int] = {}
+
+    def _pair(self, user_id: int, track_key: str) -> int:
+        code = self._track_codes.get(track_key)
+        if code is None:
+            code = self._track_codes[track_key] = len(self._track_codes)
+        return (user_id << 16) | code
+
+    def _warm(self, user_tracks, taken_rows) -> None:
+        """Load the index from (user_id, track_key) and (track_key,
+        option_key, count) rows."""
+        self._registered = {self._pair(user_id, track_key) for user_id, track_key in user_tracks}
+        limited = {track_key for track_key, _ in self.capacities}
+        self._taken = {track_key: {} for track_key in limited}
+        for track_key, option_key, count in taken_rows:
+            if track_key in limited:
+                self._taken[track_key][option_key] = count
+        for track_key in limited:
+            self._refresh_full(track_key)
+
+    def _written(self, user_id: int, track_key: str, status: str, taken: dict[str, int] | None) -> None:
+        if taken is not None:
+            self._taken[track_key] = taken
+            self._refresh_full(track_key)
+        if status != FULL:
+            self._registered.add(self._pair(user_id, track_key))
+
+    def _refresh_full(self, track_key: str) -> None:
+        taken = self._taken.get(track_key, {})
+        full = {key for key in self.full if key[0] != track_key}
+        for (cap_track, option_key), capacity in self.capacities.items():
+            if cap_track != track_key:
+                continue
+            used = sum(taken.values()) if option_key == "" else taken.get(option_key, 0)
+            if used >= capacity:
+                full.add((track_key, option_key))
+        if full != self.full:
+            self.full = frozenset(full)
+
+    def is_full(self, track_key: str, option_key: str | None = None) -> bool:
+        """In-memory: no seats left in the track (or in the option, if given)."""
+        if (track_key, "") in self.full:
+            return True
+        return option_key is not None and (track_key, option_key) in self.full
+
+    def seats_left(self, track_key: str, option_key: str = "") -> int | None:
+        """Free seats per the in-memory counters; None when unlimited."""
+        capacity = self.capacities.get((track_key, option_key))
+        if capacity is None:
+            return None
+        taken = self._taken.get(track_key, {})
+        used = sum(taken.values()) if option_key == "" else taken.get(option_key, 0)
+        return max(capacity - used, 0)
+
+    def is_registered(self, user_id: int, track_key: str) -> bool:
+        """In-memory check, no DB round-trip; warmed by init()."""
+        return self._pair(user_id, track_key) in self._registered
+
+
+class RegistrationStore(RegistrationIndex, SQLiteDatabase):
+    def __init__(self, path: str, capacities: dict[tuple[str, str], int] | None = None):
+        SQLiteDatabase.__init__(self, path, name="registrations-db")
+        RegistrationIndex.__init__(self, capacities)
+        # نتيجة counts() محفوظة لحد أول كتابة جديدة؛ _writes يمنع تخزين نتيجة قديمة
+        self._counts_cache: list[tuple[str, str, str, str, int]] | None = None
+        self._writes = 0
+
+    @staticmethod
+    def _init(conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {number}")
+
+    @staticmethod
+    def _track_taken(conn, track_key) -> dict[str, int]:
+        return dict(conn.execute(SELECT_TRACK_TAKEN, (track_key,)).fetchall())
+
+    @staticmethod
+    def _upsert(conn, values, track_cap, option_cap):
+        """Return (reg_id, status, seats taken per option of the track, or
+        None for an unlimited track)."""
+        track_key, option_key = values[5], values[7] or ""
+        limited = track_cap is not None or option_cap is not None
+        try:
+            with conn:
+                seat = None
+                if limited:
+                    # قفل الكتابة من الأول، حتى المقعد اللي منقرأه يضل صحيح لآخر الـ transaction
+                    conn.execute("BEGIN IMMEDIATE")
+                    seat = conn.execute(SELECT_SEAT, (values[0], track_key)).fetchone()
+                row = conn.execute(UPSERT_REGISTRATION, values).fetchone()
+                taken = RegistrationStore._track_taken(conn, track_key) if limited else None
+                # الـ triggers حدّثت العدّادات بنفس الـ transaction؛ إذا تجاوزنا الحد نرجع عنها.
+                # تعديل الاسم/الصف أو نفس الخيار ما بياخذ مقعد جديد، حتى لو الحد صار أقل من المسجلين
+                if row is not None and limited and _over_capacity(
+                    seat, option_key, taken, track_cap, option_cap
+                ):
+                    raise _SeatsFull
+        except _SeatsFull:
+            return None, FULL, RegistrationStore._track_taken(conn, track_key)
+        if row is None:
+            return conn.execute(SELECT_ID, (values[0], values[5])).fetchone()[0], UNCHANGED, taken
+        reg_id, updated_at = row
+        return reg_id, CREATED if updated_at is None else UPDATED, taken
+
+    @staticmethod
+    def _all_taken(conn):
+        return conn.execute(SELECT_ALL_TAKEN).fetchall()
+
+    @staticmethod
+    def _user_tracks(conn):
+        return conn.execute(SELECT_USER_TRACKS).fetchall()
+
+    @staticmethod
+    def _counts(conn):
+        return conn.execute(SELECT_COUNTS).fetchall()
+
+    @staticmethod
+    def _after(conn, after_id, limit):
+        return conn.execute(SELECT_AFTER, (after_id, limit)).fetchall()
+
+    @staticmethod
+    def _by_ids(conn, ids):
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows += conn.execute(
+                f"SELECT {SHEET_ROW_COLUMNS} FROM registrations WHERE id IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                chunk,
+            ).fetchall()
+        return rows
+
+    @staticmethod
+    def _existing_ids(conn, ids):
+        found = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT id FROM registrations WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    @staticmethod
+    def _get_checkpoint(conn, name):
+        row = conn.execute("SELECT state FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _set_checkpoint(conn, name, state):
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO checkpoints (name, state, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                """,
+                (name, json.dumps(state), datetime.utcnow().isoformat()),
+            )
+
+    @staticmethod
+    def _count_recipients(conn, filters):
+        sql, params = _recipients_query(filters, "COUNT(DISTINCT tg_user_id)")
+        return conn.execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _create_broadcast(conn, from_chat_id, message_id, filters, created_by):
+        with conn:
+            return conn.execute(
+                """
+                INSERT INTO broadcasts (from_chat_id, message_id, filters, created_by, created_at, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (from_chat_id, message_id, json.dumps(asdict(filters)), created_by,
+                 datetime.utcnow().isoformat(), DRAFT),
+            ).lastrowid
+
+    @staticmethod
+    def _get_broadcast(conn, broadcast_id):
+        row = conn.execute(
+            "SELECT id, from_chat_id, message_id, filters, created_by, status FROM broadcasts WHERE id = ?",
+            (broadcast_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        bid, from_chat_id, message_id, filters, created_by, status = row
+        return {
+            "id": bid, "from_chat_id": from_chat_id, "message_id": message_id,
+            "filters": ExportFilters(**json.loads(filters)), "created_by": created_by, "status": status,
+        }
+
+    @staticmethod
+    def _set_broadcast_status(conn, broadcast_id, status, from_statuses):
+        finished = datetime.utcnow().isoformat() if status in (DONE, CANCELLED) else None
+        with conn:
+            cur = conn.execute(
+                f"""
+                UPDATE broadcasts SET status = ?, finished_at = ?
+                WHERE id = ? AND status IN ({','.join('?' * len(from_statuses))})
+                """,
+                (status, finished, broadcast_id, *from_statuses),
+            )
+        return cur.rowcount == 1
+
+    @staticmethod
+    def _broadcasts_with_status(conn, status):
+        return [row[0] for row in conn.execute("SELECT id FROM broadcasts WHERE status = ? ORDER BY id", (status,))]
+
+    @staticmethod
+    def _claim_recipients(conn, broadcast_id, filters, limit):
+        with conn:
+            requeued = [row[0] for row in conn.execute(
+                "SELECT tg_user_id FROM broadcast_deliveries WHERE broadcast_id = ? AND status = ? LIMIT ?",
+                (broadcast_id, QUEUED, limit),
+            )]
+            if requeued:
+                conn.executemany(
+                    "UPDATE broadcast_deliveries SET status = ? WHERE broadcast_id = ? AND tg_user_id = ?",
+                    [(PENDING, broadcast_id, user_id) for user_id in requeued],
+                )
+                return requeued
+            cursor = conn.execute("SELECT cursor FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+            sql, params = _recipients_query(
+                filters, "DISTINCT tg_user_id", " AND tg_user_id > ? ORDER BY tg_user_id LIMIT ?"
+            )
+            users = [row[0] for row in conn.execute(sql, (*params, cursor, limit))]
+            if users:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, tg_user_id, status) VALUES (?, ?, ?)",
+                    [(broadcast_id, user_id, PENDING) for user_id in users],
+                )
+                conn.execute("UPDATE broadcasts SET cursor = ? WHERE id = ?", (users[-1], broadcast_id))
+        return users
+
+    @staticmethod
+    def _record_deliveries(conn, broadcast_id, results):
+        now = datetime.utcnow().isoformat()
+        with conn:
+            conn.executemany(
+                "UPDATE broadcast_deliveries SET status = ?, error = ? WHERE broadcast_id = ? AND tg_user_id = ?",
+                [(status, error, broadcast_id, user_id) for user_id, status, error in results],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO blocked_users (tg_user_id, blocked_at) VALUES (?, ?)",
+                [(user_id, now) for user_id, status, _ in results if status == BLOCKED],
+            )
+
+    @staticmethod
+    def _abandon_pending(conn, broadcast_id):
+        with conn:
+            return conn.execute(
+                "UPDATE broadcast_deliveries SET status = ? WHERE broadcast_id = ? AND status = ?",
+                (UNKNOWN, broadcast_id, PENDING),
+            ).rowcount
+
+    @staticmethod
+    def _broadcast_progress(conn, broadcast_id):
+        return dict(conn.execute(
+            "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,),
+        ).fetchall())
+
+    @staticmethod
+    def _acquire_lease(conn, name, owner, seconds):
+        with conn:
+            return conn.execute(ACQUIRE_LEASE, (name, owner, seconds)).fetchone() is not None
+
+    @staticmethod
+    def _release_lease(conn, name, owner):
+        with conn:
+            conn.execute(RELEASE_LEASE, (name, owner))
+
+    @staticmethod
+    def _mark_sheet_pending(conn, key, reg_id):
+        with conn:
+            conn.execute(MARK_SHEET_PENDING, (key, reg_id, datetime.utcnow().isoformat()))
+
+    @staticmethod
+    def _clear_sheet_pending(conn, keys):
+        with conn:
+            conn.executemany("DELETE FROM sheet_pending WHERE idem_key = ?", [(key,) for key in keys])
+
+    @staticmethod
+    def _sheet_pending(conn):
+        return conn.execute(SELECT_SHEET_PENDING).fetchall()
+
+    @staticmethod
+    def _latest(conn, user_id):
+        return conn.execute(SELECT_LATEST, (user_id,)).fetchone()
+
+    @staticmethod
+    def _history(conn, user_id, before_id, limit):
+        return conn.execute(SELECT_HISTORY, (user_id, before_id, limit)).fetchall()
+
+    async def init(self) -> None:
+        await self.run(self._init)
+        self._warm(await self.run(self._user_tracks), await self.run(self._all_taken))
+
+    async def upsert(
+        self,
+        user_id: int,
+        username: str | None,
+        full_name: str,
+        gender: str,
+        grade: str,
+        track_key: str,
+        track_title: str,
+        option_key: str | None,
+        option_title: str | None,
+    ) -> tuple[int, str]:
+        """Insert or update the user's registration for `track_key`; return
+        (reg_id, CREATED | UPDATED | UNCHANGED), or (None, FULL) when the
+        track or option has no seats left (nothing is written then).
+
+        The seat check runs in the same transaction as the write, so
+        concurrent confirms can't overbook."""
+        values = (
+            user_id,
+            username,
+            full_name,
+            gender,
+            grade,
+            track_key,
+            track_title,
+            option_key,
+            option_title,
+            datetime.utcnow().isoformat(),
+        )
+        track_cap = self.capacities.get((track_key, ""))
+        option_cap = self.capacities.get((track_key, option_key or ""))
+        try:
+            with SQLITE_SECONDS.labels("insert_registration").time():
+                reg_id, status, taken = await self.run(self._upsert, values, track_cap, option_cap)
+        finally:
+            self._writes += 1
+            self._counts_cache = None
+        self._written(user_id, track_key, status, taken)
+        return reg_id, status
+
+    async def counts(self) -> list[tuple[str, str, str, str, int]]:
+        """(gender, grade, track_key, option_key, count) for every non-empty
+        combination; missing gender/grade/option are ''."""
+        if self._counts_cache is not None:
+            return self._counts_cache
+        writes = self._writes
+        rows = await self.run(self._counts)
+        if writes == self._writes:
+            self._counts_cache = rows
+        return rows
+
+    async def registrations_after(self, after_id: int, limit: int):
+        """(id, username, full_name, gender, grade, track_title, option_title,
+        created_at) rows with id > after_id, oldest first."""
+        return await self.run(self._after, after_id, limit)
+
+    async def registrations_by_ids(self, ids: list[int]):
+        """Same rows as registrations_after, for the given ids (missing ids
+        are left out)."""
+        return await self.run(self._by_ids, sorted(ids))
+
+    async def existing_ids(self, ids: list[int]) -> set[int]:
+        return await self.run(self._existing_ids, ids)
+
+    async def get_checkpoint(self, name: str) -> dict | None:
+        return await self.run(self._get_checkpoint, name)
+
+    async def set_checkpoint(self, name: str, state: dict) -> None:
+        await self.run(self._set_checkpoint, name, state)
+
+    async def count_broadcast_recipients(self, filters: ExportFilters) -> int:
+        return await self.run(self._count_recipients, filters)
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, filters: ExportFilters, created_by: int) -> int:
+        """Record a DRAFT broadcast of a copy of (from_chat_id, message_id)."""
+        return await self.run(self._create_broadcast, from_chat_id, message_id, filters, created_by)
+
+    async def get_broadcast(self, broadcast_id: int) -> dict | None:
+        return await self.run(self._get_broadcast, broadcast_id)
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str, from_statuses: tuple[str, ...]) -> bool:
+        """Move the broadcast to `status` if it is in one of `from_statuses`."""
+        return await self.run(self._set_broadcast_status, broadcast_id, status, from_statuses)
+
+    async def broadcasts_with_status(self, status: str) -> list[int]:
+        return await self.run(self._broadcasts_with_status, status)
+
+    async def claim_broadcast_recipients(self, broadcast_id: int, filters: ExportFilters, limit: int) -> list[int]:
+        """Next `limit` recipients: QUEUED ones left by a stopped run first,
+        then distinct users after the broadcast's cursor, skipping blocked
+        ones. They are stored as PENDING (and the cursor moves past them)
+        in the same transaction."""
+        return await self.run(self._claim_recipients, broadcast_id, filters, limit)
+
+    async def record_broadcast_deliveries(self, broadcast_id: int, results: list[tuple[int, str, str | None]]) -> None:
+        """(tg_user_id, status, error) per recipient; BLOCKED users are also
+        added to blocked_users."""
+        await self.run(self._record_deliveries, broadcast_id, results)
+
+    async def abandon_pending_deliveries(self, broadcast_id: int) -> int:
+        """Mark PENDING recipients of an interrupted run UNKNOWN, so they are
+        never sent twice."""
+        return await self.run(self._abandon_pending, broadcast_id)
+
+    async def broadcast_progress(self, broadcast_id: int) -> dict[str, int]:
+        return await self.run(self._broadcast_progress, broadcast_id)
+
+    async def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        """Take or renew the named lease for `seconds`; False while another
+        owner holds an unexpired one."""
+        return await self.run(self._acquire_lease, name, owner, seconds)
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        await self.run(self._release_lease, name, owner)
+
+    async def mark_sheet_pending(self, key: str, reg_id: int) -> None:
+        """Record that the sheet row `key` of `reg_id` is queued in some
+        replica's outbox, so the reconciler doesn't append it again."""
+        await self.run(self._mark_sheet_pending, key, reg_id)
+
+    async def clear_sheet_pending(self, keys: list[str]) -> None:
+        if keys:
+            await self.run(self._clear_sheet_pending, keys)
+
+    async def sheet_pending(self) -> list[tuple[str, int, str]]:
+        """(idem_key, reg_id, queued_at) of every row not yet on the sheet."""
+        return await self.run(self._sheet_pending)
+
+    async def latest_for_user(self, user_id: int):
+        return await self.run(self._latest, user_id)
+
+    async def history_for_user(self, user_id: int, before_id: int | None = None, limit: int = 5):
+        """Return (rows, next_before_id); next_before_id is None on the last page."""
+        before_id = before_id if before_id is not None else 2 ** 63 - 1
+        rows = await self.run(self._history, user_id, before_id, limit + 1)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1][0]
+        return rows, None
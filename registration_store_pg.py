@@ -0,0 +1,440 @@
+# cSpell:disable
+import os
+import re
+import json
+import itertools
+from datetime import datetime
+from dataclasses import asdict
+
+from metrics import POSTGRES_SECONDS
+from registration_export import ExportFilters
+from registration_store import (
+    LEASE_SQL, MARK_SHEET_PENDING, RELEASE_LEASE, SELECT_SHEET_PENDING,
+    CANCELLED, CREATED, DONE, DRAFT, FULL, PENDING, QUEUED, UNCHANGED, UNKNOWN, UPDATED, BLOCKED,
+    SHEET_ROW_COLUMNS, SELECT_AFTER, SELECT_ALL_TAKEN, SELECT_COUNTS, SELECT_HISTORY, SELECT_ID, SELECT_LATEST,
+    SELECT_SEAT, SELECT_TRACK_TAKEN, SELECT_USER_TRACKS,
+    RegistrationIndex, _over_capacity, _recipients_query,
+)
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_COMMAND_TIMEOUT = float(os.getenv("PG_COMMAND_TIMEOUT", "30"))
+
+# نفس المفتاح لكل النسخ: وحدة بس بتشغّل الـ migrations بنفس الوقت
+_MIGRATION_LOCK = 0x67697261  # "gira"
+
+
+def _asyncpg():
+    try:
+        import asyncpg
+    except ImportError as e:
+        raise RuntimeError("asyncpg is required for a PostgreSQL DATABASE_URL") from e
+    return asyncpg
+
+
+def pg_sql(sql: str) -> str:
+    """Turn the SQLite-style `?` placeholders of the shared queries into
+    $1, $2, ... (none of them has a literal `?`)."""
+    counter = itertools.count(1)
+    return re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+
+
+ACQUIRE_LEASE = LEASE_SQL.format(now="extract(epoch FROM clock_timestamp())::float8")
+
+
+# نفس ترتيب MIGRATIONS تبع SQLite: النسخة N هي نفس الـ schema بالاثنين
+PG_MIGRATIONS = [
+    # 1: الجدول الأساسي؛ created_at نص ISO متل SQLite حتى الفلاتر والمقارنات تبقى نفسها
+    """
+    CREATE TABLE IF NOT EXISTS registrations (
+        id BIGSERIAL PRIMARY KEY,
+        tg_user_id BIGINT NOT NULL,
+        tg_username TEXT,
+        full_name TEXT NOT NULL,
+        gender TEXT,
+        grade TEXT,
+        track_key TEXT NOT NULL,
+        track_title TEXT NOT NULL,
+        option_key TEXT,
+        option_title TEXT,
+        created_at TEXT NOT NULL
+    );
+    """,
+    # 2
+    "CREATE INDEX IF NOT EXISTS idx_registrations_user ON registrations (tg_user_id, id DESC);",
+    # 3: العدّادات + trigger واحد لكل العمليات
+    """
+    CREATE TABLE IF NOT EXISTS registration_counts (
+        gender TEXT NOT NULL,
+        grade TEXT NOT NULL,
+        track_key TEXT NOT NULL,
+        option_key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (gender, grade, track_key, option_key)
+    );
+    INSERT INTO registration_counts (gender, grade, track_key, option_key, count)
+    SELECT COALESCE(gender, ''), COALESCE(grade, ''), track_key, COALESCE(option_key, ''), COUNT(*)
+    FROM registrations
+    GROUP BY 1, 2, 3, 4;
+    CREATE OR REPLACE FUNCTION registration_counts_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE registration_counts SET count = count - 1
+            WHERE gender = COALESCE(OLD.gender, '') AND grade = COALESCE(OLD.grade, '')
+              AND track_key = OLD.track_key AND option_key = COALESCE(OLD.option_key, '');
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO registration_counts (gender, grade, track_key, option_key, count)
+            VALUES (COALESCE(NEW.gender, ''), COALESCE(NEW.grade, ''), NEW.track_key, COALESCE(NEW.option_key, ''), 1)
+            ON CONFLICT (gender, grade, track_key, option_key)
+            DO UPDATE SET count = registration_counts.count + 1;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER trg_registrations_count AFTER INSERT OR DELETE ON registrations
+    FOR EACH ROW EXECUTE FUNCTION registration_counts_apply();
+    """,
+    # 4: تسجيل واحد لكل طالب ومسابقة؛ التكرارات بتنسخ لـ registrations_duplicates قبل ما تنحذف
+    """
+    CREATE TABLE IF NOT EXISTS registrations_duplicates AS
+    SELECT r.*, r.id AS kept_id, r.created_at AS removed_at FROM registrations r WHERE false;
+    INSERT INTO registrations_duplicates
+    SELECT r.*, k.kept_id, to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD"T"HH24:MI:SS.US') FROM registrations r
+    JOIN (SELECT tg_user_id, track_key, MAX(id) AS kept_id FROM registrations GROUP BY tg_user_id, track_key) k
+      ON k.tg_user_id = r.tg_user_id AND k.track_key = r.track_key
+    WHERE r.id <> k.kept_id;
+    DELETE FROM registrations WHERE id IN (SELECT id FROM registrations_duplicates);
+    ALTER TABLE registrations ADD COLUMN IF NOT EXISTS updated_at TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_user_track ON registrations (tg_user_id, track_key);
+    CREATE TRIGGER trg_registrations_count_update
+    AFTER UPDATE OF gender, grade, track_key, option_key ON registrations
+    FOR EACH ROW EXECUTE FUNCTION registration_counts_apply();
+    """,
+    # 5
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        name TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    """,
+    # 6
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id BIGSERIAL PRIMARY KEY,
+        from_chat_id BIGINT NOT NULL,
+        message_id BIGINT NOT NULL,
+        filters TEXT NOT NULL,
+        created_by BIGINT NOT NULL,
+        created_at TEXT NOT NULL,
+        finished_at TEXT,
+        status TEXT NOT NULL,
+        cursor BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id BIGINT NOT NULL,
+        tg_user_id BIGINT NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        PRIMARY KEY (broadcast_id, tg_user_id)
+    );
+    CREATE TABLE IF NOT EXISTS blocked_users (
+        tg_user_id BIGINT PRIMARY KEY,
+        blocked_at TEXT NOT NULL
+    );
+    """,
+    # 7
+    """
+    CREATE TABLE IF NOT EXISTS sheet_pending (
+        idem_key TEXT PRIMARY KEY,
+        reg_id BIGINT NOT NULL,
+        queued_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL
+    );
+    """,
+]
+
+UPSERT_REGISTRATION = """
+    INSERT INTO registrations (
+        tg_user_id, tg_username, full_name, gender, grade,
+        track_key, track_title, option_key, option_title, created_at
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    ON CONFLICT (tg_user_id, track_key) DO UPDATE SET
+        tg_username = excluded.tg_username,
+        full_name = excluded.full_name,
+        gender = excluded.gender,
+        grade = excluded.grade,
+        track_title = excluded.track_title,
+        option_key = excluded.option_key,
+        option_title = excluded.option_title,
+        updated_at = excluded.created_at
+    WHERE (registrations.full_name, registrations.gender, registrations.grade, registrations.option_key)
+        IS DISTINCT FROM (excluded.full_name, excluded.gender, excluded.grade, excluded.option_key)
+    RETURNING id, updated_at
+"""
+
+
+class _SeatsFull(Exception):
+    pass
+
+
+class PostgresRegistrationStore(RegistrationIndex):
+    """RegistrationStore on PostgreSQL through an asyncpg pool, for several
+    bot replicas sharing one database.
+
+    Same public API and schema as the SQLite store. Seat limits take a
+    per-track advisory lock inside the write transaction, so they hold
+    across replicas. The in-memory index only sees this replica's writes
+    (and what was there at init), which is fine for the hints it drives."""
+
+    def __init__(self, dsn: str, capacities: dict[tuple[str, str], int] | None = None):
+        super().__init__(capacities)
+        self.dsn = dsn
+        self._pool = None
+
+    async def _migrate(self, conn) -> None:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK)
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            version = await conn.fetchval("SELECT version FROM schema_version")
+            if version is None:
+                await conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+                version = 0
+            for number, migration in enumerate(PG_MIGRATIONS[version:], start=version + 1):
+                await conn.execute(migration)
+                await conn.execute("UPDATE schema_version SET version = $1", number)
+
+    async def init(self) -> None:
+        asyncpg = _asyncpg()
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                self.dsn, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX, command_timeout=PG_COMMAND_TIMEOUT
+            )
+        async with self._pool.acquire() as conn:
+            await self._migrate(conn)
+            user_tracks = await conn.fetch(SELECT_USER_TRACKS)
+            taken = await conn.fetch(SELECT_ALL_TAKEN)
+        self._warm(user_tracks, taken)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _fetch(self, sql: str, *args) -> list[tuple]:
+        return [tuple(r) for r in await self._pool.fetch(pg_sql(sql), *args)]
+
+    async def _fetchrow(self, sql: str, *args) -> tuple | None:
+        row = await self._pool.fetchrow(pg_sql(sql), *args)
+        return tuple(row) if row is not None else None
+
+    @staticmethod
+    async def _track_taken(conn, track_key: str) -> dict[str, int]:
+        return {option_key: count for option_key, count in await conn.fetch(pg_sql(SELECT_TRACK_TAKEN), track_key)}
+
+    async def upsert(
+        self,
+        user_id: int,
+        username: str | None,
+        full_name: str,
+        gender: str,
+        grade: str,
+        track_key: str,
+        track_title: str,
+        option_key: str | None,
+        option_title: str | None,
+    ) -> tuple[int, str]:
+        """See RegistrationStore.upsert."""
+        values = (
+            user_id, username, full_name, gender, grade, track_key, track_title, option_key, option_title,
+            datetime.utcnow().isoformat(),
+        )
+        track_cap = self.capacities.get((track_key, ""))
+        option_cap = self.capacities.get((track_key, option_key or ""))
+        limited = track_cap is not None or option_cap is not None
+        taken = None
+        with POSTGRES_SECONDS.labels("insert_registration").time():
+            async with self._pool.acquire() as conn:
+                try:
+                    async with conn.transaction():
+                        seat = None
+                        if limited:
+                            # المقاعد: كتابة وحدة لكل مسابقة بنفس الوقت، من كل النسخ
+                            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", f"seats:{track_key}")
+                            seat = await conn.fetchrow(pg_sql(SELECT_SEAT), user_id, track_key)
+                        row = await conn.fetchrow(UPSERT_REGISTRATION, *values)
+                        if limited:
+                            taken = await self._track_taken(conn, track_key)
+                            if row is not None and _over_capacity(
+                                seat, option_key or "", taken, track_cap, option_cap
+                            ):
+                                raise _SeatsFull
+                except _SeatsFull:
+                    reg_id, status = None, FULL
+                    taken = await self._track_taken(conn, track_key)
+                else:
+                    if row is None:
+                        reg_id, status = await conn.fetchval(pg_sql(SELECT_ID), user_id, track_key), UNCHANGED
+                    else:
+                        reg_id, status = row["id"], CREATED if row["updated_at"] is None else UPDATED
+        self._written(user_id, track_key, status, taken)
+        return reg_id, status
+
+    async def counts(self) -> list[tuple[str, str, str, str, int]]:
+        # بدون cache: نسخ ثانية ممكن تكون كتبت
+        return await self._fetch(SELECT_COUNTS)
+
+    async def registrations_after(self, after_id: int, limit: int):
+        return await self._fetch(SELECT_AFTER, after_id, limit)
+
+    async def registrations_by_ids(self, ids: list[int]):
+        return await self._fetch(
+            f"SELECT {SHEET_ROW_COLUMNS} FROM registrations WHERE id = ANY($1::bigint[]) ORDER BY id", list(ids)
+        )
+
+    async def existing_ids(self, ids: list[int]) -> set[int]:
+        rows = await self._pool.fetch("SELECT id FROM registrations WHERE id = ANY($1::bigint[])", ids)
+        return {row[0] for row in rows}
+
+    async def get_checkpoint(self, name: str) -> dict | None:
+        state = await self._pool.fetchval("SELECT state FROM checkpoints WHERE name = $1", name)
+        return json.loads(state) if state is not None else None
+
+    async def set_checkpoint(self, name: str, state: dict) -> None:
+        await self._pool.execute(
+            """
+            INSERT INTO checkpoints (name, state, updated_at) VALUES ($1, $2, $3)
+            ON CONFLICT (name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            """,
+            name, json.dumps(state), datetime.utcnow().isoformat(),
+        )
+
+    async def count_broadcast_recipients(self, filters: ExportFilters) -> int:
+        sql, params = _recipients_query(filters, "COUNT(DISTINCT tg_user_id)")
+        return await self._pool.fetchval(pg_sql(sql), *params)
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, filters: ExportFilters, created_by: int) -> int:
+        return await self._pool.fetchval(
+            """
+            INSERT INTO broadcasts (from_chat_id, message_id, filters, created_by, created_at, status)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id
+            """,
+            from_chat_id, message_id, json.dumps(asdict(filters)), created_by, datetime.utcnow().isoformat(), DRAFT,
+        )
+
+    async def get_broadcast(self, broadcast_id: int) -> dict | None:
+        row = await self._pool.fetchrow(
+            "SELECT id, from_chat_id, message_id, filters, created_by, status FROM broadcasts WHERE id = $1",
+            broadcast_id,
+        )
+        if row is None:
+            return None
+        return {**dict(row), "filters": ExportFilters(**json.loads(row["filters"]))}
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str, from_statuses: tuple[str, ...]) -> bool:
+        finished = datetime.utcnow().isoformat() if status in (DONE, CANCELLED) else None
+        result = await self._pool.execute(
+            "UPDATE broadcasts SET status = $1, finished_at = $2 WHERE id = $3 AND status = ANY($4::text[])",
+            status, finished, broadcast_id, list(from_statuses),
+        )
+        return result == "UPDATE 1"
+
+    async def broadcasts_with_status(self, status: str) -> list[int]:
+        rows = await self._pool.fetch("SELECT id FROM broadcasts WHERE status = $1 ORDER BY id", status)
+        return [row[0] for row in rows]
+
+    async def claim_broadcast_recipients(self, broadcast_id: int, filters: ExportFilters, limit: int) -> list[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # FOR UPDATE: لو نسختين عم يكمّلوا نفس البث ما بياخذوا نفس المستلمين
+                cursor = await conn.fetchval("SELECT cursor FROM broadcasts WHERE id = $1 FOR UPDATE", broadcast_id)
+                requeued = [row[0] for row in await conn.fetch(
+                    """
+                    UPDATE broadcast_deliveries SET status = $3
+                    WHERE (broadcast_id, tg_user_id) IN (
+                        SELECT broadcast_id, tg_user_id FROM broadcast_deliveries
+                        WHERE broadcast_id = $1 AND status = $2
+                        LIMIT $4
+                    )
+                    RETURNING tg_user_id
+                    """,
+                    broadcast_id, QUEUED, PENDING, limit,
+                )]
+                if requeued:
+                    return requeued
+                sql, params = _recipients_query(
+                    filters, "DISTINCT tg_user_id", " AND tg_user_id > ? ORDER BY tg_user_id LIMIT ?"
+                )
+                users = [row[0] for row in await conn.fetch(pg_sql(sql), *params, cursor, limit)]
+                if users:
+                    await conn.execute(
+                        """
+                        INSERT INTO broadcast_deliveries (broadcast_id, tg_user_id, status)
+                        SELECT $1, unnest($2::bigint[]), $3
+                        ON CONFLICT DO NOTHING
+                        """,
+                        broadcast_id, users, PENDING,
+                    )
+                    await conn.execute("UPDATE broadcasts SET cursor = $1 WHERE id = $2", users[-1], broadcast_id)
+                return users
+
+    async def record_broadcast_deliveries(self, broadcast_id: int, results: list[tuple[int, str, str | None]]) -> None:
+        now = datetime.utcnow().isoformat()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    "UPDATE broadcast_deliveries SET status = $1, error = $2 WHERE broadcast_id = $3 AND tg_user_id = $4",
+                    [(status, error, broadcast_id, user_id) for user_id, status, error in results],
+                )
+                await conn.executemany(
+                    "INSERT INTO blocked_users (tg_user_id, blocked_at) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                    [(user_id, now) for user_id, status, _ in results if status == BLOCKED],
+                )
+
+    async def abandon_pending_deliveries(self, broadcast_id: int) -> int:
+        result = await self._pool.execute(
+            "UPDATE broadcast_deliveries SET status = $1 WHERE broadcast_id = $2 AND status = $3",
+            UNKNOWN, broadcast_id, PENDING,
+        )
+        return int(result.split()[-1])
+
+    async def broadcast_progress(self, broadcast_id: int) -> dict[str, int]:
+        rows = await self._pool.fetch(
+            "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = $1 GROUP BY status",
+            broadcast_id,
+        )
+        return {status: count for status, count in rows}
+
+    async def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        return await self._fetchrow(ACQUIRE_LEASE, name, owner, seconds) is not None
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        await self._pool.execute(pg_sql(RELEASE_LEASE), name, owner)
+
+    async def mark_sheet_pending(self, key: str, reg_id: int) -> None:
+        await self._pool.execute(pg_sql(MARK_SHEET_PENDING), key, reg_id, datetime.utcnow().isoformat())
+
+    async def clear_sheet_pending(self, keys: list[str]) -> None:
+        if keys:
+            await self._pool.execute("DELETE FROM sheet_pending WHERE idem_key = ANY($1::text[])", list(keys))
+
+    async def sheet_pending(self) -> list[tuple[str, int, str]]:
+        return await self._fetch(SELECT_SHEET_PENDING)
+
+    async def latest_for_user(self, user_id: int):
+        return await self._fetchrow(SELECT_LATEST, user_id)
+
+    async def history_for_user(self, user_id: int, before_id: int | None = None, limit: int = 5):
+        """Return (rows, next_before_id); next_before_id is None on the last page."""
+        before_id = before_id if before_id is not None else 2 ** 63 - 1
+        rows = await self._fetch(SELECT_HISTORY, user_id, before_id, limit + 1)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1][0]
+        return rows, None
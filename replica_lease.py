@@ -0,0 +1,83 @@
+# cSpell:disable
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+log = logging.getLogger("replica-lease")
+
+# هوية هالنسخة من البوت؛ بتتغير مع كل تشغيل
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+LEASE_SECONDS = float(os.getenv("LEASE_SECONDS", "60"))
+# إذا ما قدرنا نجدد، منعتبره راح بعد هالجزء من المدة، قبل ما تقدر نسخة ثانية تاخذه
+SAFE_FRACTION = 0.8
+
+
+class Lease:
+    __slots__ = ("name", "owner", "held", "lost")
+
+    def __init__(self, name: str, owner: str, held: bool):
+        self.name = name
+        self.owner = owner
+        self.held = held
+        # صار True إذا فشل التجديد ونسخة ثانية أخذته؛ الشغل لازم يوقف بأول فرصة
+        self.lost = False
+
+
+@asynccontextmanager
+async def hold_lease(store, name: str, seconds: float = LEASE_SECONDS, owner: str = REPLICA_ID):
+    """Hold the store's named lease for the duration of the block, so only
+    one replica does the guarded work at a time.
+
+    Yields a Lease; `held` is False when another replica owns it (the block
+    should do nothing then). While held it is renewed every seconds/3 in
+    the background and released on exit. `lost` is set, and the block
+    should stop at its next safe point, when a renewal finds the lease
+    taken or when renewals keep failing until SAFE_FRACTION of `seconds`
+    has passed since the last good one (the database may already let
+    another replica take it by then)."""
+    started = time.monotonic()
+    lease = Lease(name, owner, await store.acquire_lease(name, owner, seconds))
+    if not lease.held:
+        yield lease
+        return
+
+    async def renew():
+        # وقت بداية آخر تجديد نجح؛ الانتهاء بالقاعدة محسوب من بعده
+        last_ok = started
+        while True:
+            deadline = last_ok + seconds * SAFE_FRACTION
+            await asyncio.sleep(max(0.0, min(seconds / 3, deadline - time.monotonic())))
+            attempt = time.monotonic()
+            try:
+                if attempt >= deadline:
+                    raise TimeoutError("no successful renewal in time")
+                still_ours = await asyncio.wait_for(store.acquire_lease(name, owner, seconds), deadline - attempt)
+            except Exception as e:
+                log.warning("Renewing lease %r failed: %s", name, e)
+                if time.monotonic() < deadline:
+                    # القاعدة مش متاحة: منضل نحاول لحد قبل ما تخلص المدة بشوي
+                    continue
+                log.warning("Giving up lease %r before it expires", name)
+                lease.lost = True
+                return
+            if not still_ours:
+                log.warning("Lease %r was taken over by another replica", name)
+                lease.lost = True
+                return
+            last_ok = attempt
+
+    renewer = asyncio.get_running_loop().create_task(renew())
+    try:
+        yield lease
+    finally:
+        renewer.cancel()
+        await asyncio.gather(renewer, return_exceptions=True)
+        if not lease.lost:
+            try:
+                await asyncio.shield(store.release_lease(name, owner))
+            except Exception as e:
+                log.warning("Releasing lease %r failed (it expires by itself): %s", name, e)
@@ -0,0 +1,259 @@
+# cSpell:disable
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+
+from replica_lease import REPLICA_ID, Lease, hold_lease
+from sheets_client import SheetClient
+from registration_store import RegistrationStore, registration_sheet_row
+
+log = logging.getLogger("sheet-reconcile")
+
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL_MINUTES", "60")) * 60
+# صفوف أحدث من هيك ممكن تكون لسه بطريقها عبر الـ outbox
+RECONCILE_GRACE = timedelta(minutes=10)
+# صف بـ sheet_pending أقدم من هيك منعتبره ضاع (outbox نسخة انمسح ديسكها) ومنضيفه من جديد
+RECONCILE_LOST_AFTER = timedelta(hours=float(os.getenv("RECONCILE_LOST_AFTER_HOURS", "6")))
+READ_RANGE_ROWS = 5000
+RANGES_PER_CALL = 4
+DB_CHUNK_ROWS = 5000
+# صف مؤجل أكثر من هالعدد من المرات (لسه بالـ outbox) بينذكر بالتقرير
+STUCK_AFTER_RUNS = 3
+# الأعمدة اللي نقارنها بعد reg_id: الاسم، الجنس، الصف، المسابقة، الخيار
+COMPARED_COLUMNS = (2, 3, 4, 5, 6)
+
+
+@dataclass
+class ReconcileReport:
+    sheet_rows_scanned: int = 0
+    db_rows_checked: int = 0
+    reappended: list[int] = field(default_factory=list)
+    missing_from_db: list[int] = field(default_factory=list)
+    mismatched: list[int] = field(default_factory=list)
+    deferred: int = 0
+    stuck: list[int] = field(default_factory=list)
+    verified_id: int = 0
+    seconds: float = 0.0
+    # نسخة ثانية كانت عم تعمل المطابقة
+    skipped: bool = False
+
+    @property
+    def clean(self) -> bool:
+        return not (self.reappended or self.missing_from_db or self.mismatched or self.stuck)
+
+    def summary(self) -> str:
+        def ids(values: list[int]) -> str:
+            shown = ", ".join(map(str, values[:20]))
+            return shown + (f" … (+{len(values) - 20})" if len(values) > 20 else "")
+
+        if self.skipped:
+            return "⏭ نسخة ثانية من البوت عم تعمل مطابقة هلق. جرّب بعد شوي."
+        lines = [
+            f"🔎 مطابقة الشيت مع القاعدة ({self.seconds:.1f}s)",
+            f"صفوف الشيت المفحوصة: {self.sheet_rows_scanned}",
+            f"تسجيلات القاعدة المفحوصة: {self.db_rows_checked}",
+            f"آخر reg_id متحقق منه: {self.verified_id}",
+        ]
+        if self.reappended:
+            lines.append(f"➕ انضافوا للشيت من جديد ({len(self.reappended)}): {ids(self.reappended)}")
+        if self.missing_from_db:
+            lines.append(f"❓ بالشيت ومش بالقاعدة ({len(self.missing_from_db)}): {ids(self.missing_from_db)}")
+        if self.mismatched:
+            lines.append(f"≠ معلومات مختلفة ({len(self.mismatched)}): {ids(self.mismatched)}")
+        if self.deferred:
+            lines.append(f"⏳ مؤجلة للمرة الجاية: {self.deferred}")
+        if self.stuck:
+            lines.append(f"⚠️ عالقة بالـ outbox لأكثر من {STUCK_AFTER_RUNS} مرات ({len(self.stuck)}): {ids(self.stuck)}")
+        if self.clean:
+            lines.append("✅ ما في فروقات")
+        return "\n".join(lines)
+
+
+def _fingerprint(row: list[str]) -> int:
+    # نخزن hash للأعمدة المقارنة بدل الصف كامل، حتى مسح شيت كبير ما ياكل الذاكرة
+    return hash(tuple(str(row[i]).strip() if i < len(row) else "" for i in COMPARED_COLUMNS))
+
+
+class SheetReconciler:
+    """Diffs the registrations worksheet against the `registrations` table by
+    the reg_id in column A, and appends rows the sheet is missing.
+
+    A checkpoint keeps the last sheet row read, the highest reg_id checked,
+    and the ids that couldn't be checked yet (still queued for the sheet or
+    inside the grace period). Each run reads only the new part of the sheet
+    (with batch_get, RANGES_PER_CALL ranges per request), the newer
+    registrations and the deferred ids, so a row stuck in an outbox costs
+    one lookup per run instead of pinning the watermark.
+
+    Queued rows come from the store's sheet_pending table, which every
+    replica's bot writes, not from this process's outbox; and a lease on the
+    store lets only one replica reconcile at a time."""
+
+    def __init__(
+        self,
+        store: RegistrationStore,
+        client: SheetClient,
+        spreadsheet_id: str,
+        worksheet: str,
+        grace: timedelta = RECONCILE_GRACE,
+        lost_after: timedelta = RECONCILE_LOST_AFTER,
+        owner: str = REPLICA_ID,
+    ):
+        self.store = store
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet
+        client.wanted.add(worksheet)
+        self.grace = grace
+        self.lost_after = lost_after
+        self.owner = owner
+        self.checkpoint_name = f"reconcile:{spreadsheet_id}:{worksheet}"
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def _read_sheet(self, first_row: int) -> tuple[dict[int, int], int, int]:
+        """Read from `first_row` to the end; return (fingerprint of the latest
+        row per reg_id, last non-empty row number, rows scanned)."""
+        latest: dict[int, int] = {}
+        last_row = first_row - 1
+        scanned = 0
+        start = first_row
+        while True:
+            starts = [start + i * READ_RANGE_ROWS for i in range(RANGES_PER_CALL)]
+            ranges = [f"A{s}:G{s + READ_RANGE_ROWS - 1}" for s in starts]
+            results = await asyncio.to_thread(self.client.batch_get, self.worksheet, ranges)
+            for range_start, values in zip(starts, results):
+                for offset, row in enumerate(values):
+                    scanned += 1
+                    if not row:
+                        continue
+                    last_row = range_start + offset
+                    try:
+                        reg_id = int(str(row[0]).strip())
+                    except ValueError:
+                        continue  # عنوان أو صف مكتوب باليد
+                    # التحديثات بتنضاف تحت، فآخر صف هو المعتمد
+                    latest[reg_id] = _fingerprint(row)
+                if len(values) < READ_RANGE_ROWS:
+                    return latest, last_row, scanned
+            start = starts[-1] + READ_RANGE_ROWS
+
+    async def run_once(self) -> ReconcileReport:
+        async with self._lock, hold_lease(self.store, self.checkpoint_name, owner=self.owner) as lease:
+            if not lease.held:
+                log.info("Another replica is reconciling %r, skipping", self.worksheet)
+                return ReconcileReport(skipped=True)
+            return await self._run_once(lease)
+
+    async def _db_rows(self, verified_id: int, deferred: list[int]):
+        """The deferred rows, then every registration after verified_id."""
+        if deferred:
+            yield await self.store.registrations_by_ids(deferred)
+        after_id = verified_id
+        while True:
+            rows = await self.store.registrations_after(after_id, DB_CHUNK_ROWS)
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    async def _run_once(self, lease: Lease) -> ReconcileReport:
+        started = time.perf_counter()
+        report = ReconcileReport()
+        state = await self.store.get_checkpoint(self.checkpoint_name) or {}
+        sheet_row = state.get("sheet_row", 0)
+        verified_id = state.get("verified_id", 0)
+        # reg_id -> كم مرة انأجل
+        deferred_before = {int(k): v for k, v in state.get("deferred", {}).items()}
+        # reg_ids مؤجلة شفناها بالشيت بمرات سابقة
+        seen_before = set(state.get("seen", ()))
+
+        sheet, last_row, report.sheet_rows_scanned = await self._read_sheet(sheet_row + 1)
+        now = datetime.utcnow()
+        cutoff = (now - self.grace).isoformat()
+        lost_cutoff = (now - self.lost_after).isoformat()
+        pending: set[int] = set()
+        lost_keys: list[str] = []
+        queued_ids: set[int] = set()
+        for key, reg_id, queued_at in await self.store.sheet_pending():
+            queued_ids.add(reg_id)
+            if queued_at > lost_cutoff:
+                pending.add(reg_id)
+            else:
+                lost_keys.append(key)
+
+        missing_rows: list[list[str]] = []
+        checked: set[int] = set()
+        deferred: dict[int, int] = {}
+        new_verified = verified_id
+        # تحديثات لتسجيلات قديمة بتكون تحت الـ watermark، فمنجيبها بالـ id كمان
+        recheck = {reg_id for reg_id in deferred_before.keys() | queued_ids if reg_id <= verified_id}
+        async for rows in self._db_rows(verified_id, sorted(recheck)):
+            for reg_id, username, full_name, gender, grade, track_title, option_title, created_at in rows:
+                report.db_rows_checked += 1
+                checked.add(reg_id)
+                new_verified = max(new_verified, reg_id)
+                expected = registration_sheet_row(reg_id, username, full_name, gender, grade, track_title, option_title)
+                if reg_id in pending or created_at > cutoff:
+                    # ممكن توصل بأي لحظة؛ منرجع نفحصها المرة الجاية
+                    deferred[reg_id] = deferred_before.get(reg_id, 0) + 1
+                    continue
+                if reg_id in sheet:
+                    if sheet[reg_id] != _fingerprint(expected):
+                        report.mismatched.append(reg_id)
+                elif reg_id not in seen_before:
+                    missing_rows.append(expected)
+                    report.reappended.append(reg_id)
+        report.deferred = len(deferred)
+        report.stuck = sorted(reg_id for reg_id, runs in deferred.items() if runs > STUCK_AFTER_RUNS)
+
+        unknown = [reg_id for reg_id in sheet if reg_id not in checked]
+        if unknown:
+            existing = await self.store.existing_ids(unknown)
+            report.missing_from_db = sorted(set(unknown) - existing)
+
+        if lease.lost:
+            # نسخة ثانية أخذت المطابقة بالنص؛ هي بتكمل، ونحنا ما منضيف ولا منحفظ شي
+            log.warning("Lost the reconcile lease for %r mid-run, dropping this run", self.worksheet)
+            report.skipped = True
+            return report
+
+        if missing_rows:
+            # طلب واحد لكل الناقص
+            await asyncio.to_thread(self.client.append_rows, self.worksheet, missing_rows)
+            log.warning("Re-appended %d registrations missing from %r", len(missing_rows), self.worksheet)
+
+        # اللي اعتبرناه ضايع انفحص (أو انضاف) هالمرة
+        await self.store.clear_sheet_pending(lost_keys)
+        await self.store.set_checkpoint(self.checkpoint_name, {
+            "sheet_row": last_row,
+            "verified_id": new_verified,
+            "deferred": {str(reg_id): runs for reg_id, runs in deferred.items()},
+            "seen": sorted(reg_id for reg_id in seen_before | set(sheet) if reg_id in deferred),
+        })
+        report.verified_id = new_verified
+        report.seconds = time.perf_counter() - started
+        if not report.clean:
+            log.warning("Reconciliation of %r found differences:\n%s", self.worksheet, report.summary())
+        return report
+
+    async def _loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("Reconciliation of %r failed", self.worksheet)
+
+    def start(self, interval: float = RECONCILE_INTERVAL) -> None:
+        if self._task is None and interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
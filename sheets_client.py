@@ -0,0 +1,144 @@
+# cSpell:disable
+import time
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from metrics import RATE_LIMITED
+
+if TYPE_CHECKING:
+    import gspread
+
+log = logging.getLogger("sheets-client")
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# الـ worksheet المخزّن ما عاد صالح (انحذف/تغيّر اسمه) ولم يُكتب شيء: 404، أو 400
+# لأن gspread بيبعت الاسم القديم بالـ range. باقي الـ 400 أخطاء بالطلب نفسه وما بتنعاد
+_STALE_RANGE_MESSAGE = "Unable to parse range"
+
+
+def _is_stale_handle(e: "gspread.exceptions.APIError") -> bool:
+    status = e.response.status_code
+    return status == 404 or (status == 400 and _STALE_RANGE_MESSAGE in str(e.error.get("message", "")))
+
+
+def _gspread():
+    # gspread وgoogle-auth بطيئين بالاستيراد؛ ما منحتاجهم قبل أول كتابة (أو warm)
+    import gspread
+    return gspread
+
+
+class SheetClient:
+    """Long-lived gspread client: credentials, spreadsheet and worksheet handles
+    are resolved once and reused for every append.
+
+    gspread and google-auth are imported on first use, not at module load."""
+
+    def __init__(self, creds_file: str, spreadsheet_id: str, scopes: list[str] = SCOPES):
+        self.creds_file = creds_file
+        self.spreadsheet_id = spreadsheet_id
+        self.scopes = scopes
+        self._lock = threading.Lock()
+        self._gc: "gspread.Client | None" = None
+        self._sh: "gspread.Spreadsheet | None" = None
+        self._worksheets: dict[str, "gspread.Worksheet"] = {}
+        # الـ worksheets اللي رح نكتب عليها، حتى warm() يجهّزها سلفاً
+        self.wanted: set[str] = set()
+
+    def _spreadsheet(self) -> "gspread.Spreadsheet":
+        if self._sh is None:
+            if self._gc is None:
+                from google.oauth2.service_account import Credentials
+
+                # gspread's AuthorizedSession refreshes the token by itself, and
+                # only once it has expired, so the credentials are built once.
+                creds = Credentials.from_service_account_file(self.creds_file, scopes=self.scopes)
+                self._gc = _gspread().authorize(creds)
+            self._sh = self._gc.open_by_key(self.spreadsheet_id)
+        return self._sh
+
+    def worksheet(self, name: str) -> "gspread.Worksheet":
+        ws = self._worksheets.get(name)
+        if ws is not None:
+            return ws
+        with self._lock:
+            ws = self._worksheets.get(name)
+            if ws is None:
+                ws = self._spreadsheet().worksheet(name)
+                self._worksheets[name] = ws
+            return ws
+
+    def invalidate(self, name: str | None = None) -> None:
+        with self._lock:
+            if name is None:
+                self._worksheets.clear()
+                self._sh = None
+            else:
+                self._worksheets.pop(name, None)
+
+    def _call(self, worksheet_name: str, fn):
+        try:
+            return fn(self.worksheet(worksheet_name))
+        except _gspread().exceptions.APIError as e:
+            if e.response.status_code == 429:
+                RATE_LIMITED.labels("sheets").inc()
+            # 429 و5xx ما بيعنوا إنو الـ handles خربانة؛ نخليها حتى ما ندفع metadata reads مع كل retry
+            if not _is_stale_handle(e):
+                raise
+            log.warning("Worksheet %r handle looks stale (%s), re-resolving", worksheet_name, e)
+            # بس هاد الـ worksheet؛ الباقي ما إلهم علاقة
+            self.invalidate(worksheet_name)
+            return fn(self.worksheet(worksheet_name))
+
+    def append_row(self, worksheet_name: str, values: list[str]) -> None:
+        self._call(worksheet_name, lambda ws: ws.append_row(values))
+
+    def append_rows(self, worksheet_name: str, rows: list[list[str]]) -> None:
+        self._call(worksheet_name, lambda ws: ws.append_rows(rows))
+
+    def batch_get(self, worksheet_name: str, ranges: list[str]) -> list[list[list[str]]]:
+        """Values of several A1 ranges in one request; trailing empty rows
+        of each range are omitted."""
+        return self._call(worksheet_name, lambda ws: [list(r) for r in ws.batch_get(ranges)])
+
+    def warm(self) -> None:
+        """Import the Google libraries, authorize and resolve the wanted
+        worksheets, so the first real write doesn't pay for it. Blocking."""
+        for name in sorted(self.wanted):
+            self.worksheet(name)
+        if not self.wanted:
+            with self._lock:
+                self._spreadsheet()
+
+
+_clients: dict[tuple[str, str], SheetClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_sheet_client(creds_file: str, spreadsheet_id: str) -> SheetClient:
+    key = (creds_file, spreadsheet_id)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = SheetClient(creds_file, spreadsheet_id)
+        return client
+
+
+async def warm_sheet_clients() -> None:
+    """Warm every client created so far, off the event loop. Failures are
+    only logged: the first write retries through the outbox anyway."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(client.warm)
+        except Exception as e:
+            log.warning("Warming sheets client for %s failed: %s", client.spreadsheet_id, e)
+            continue
+        log.info(
+            "Sheets client for %s warm (%s) in %.2fs",
+            client.spreadsheet_id, ", ".join(sorted(client.wanted)) or "-", time.perf_counter() - started,
+        )
@@ -0,0 +1,102 @@
+# cSpell:disable
+import os
+import asyncio
+import logging
+
+from sheets_client import SheetClient, get_sheet_client
+from metrics import SHEETS_APPEND_SECONDS, SHEETS_ROWS
+
+log = logging.getLogger("sheets-writer")
+
+BATCH_MAX_ROWS = int(os.getenv("SHEETS_BATCH_MAX_ROWS", "50"))
+BATCH_MAX_DELAY = int(os.getenv("SHEETS_BATCH_MAX_DELAY_MS", "500")) / 1000
+
+
+class BatchedSheetWriter:
+    """Buffers rows per worksheet and writes them with one `append_rows` call
+    once `max_rows` rows are pending or `max_delay` seconds have passed."""
+
+    def __init__(self, client: SheetClient, max_rows: int = BATCH_MAX_ROWS, max_delay: float = BATCH_MAX_DELAY):
+        self.client = client
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._buffers: dict[str, list[tuple[list[str], asyncio.Future]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+    def submit(self, worksheet_name: str, values: list[str]) -> asyncio.Future:
+        if self._closed:
+            raise RuntimeError("BatchedSheetWriter is closed")
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        buf = self._buffers.setdefault(worksheet_name, [])
+        buf.append((values, fut))
+
+        if len(buf) >= self.max_rows:
+            self._spawn_flush(worksheet_name)
+        elif worksheet_name not in self._timers:
+            self._timers[worksheet_name] = loop.call_later(
+                self.max_delay, self._spawn_flush, worksheet_name
+            )
+        return fut
+
+    async def append(self, worksheet_name: str, values: list[str]) -> None:
+        await self.submit(worksheet_name, values)
+
+    def _spawn_flush(self, worksheet_name: str) -> None:
+        task = asyncio.get_running_loop().create_task(self.flush(worksheet_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, worksheet_name: str) -> None:
+        timer = self._timers.pop(worksheet_name, None)
+        if timer is not None:
+            timer.cancel()
+
+        # الدفعات لنفس الورقة تُكتب بالترتيب
+        lock = self._locks.setdefault(worksheet_name, asyncio.Lock())
+        async with lock:
+            batch = self._buffers.pop(worksheet_name, [])
+            if not batch:
+                return
+            try:
+                with SHEETS_APPEND_SECONDS.labels(worksheet_name).time():
+                    await asyncio.to_thread(
+                        self.client.append_rows, worksheet_name, [values for values, _ in batch]
+                    )
+            except Exception as e:
+                log.exception("Failed to append %d rows to %r", len(batch), worksheet_name)
+                SHEETS_ROWS.labels(worksheet_name, "error").inc(len(batch))
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                SHEETS_ROWS.labels(worksheet_name, "ok").inc(len(batch))
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(None)
+
+    async def aclose(self) -> None:
+        self._closed = True
+        for name in list(self._buffers):
+            await self.flush(name)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_writers: dict[int, BatchedSheetWriter] = {}
+
+
+def get_sheet_writer(creds_file: str, spreadsheet_id: str) -> BatchedSheetWriter:
+    client = get_sheet_client(creds_file, spreadsheet_id)
+    writer = _writers.get(id(client))
+    if writer is None:
+        writer = _writers[id(client)] = BatchedSheetWriter(client)
+    return writer
+
+
+async def close_sheet_writers() -> None:
+    for writer in list(_writers.values()):
+        await writer.aclose()
@@ -0,0 +1,48 @@
+# cSpell:disable
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("sqlite-db")
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",   # مع WAL: آمن ضد فساد القاعدة وبدون fsync لكل commit
+    "PRAGMA cache_size=-16000",    # ~16MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class SQLiteDatabase:
+    """One long-lived connection driven by a dedicated single-thread executor,
+    so every query runs off the event loop and in submission order."""
+
+    def __init__(self, path: str, name: str = "sqlite"):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # sqlite3 keeps compiled statements in a per-connection LRU, so the
+            # constant SQL strings below are prepared once and reused.
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._conn = conn
+        return self._conn
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connect(), *args))
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
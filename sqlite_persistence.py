@@ -0,0 +1,182 @@
+# cSpell:disable
+import os
+import json
+import asyncio
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from sqlite_db import SQLiteDatabase
+
+log = logging.getLogger("sqlite-persistence")
+
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.sqlite3")
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+
+# بعد ما يخلص PTB دورة update_persistence نكتب كل اللي تغيّر بـ transaction وحدة
+WRITE_BEHIND_DELAY = 0.25
+
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence backed by SQLite, storing user/chat/bot data and
+    conversation states as JSON.
+
+    `update_*` calls only stage the new value in memory; staged values are
+    written in a single transaction shortly after each persistence pass, and
+    on `flush()` at shutdown. Several bots can share one file by using
+    different namespaces."""
+
+    def __init__(
+        self,
+        namespace: str,
+        db_path: str = STATE_DB_PATH,
+        store_data: PersistenceInput | None = None,
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+    ):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.namespace = namespace
+        self.db = SQLiteDatabase(db_path, name="state-db")
+        self._initialized = False
+        # (kind, key) -> JSON أو None للحذف
+        self._pending: dict[tuple[str, str], str | None] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _init(conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_state (
+                namespace TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (namespace, kind, key)
+            )
+            """
+        )
+        conn.commit()
+
+    async def _ensure_init(self) -> None:
+        if not self._initialized:
+            await self.db.run(self._init)
+            self._initialized = True
+
+    @staticmethod
+    def _load(conn, namespace, kind):
+        return conn.execute(
+            "SELECT key, value FROM bot_state WHERE namespace = ? AND kind = ?", (namespace, kind)
+        ).fetchall()
+
+    @staticmethod
+    def _write(conn, namespace, items):
+        with conn:
+            conn.executemany(
+                "DELETE FROM bot_state WHERE namespace = ? AND kind = ? AND key = ?",
+                [(namespace, kind, key) for (kind, key), value in items if value is None],
+            )
+            conn.executemany(
+                """
+                INSERT INTO bot_state (namespace, kind, key, value) VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, kind, key) DO UPDATE SET value = excluded.value
+                """,
+                [(namespace, kind, key, value) for (kind, key), value in items if value is not None],
+            )
+
+    async def _load_kind(self, kind: str) -> dict[str, object]:
+        await self._ensure_init()
+        rows = await self.db.run(self._load, self.namespace, kind)
+        return {key: json.loads(value) for key, value in rows}
+
+    def _stage(self, kind: str, key: str, data) -> None:
+        try:
+            value = None if data is None else json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError):
+            log.exception("Cannot persist %s %s, value is not JSON serializable", kind, key)
+            return
+        self._pending[(kind, key)] = value
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(WRITE_BEHIND_DELAY, self._spawn_write)
+
+    def _spawn_write(self) -> None:
+        self._flush_handle = None
+        task = asyncio.get_running_loop().create_task(self._write_pending())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        items, self._pending = list(self._pending.items()), {}
+        try:
+            await self._ensure_init()
+            await self.db.run(self._write, self.namespace, items)
+        except Exception:
+            log.exception("Failed to write %d persistence entries", len(items))
+            # نرجّعها للدفعة الجاية بدون ما نغطي قيم أحدث
+            for key, value in items:
+                self._pending.setdefault(key, value)
+
+    # ---- get ----
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return {int(k): v for k, v in (await self._load_kind("user_data")).items()}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {int(k): v for k, v in (await self._load_kind("chat_data")).items()}
+
+    async def get_bot_data(self) -> dict:
+        return (await self._load_kind("bot_data")).get("", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        # مفاتيح المحادثة tuples، فتتخزن كـ JSON list
+        data = await self._load_kind(f"conv:{name}")
+        return {tuple(json.loads(k)): state for k, state in data.items()}
+
+    # ---- update ----
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._stage(f"conv:{name}", json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("user_data", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("chat_data", str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._stage("bot_data", "", data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("chat_data", str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user_data", str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self._write_pending()
+        await self.db.close()
@@ -0,0 +1,149 @@
+# cSpell:disable
+import os
+import uuid
+import asyncio
+import sqlite3
+
+import pytest
+
+from registration_store import MIGRATIONS, open_registration_store
+
+# قاعدة PostgreSQL للتجارب فقط (كل test بيعمل schema خاص فيه وبيمسحها)، مثلاً:
+# TEST_DATABASE_URL=postgresql://postgres@localhost/giras_test
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+INSERT_RAW = """
+    INSERT INTO registrations (tg_user_id, full_name, gender, grade, track_key, track_title, option_key, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class SQLiteBackend:
+    name = "sqlite"
+
+    def __init__(self, tmp_path):
+        self.location = str(tmp_path / "registrations.sqlite3")
+
+    async def setup(self) -> None:
+        pass
+
+    async def teardown(self) -> None:
+        pass
+
+    async def version(self) -> int:
+        with sqlite3.connect(self.location) as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    async def fetch(self, sql: str) -> list[tuple]:
+        with sqlite3.connect(self.location) as conn:
+            return conn.execute(sql).fetchall()
+
+    async def prepare(self, migrations: int, rows: list[tuple]) -> None:
+        """A database left at schema version `migrations`, holding `rows`."""
+        conn = sqlite3.connect(self.location)
+        with conn:
+            for number, migration in enumerate(MIGRATIONS[:migrations], start=1):
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.executemany(INSERT_RAW, rows)
+        conn.close()
+
+
+class PostgresBackend:
+    name = "postgres"
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.schema = f"test_{uuid.uuid4().hex[:12]}"
+        # باقي الـ query params بيوصلوا للسيرفر كـ settings
+        self.location = f"{dsn}{'&' if '?' in dsn else '?'}search_path={self.schema}"
+
+    async def _connect(self, dsn: str):
+        import asyncpg
+
+        return await asyncpg.connect(dsn)
+
+    async def setup(self) -> None:
+        conn = await self._connect(self.dsn)
+        try:
+            await conn.execute(f"CREATE SCHEMA {self.schema}")
+        finally:
+            await conn.close()
+
+    async def teardown(self) -> None:
+        conn = await self._connect(self.dsn)
+        try:
+            await conn.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        finally:
+            await conn.close()
+
+    async def version(self) -> int:
+        conn = await self._connect(self.location)
+        try:
+            return await conn.fetchval("SELECT version FROM schema_version")
+        finally:
+            await conn.close()
+
+    async def fetch(self, sql: str) -> list[tuple]:
+        conn = await self._connect(self.location)
+        try:
+            return [tuple(row) for row in await conn.fetch(sql)]
+        finally:
+            await conn.close()
+
+    async def prepare(self, migrations: int, rows: list[tuple]) -> None:
+        from registration_store_pg import PG_MIGRATIONS, pg_sql
+
+        conn = await self._connect(self.location)
+        try:
+            await conn.execute("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+            await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", migrations)
+            for migration in PG_MIGRATIONS[:migrations]:
+                await conn.execute(migration)
+            await conn.executemany(pg_sql(INSERT_RAW), rows)
+        finally:
+            await conn.close()
+
+
+def _postgres_param():
+    skip = None
+    if not TEST_DATABASE_URL:
+        skip = "TEST_DATABASE_URL is not set"
+    else:
+        try:
+            import asyncpg  # noqa: F401
+        except ImportError:
+            skip = "asyncpg is not installed"
+    return pytest.param("postgres", marks=pytest.mark.skipif(skip is not None, reason=skip or ""))
+
+
+@pytest.fixture(params=["sqlite", _postgres_param()])
+def backend(request, tmp_path):
+    backend = SQLiteBackend(tmp_path) if request.param == "sqlite" else PostgresBackend(TEST_DATABASE_URL)
+    asyncio.run(backend.setup())
+    yield backend
+    asyncio.run(backend.teardown())
+
+
+@pytest.fixture
+def with_store(backend):
+    """Run `body(store)` (or `body(store_a, store_b)` with stores=2) on a
+    fresh event loop, with initialized stores that are closed afterwards.
+    Two stores on one database stand in for two bot replicas."""
+
+    def run(body, capacities=None, stores: int = 1):
+        async def main():
+            opened = []
+            try:
+                for _ in range(stores):
+                    store = open_registration_store(backend.location, capacities)
+                    await store.init()
+                    opened.append(store)
+                return await body(*opened)
+            finally:
+                for store in opened:
+                    await store.close()
+
+        return asyncio.run(main())
+
+    return run
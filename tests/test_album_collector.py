@@ -0,0 +1,101 @@
+# cSpell:disable
+import asyncio
+from types import SimpleNamespace
+
+import contribution_bot
+from album_collector import ALBUM_MAX_ITEMS, AlbumCollector
+from contribution_bot import ContributionBotConfig
+from outbox import SheetOutbox
+
+
+class FakePart:
+    """One photo of an album, with the fields _submit reads."""
+
+    def __init__(self, message_id, media_group_id="g1", chat_id=5):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.text = None
+        self.caption = f"part {message_id}"
+        self.photo = [SimpleNamespace(file_id=f"f{message_id}", file_unique_id=f"u{message_id}")]
+        self.document = self.voice = self.audio = self.video = self.video_note = self.sticker = None
+        self.replies: list[str] = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+def collecting():
+    albums = []
+
+    async def on_complete(messages):
+        albums.append([m.message_id for m in messages])
+
+    return albums, on_complete
+
+
+def test_debounce_restarts_with_each_part():
+    async def main():
+        albums, on_complete = collecting()
+        collector = AlbumCollector(delay=0.1)
+        collector.add(FakePart(2), on_complete)
+        await asyncio.sleep(0.07)
+        collector.add(FakePart(1), on_complete)
+        # 0.14 من أول جزء بس 0.07 من آخر جزء
+        await asyncio.sleep(0.07)
+        assert albums == [] and collector.pending() == 1
+        await asyncio.sleep(0.06)
+        assert albums == [[1, 2]] and collector.pending() == 0
+
+    asyncio.run(main())
+
+
+def test_the_last_possible_part_completes_the_album_at_once():
+    async def main():
+        albums, on_complete = collecting()
+        collector = AlbumCollector(delay=60)
+        for message_id in range(ALBUM_MAX_ITEMS, 0, -1):
+            collector.add(FakePart(message_id), on_complete)
+        # ألبوم ثاني بنفس الشات ما بيتأثر
+        collector.add(FakePart(50, "g2"), on_complete)
+        await asyncio.sleep(0)
+        assert albums == [list(range(1, ALBUM_MAX_ITEMS + 1))]
+        assert collector.pending() == 1
+        await collector.flush()
+        assert albums[-1] == [50]
+
+    asyncio.run(main())
+
+
+def test_one_album_is_one_submission(tmp_path, monkeypatch):
+    async def main():
+        outbox = SheetOutbox(str(tmp_path / "outbox.sqlite3"))
+        await outbox.init()
+        monkeypatch.setattr(contribution_bot, "OUTBOX", outbox)
+        config = ContributionBotConfig("test", "Sheet1", admin_chat_id="", greeting="", name_ack="")
+        app = SimpleNamespace(bot_data={})
+        user = SimpleNamespace(id=7, username="student", full_name="Student")
+        collector = AlbumCollector(delay=0.05)
+
+        async def deliver(parts):
+            for part in parts:
+                collector.add(part, lambda messages: contribution_bot._submit(app, config, user, 5, "Ali", messages))
+            await asyncio.sleep(0.1)
+
+        try:
+            parts = [FakePart(message_id) for message_id in (12, 10, 11)]
+            await deliver(parts)
+            # Telegram أعاد نفس الألبوم
+            await deliver([FakePart(message_id) for message_id in (10, 11, 12)])
+
+            due = await outbox.due(config.spreadsheet_id, "Sheet1", 10)
+            assert [key for _, _, _, key in due] == ["album:5:g1:10"]
+            [(_, row, _, _)] = due
+            assert row[5] == "album:photo (3)"
+            assert row[-1] == "f10\nf11\nf12"
+            # رد وحيد للطالب على كل تسليم
+            assert parts[1].replies == ["تم استلام مشروعك بنجاح ✅"]
+        finally:
+            await outbox.close()
+
+    asyncio.run(main())
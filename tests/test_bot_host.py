@@ -0,0 +1,81 @@
+# cSpell:disable
+import json
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from tornado.testing import AsyncHTTPTestCase
+
+import bot_host
+from bot_host import SECRET_HEADER, MetricsServer, WebhookServer
+from metrics import Registry
+
+
+class PublicListenerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return WebhookServer("0.0.0.0", 0).application()
+
+    def test_metrics_are_not_served(self):
+        assert self.fetch("/metrics").code == 404
+
+
+class MetricsListenerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        # بدون collectors البوتات (الـ outbox بيفتح ملف بالـ cwd)
+        patcher = mock.patch.object(bot_host, "REGISTRY", Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return MetricsServer("127.0.0.1", 0, token="s3cret").application()
+
+    def test_the_token_is_required(self):
+        response = self.fetch("/metrics")
+        assert response.code == 401
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+        assert self.fetch("/metrics", headers={"Authorization": "Bearer wrong"}).code == 401
+
+        response = self.fetch("/metrics", headers={"Authorization": "Bearer s3cret"})
+        assert response.code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+
+
+class WebhookTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.app = SimpleNamespace(update_queue=asyncio.Queue(), bot=None, update_processor=None)
+        server = WebhookServer("0.0.0.0", 0)
+        server.add_bot("test", "hook", self.app, "s3cret")
+        return server.application()
+
+    def post(self, update_id, secret="s3cret"):
+        return self.fetch(
+            "/hook", method="POST", headers={SECRET_HEADER: secret},
+            body=json.dumps({"update_id": update_id}),
+        )
+
+    def test_a_bad_secret_is_forbidden(self):
+        assert self.post(1, secret="wrong").code == 403
+        assert self.post(1, secret="").code == 403
+        assert self.app.update_queue.empty()
+
+    def test_a_duplicate_is_acknowledged_but_not_queued(self):
+        assert self.post(1).code == 200
+        assert self.post(1).code == 200
+        assert self.app.update_queue.qsize() == 1
+        assert self.app.update_queue.get_nowait().update_id == 1
+
+    def test_a_full_queue_asks_telegram_to_retry(self):
+        with mock.patch.object(bot_host, "WEBHOOK_MAX_QUEUE", 2):
+            assert [self.post(n).code for n in (1, 2)] == [200, 200]
+            response = self.post(3)
+            assert response.code == 503
+            assert response.headers["Retry-After"] == "5"
+            assert self.app.update_queue.qsize() == 2
+
+            # ما انحسب seen، فإعادة الإرسال بعد ما يفضى الطابور بتنقبل
+            self.app.update_queue.get_nowait()
+            assert self.post(3).code == 200
+            assert self.app.update_queue.qsize() == 2
+
+    def test_shedding_can_drop_instead(self):
+        with mock.patch.object(bot_host, "WEBHOOK_MAX_QUEUE", 1), mock.patch.object(bot_host, "WEBHOOK_SHED", "drop"):
+            assert [self.post(n).code for n in (1, 2)] == [200, 200]
+            assert self.app.update_queue.qsize() == 1
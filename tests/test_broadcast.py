@@ -0,0 +1,82 @@
+# cSpell:disable
+import asyncio
+
+from broadcast import Broadcaster
+from registration_export import ExportFilters
+from registration_store import DONE, PENDING, RUNNING, SENT, UNKNOWN
+
+
+class FakeBot:
+    """Records copy_message calls; every copy takes `delay` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.copies: list[int] = []
+        self.reports: list[int] = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        await asyncio.sleep(self.delay)
+        self.copies.append(chat_id)
+
+    async def send_message(self, chat_id, text):
+        self.reports.append(chat_id)
+
+
+async def running_broadcast(store, users):
+    for user_id in users:
+        await store.upsert(user_id, None, f"Student {user_id}", "m", "g4", "t1", "T1", None, None)
+    broadcast_id = await store.create_broadcast(100, 5, ExportFilters(), created_by=100)
+    await store.set_broadcast_status(broadcast_id, RUNNING, ("draft",))
+    return broadcast_id
+
+
+async def wait_for_report(bot):
+    # الملخّص بينبعت بعد ما يصير DONE
+    for _ in range(300):
+        if bot.reports:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("broadcast never finished")
+
+
+def test_only_one_replica_sends_a_broadcast(with_store):
+    async def body(replica_a, replica_b):
+        broadcast_id = await running_broadcast(replica_a, range(1, 31))
+        bot = FakeBot(delay=0.001)
+        broadcasters = [
+            Broadcaster(store, bot, rate_per_second=1000, poll_seconds=0.01, owner=owner)
+            for store, owner in ((replica_a, "a"), (replica_b, "b"))
+        ]
+        for broadcaster in broadcasters:
+            broadcaster.start()
+        await wait_for_report(bot)
+        for broadcaster in broadcasters:
+            await broadcaster.stop()
+
+        assert sorted(bot.copies) == list(range(1, 31))
+        assert bot.reports == [100]
+        assert (await replica_a.get_broadcast(broadcast_id))["status"] == DONE
+        assert await replica_a.broadcast_progress(broadcast_id) == {SENT: 30}
+
+    with_store(body, stores=2)
+
+
+def test_next_holder_abandons_deliveries_left_pending(with_store):
+    async def body(replica_a, replica_b):
+        broadcast_id = await running_broadcast(replica_a, range(1, 6))
+        # النسخة a انقطعت بعد ما حجزت أول اثنين وقبل ما تسجّل شي
+        assert await replica_a.claim_broadcast_recipients(broadcast_id, ExportFilters(), 2) == [1, 2]
+        assert (await replica_a.broadcast_progress(broadcast_id)) == {PENDING: 2}
+
+        bot = FakeBot()
+        broadcaster = Broadcaster(replica_b, bot, rate_per_second=1000, poll_seconds=0.01, owner="b")
+        broadcaster.start()
+        await wait_for_report(bot)
+        await broadcaster.stop()
+
+        assert sorted(bot.copies) == [3, 4, 5]
+        assert await replica_b.broadcast_progress(broadcast_id) == {SENT: 3, UNKNOWN: 2}
+        # انتهى، فالـ lease تحرر
+        assert await replica_a.acquire_lease("broadcast", "a", 60)
+
+    with_store(body, stores=2)
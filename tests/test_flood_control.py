@@ -0,0 +1,108 @@
+# cSpell:disable
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+from flood_control import FloodGuard, flood_filter
+
+
+def test_window_allows_a_burst_then_recovers_gradually():
+    guard = FloodGuard(window=10, burst=3, idle=60)
+    assert [guard.allow(1, now=t) for t in (0, 1, 2, 3)] == [True, True, True, False]
+    # مستخدم ثاني عنده حده الخاص
+    assert guard.allow(2, now=3)
+    # نافذة جديدة بس السابقة لسا بتوزن: 3 * 0.8 = 2.4 → وحدة بس
+    assert guard.allow(1, now=12)
+    assert not guard.allow(1, now=12.5)
+    # بعد نافذتين ما في شي من قبل
+    assert [guard.allow(1, now=40 + t) for t in range(4)] == [True, True, True, False]
+
+
+def test_album_parts_count_once():
+    guard = FloodGuard(window=10, burst=2, idle=60)
+    assert all(guard.allow(1, "album", now=0.1 * n) for n in range(10))
+    assert guard.allow(1, now=2)
+    assert not guard.allow(1, now=3)
+
+
+@pytest.mark.parametrize("times", [(0, 1, 2), (0, 9.5, 9.9), (0, 5, 12, 13, 14)])
+def test_retry_in_is_when_the_next_message_gets_through(times):
+    guard = FloodGuard(window=10, burst=3, idle=60)
+    for t in times:
+        guard.allow(1, now=t)
+    now = times[-1] + 0.01
+    wait = guard.retry_in(1, now=now)
+    if wait > 0:
+        assert not guard.allow(1, now=now + wait - 0.05)
+    assert guard.allow(1, now=now + wait + 0.01)
+
+
+def test_idle_users_are_evicted():
+    guard = FloodGuard(window=1, burst=3, idle=10, max_users=3)
+    for user_id in range(3):
+        guard.allow(user_id, now=user_id)
+    assert len(guard) == 3
+    # 0 و 1 ما بعتوا من 10 ثواني
+    guard.allow(5, now=11.5)
+    assert len(guard) == 2
+    # فوق max_users بينشال الأقدم حتى لو مش idle
+    for user_id in range(6, 9):
+        guard.allow(user_id, now=12)
+    assert len(guard) == 3
+    assert 2 not in guard._users and 5 not in guard._users
+
+
+class FakeMessage:
+    def __init__(self, kind, text=None, media_group_id=None):
+        self.kind = kind
+        self.text = text
+        self.media_group_id = media_group_id
+        self.replies: list[str] = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+def update_for(user_id, kind, text=None):
+    return SimpleNamespace(
+        effective_message=FakeMessage(kind, text),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(type="private"),
+    )
+
+
+def test_filter_applies_the_type_policy_and_coalesces_text():
+    async def main():
+        guard = FloodGuard(window=0.2, burst=2, idle=60, rejected_types=frozenset({"sticker"}))
+        check = flood_filter(guard, "test", lambda m: m.kind)
+        context = SimpleNamespace(application=SimpleNamespace(update_queue=asyncio.Queue()))
+
+        async def passes(update):
+            try:
+                await check(update, context)
+                return True
+            except ApplicationHandlerStop:
+                return False
+
+        sticker = update_for(1, "sticker")
+        assert not await passes(sticker)
+        assert sticker.effective_message.replies
+        # الأوامر ما بتنرفض بسبب النوع
+        assert await passes(update_for(1, "text", "/start"))
+
+        # فوق الحد: الصورة بتنرمى، وآخر نص بس بيضل ناطر
+        photo, first, latest = update_for(1, "photo"), update_for(1, "text", "1"), update_for(1, "text", "2")
+        assert not await passes(photo)
+        assert not await passes(first)
+        assert not await passes(latest)
+        assert context.application.update_queue.empty()
+
+        replayed = await asyncio.wait_for(context.application.update_queue.get(), 1)
+        assert replayed is latest
+        assert await passes(replayed)
+        await asyncio.sleep(0.3)
+        assert context.application.update_queue.empty()
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# cSpell:disable
+import os
+import asyncio
+import hashlib
+
+import httpx
+from telegram.error import BadRequest, NetworkError
+
+from media_archive import MediaArchive, MediaArchiver, MediaRef
+
+CONTENT = b"x" * 200_000
+
+
+class FakeBot:
+    """get_file raises `error` while it is set, else points at /<file_id>."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def get_file(self, file_id):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return type("File", (), {"file_path": f"https://files.test/{file_id}.mp4"})()
+
+
+def files_server(request):
+    return httpx.Response(200, content=CONTENT)
+
+
+async def archiver_for(tmp_path, bot):
+    archive = MediaArchive(str(tmp_path / "archive.sqlite3"))
+    await archive.init()
+    archiver = MediaArchiver(archive, bot, "bot", str(tmp_path / "files"), concurrency=2)
+    await archiver.start()
+    await archiver._http.aclose()
+    archiver._http = httpx.AsyncClient(transport=httpx.MockTransport(files_server))
+    return archive, archiver
+
+
+def test_downloads_to_disk_and_dedupes_by_content(tmp_path):
+    async def main():
+        archive, archiver = await archiver_for(tmp_path, FakeBot())
+        try:
+            await archiver.submit("msg:1:1", 7, MediaRef("video", "f1", "u1"))
+            await archiver.submit("msg:1:2", 8, MediaRef("video", "f2", "u2"))
+            await archiver._queue.join()
+            rows = await archive.locate(["f1", "f2", "missing"])
+        finally:
+            await archiver.stop()
+            await archive.close()
+        assert [(file_id, status, size) for file_id, _, status, _, size, _ in rows] == [
+            ("f1", "done", len(CONTENT)), ("f2", "done", len(CONTENT)),
+        ]
+        digest = hashlib.sha256(CONTENT).hexdigest()
+        assert rows[0][3].endswith(os.path.join("7", digest[:16] + ".mp4"))
+        assert os.path.getsize(rows[1][3]) == len(CONTENT)
+        assert not [name for _, _, names in os.walk(tmp_path / "files") for name in names if name.endswith(".part")]
+
+    asyncio.run(main())
+
+
+def test_permanent_errors_fail_at_once_and_transient_ones_retry(tmp_path):
+    async def main():
+        archive, archiver = await archiver_for(tmp_path, FakeBot(BadRequest("File is too big")))
+        try:
+            await archiver.submit("msg:1:1", 7, MediaRef("video", "big", "u1"))
+            await archiver._queue.join()
+            assert not archiver._retries
+            assert [row[2] for row in await archive.locate(["big"])] == ["failed"]
+
+            archiver.bot.error = NetworkError("connection reset")
+            await archiver.submit("msg:1:2", 7, MediaRef("video", "flaky", "u2"))
+            await archiver._queue.join()
+            assert len(archiver._retries) == 1
+            assert [row[2] for row in await archive.locate(["flaky"])] == ["pending"]
+        finally:
+            await archiver.stop()
+            await archive.close()
+
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+# cSpell:disable
+import time
+import asyncio
+
+from outbox import SENT_RETENTION_SECONDS, OutboxDrainer, SheetOutbox
+from sheets_writer import BatchedSheetWriter
+
+
+class FakeSheetClient:
+    """Appended rows per worksheet; raises `error` while it is set."""
+
+    def __init__(self):
+        self.wanted: set[str] = set()
+        self.rows: list[list[str]] = []
+        self.error: Exception | None = None
+
+    def append_rows(self, worksheet_name, rows):
+        if self.error:
+            raise self.error
+        self.rows += rows
+
+
+def with_outbox(tmp_path, body):
+    async def main():
+        outbox = SheetOutbox(str(tmp_path / "outbox.sqlite3"))
+        await outbox.init()
+        client = FakeSheetClient()
+        writer = BatchedSheetWriter(client, max_rows=50, max_delay=0.01)
+        sent_keys = []
+
+        async def on_sent(keys):
+            sent_keys.extend(keys)
+
+        drainer = OutboxDrainer(outbox, writer, "spreadsheet", "Sheet1", base_delay=10, on_sent=on_sent)
+        try:
+            await body(outbox, client, drainer, sent_keys)
+        finally:
+            await writer.aclose()
+            await outbox.close()
+
+    asyncio.run(main())
+
+
+def backdate(outbox, column, seconds):
+    def update(conn):
+        conn.execute(f"UPDATE sheet_outbox SET {column} = {column} - ?", (seconds,))
+        conn.commit()
+
+    return outbox.run(update)
+
+
+def test_a_key_is_queued_and_sent_once(tmp_path):
+    async def body(outbox, client, drainer, sent_keys):
+        assert await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1", "أحمد"])
+        assert not await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1", "changed"])
+        # نفس المفتاح بورقة ثانية صف مختلف
+        assert await outbox.enqueue("spreadsheet", "Sheet2", "reg:1", ["1"])
+        assert await outbox.pending_keys("spreadsheet", "Sheet1") == {"reg:1"}
+
+        assert await drainer.drain_once() == 0.0
+        assert client.rows == [["1", "أحمد"]]
+        assert sent_keys == ["reg:1"]
+        # Telegram أعاد التحديث بعد ما انبعت: ما في صف ثاني
+        assert not await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1", "أحمد"])
+        assert await drainer.drain_once() == drainer.idle_interval
+        assert client.rows == [["1", "أحمد"]]
+
+    with_outbox(tmp_path, body)
+
+
+def test_failed_rows_back_off_and_are_retried(tmp_path):
+    async def body(outbox, client, drainer, sent_keys):
+        await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1"])
+        client.error = RuntimeError("quota exceeded")
+        delay = await drainer.drain_once()
+        # base_delay * 2**0 مع jitter بين النص والكل
+        assert 10 * 0.5 - 1 <= delay <= 10
+        assert await outbox.due("spreadsheet", "Sheet1", 50) == []
+        assert await outbox.pending_keys("spreadsheet", "Sheet1") == {"reg:1"}
+        assert 0 < await drainer.drain_once() <= 10
+        assert sent_keys == []
+
+        client.error = None
+        await backdate(outbox, "next_attempt_at", 60)
+        [(_, _, attempts, _)] = await outbox.due("spreadsheet", "Sheet1", 50)
+        assert attempts == 1
+        assert await drainer.drain_once() == 0.0
+        assert client.rows == [["1"]] and sent_keys == ["reg:1"]
+
+        # المحاولة الثانية بتستنى أكثر
+        await outbox.enqueue("spreadsheet", "Sheet1", "reg:2", ["2"])
+        client.error = RuntimeError("still down")
+        await drainer.drain_once()
+        await backdate(outbox, "next_attempt_at", 60)
+        started = time.time()
+        delay = await drainer.drain_once()
+        assert 20 * 0.5 - 1 <= delay <= 20 + (time.time() - started)
+
+    with_outbox(tmp_path, body)
+
+
+def test_sent_rows_are_kept_for_the_retention_period(tmp_path):
+    async def body(outbox, client, drainer, sent_keys):
+        await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1"])
+        await drainer.drain_once()
+        await backdate(outbox, "sent_at", SENT_RETENTION_SECONDS - 3600)
+        await outbox.enqueue("spreadsheet", "Sheet1", "reg:2", ["2"])
+        await drainer.drain_once()
+        # لسا جوا المدة: نفس المفتاح بيضل مرفوض
+        assert not await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1"])
+
+        await backdate(outbox, "sent_at", 2 * 3600)
+        await outbox.enqueue("spreadsheet", "Sheet1", "reg:3", ["3"])
+        await drainer.drain_once()
+        # انمسح مع الإرسال اللي بعده، فالمفتاح صار جديد
+        assert await outbox.enqueue("spreadsheet", "Sheet1", "reg:1", ["1"])
+        assert not await outbox.enqueue("spreadsheet", "Sheet1", "reg:2", ["2"])
+
+    with_outbox(tmp_path, body)
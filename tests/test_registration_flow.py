@@ -0,0 +1,108 @@
+# cSpell:disable
+import asyncio
+import importlib.util
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from outbox import SheetOutbox
+from registration_store import open_registration_store
+from track_catalog import load_catalog
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "class_4-6_male.py")
+
+
+@pytest.fixture(scope="module")
+def bot():
+    spec = importlib.util.spec_from_file_location("registration_bot", BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeQuery:
+    def __init__(self, user_id, data):
+        self.id = f"q{user_id}"
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}")
+        self.texts: list[str] = []
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.texts.append(text)
+
+
+async def confirm(bot, user_id, track_key, option_key=None):
+    q = FakeQuery(user_id, "confirm")
+    user_data = {
+        "full_name": f"Student {user_id}", "gender": "ذكر", "gender_key": "m",
+        "grade": "الصف الرابع", "grade_key": "g4", "track_key": track_key, "option_key": option_key,
+    }
+    state = await bot.confirm_step(SimpleNamespace(callback_query=q), SimpleNamespace(user_data=user_data))
+    return state, q.texts[-1]
+
+
+def test_confirm_step_reports_a_full_track(bot, backend, monkeypatch, tmp_path):
+    async def main():
+        store = open_registration_store(backend.location, capacities={("m46_t2", ""): 1})
+        outbox = SheetOutbox(str(tmp_path / "outbox.sqlite3"))
+        await store.init()
+        await outbox.init()
+        monkeypatch.setattr(bot, "STORE", store)
+        monkeypatch.setattr(bot, "OUTBOX", outbox)
+        try:
+            state, text = await confirm(bot, 1, "m46_t2", "o1")
+            assert state == bot.ConversationHandler.END and "تم تسجيلك" in text
+
+            state, text = await confirm(bot, 2, "m46_t2", "o2")
+            assert state == bot.TRACK and "اكتمل العدد" in text
+            assert not store.is_registered(2, "m46_t2")
+            assert bot.track_is_full(bot.CATALOG.by_key["m46_t2"])
+            # صف واحد بس رايح عالشيت
+            assert await outbox.pending_keys(bot.SPREADSHEET_ID, bot.WORKSHEET_NAME) == {
+                f"reg:{(await store.latest_for_user(1))[0]}"
+            }
+        finally:
+            await store.close()
+            await outbox.close()
+
+    asyncio.run(main())
+
+
+def test_track_capacities_come_from_the_environment(bot, monkeypatch):
+    monkeypatch.setenv("TRACK_CAPACITIES", "m46_t2=40, f46_t2=40, m46_t2:o3=10")
+    catalog = load_catalog(bot.TRACKS_MATRIX)
+    assert catalog.capacities() == {("m46_t2", ""): 40, ("m46_t2", "o3"): 10, ("f46_t2", ""): 40}
+    assert catalog.by_key["m46_t2"].options_by_key["o3"].title == "المسار المرئي"
+    # الـ matrix الأصلي ما بيتغيّر
+    assert "capacity" not in bot.TRACKS_MATRIX["m"]["grp_4_6"]["m46_t2"]
+
+    for bad in ("m46_t2", "m46_t2=x", "nope=3", "m46_t2:o9=3"):
+        with pytest.raises(ValueError):
+            load_catalog(bot.TRACKS_MATRIX, capacities=bad)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts: list[str] = []
+        self.documents = []
+
+    async def reply_text(self, text):
+        self.texts.append(text)
+
+    async def reply_document(self, document, **kwargs):
+        self.documents.append(kwargs)
+
+
+def test_a_failed_export_is_reported_and_cleaned_up(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(bot, "DATABASE_URL", str(tmp_path / "missing" / "registrations.db"))
+    message = FakeMessage()
+    asyncio.run(bot.export_cmd(SimpleNamespace(message=message), SimpleNamespace(args=["csv"])))
+    assert len(message.texts) == 1 and message.texts[0].startswith("ما قدرت أصدّر")
+    assert not message.documents
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,225 @@
+# cSpell:disable
+import asyncio
+
+from registration_export import ExportFilters
+from registration_store import (
+    BLOCKED, CREATED, FULL, MIGRATIONS, QUEUED, RUNNING, SENT, UNCHANGED, UNKNOWN, UPDATED,
+)
+
+
+def register(store, user_id, track_key="t1", option_key=None, name=None, gender="m", grade="g4"):
+    return store.upsert(
+        user_id, f"user{user_id}", name or f"Student {user_id}", gender, grade,
+        track_key, track_key.upper(), option_key, option_key.upper() if option_key else None,
+    )
+
+
+def totals(counts):
+    """{(track_key, option_key): count} from counts() rows."""
+    result = {}
+    for _, _, track_key, option_key, count in counts:
+        result[(track_key, option_key)] = result.get((track_key, option_key), 0) + count
+    return result
+
+
+def test_migrates_an_empty_database_to_the_latest_version(backend, with_store):
+    async def body(store):
+        assert await backend.version() == len(MIGRATIONS)
+        assert await store.counts() == []
+        assert await store.latest_for_user(1) is None
+
+    with_store(body)
+    # المرة الثانية ما في شي ينفّذ
+    with_store(body)
+
+
+def test_migration_keeps_the_latest_duplicate_and_fixes_counts(backend, with_store):
+    # قبل migration 4: نفس الطالب والمسابقة مسجلين مرتين
+    asyncio.run(backend.prepare(3, [
+        (1, "Old name", "m", "g4", "t1", "T1", "o1", "2026-01-01T10:00:00"),
+        (1, "New name", "m", "g4", "t1", "T1", "o2", "2026-01-02T10:00:00"),
+        (2, "Other", "f", "g5", "t1", "T1", "o1", "2026-01-03T10:00:00"),
+    ]))
+
+    async def body(store):
+        assert await backend.version() == len(MIGRATIONS)
+        assert (await store.latest_for_user(1))[1] == "New name"
+        assert totals(await store.counts()) == {("t1", "o1"): 1, ("t1", "o2"): 1}
+        assert store.is_registered(1, "t1")
+        _, status = await register(store, 1, "t1", "o2", name="New name", grade="g4")
+        assert status == UNCHANGED
+
+    with_store(body)
+    # الصف المحذوف محفوظ مع id الصف اللي ضل
+    kept_id = asyncio.run(backend.fetch("SELECT id FROM registrations WHERE full_name = 'New name'"))[0][0]
+    assert asyncio.run(backend.fetch(
+        "SELECT tg_user_id, full_name, option_key, kept_id FROM registrations_duplicates"
+    )) == [(1, "Old name", "o1", kept_id)]
+
+
+def test_upsert_reports_created_updated_unchanged_and_full(with_store):
+    async def body(store):
+        reg_id, status = await register(store, 1, "t1", "o1")
+        assert status == CREATED
+        assert await register(store, 1, "t1", "o1") == (reg_id, UNCHANGED)
+        assert await register(store, 1, "t1", "o2") == (reg_id, UPDATED)
+        assert await register(store, 1, "t1", "o2", name="Renamed") == (reg_id, UPDATED)
+
+        other_id, _ = await register(store, 2, "t1", "o1")
+        assert store.is_full("t1", "o1")
+        assert await register(store, 3, "t1", "o1") == (None, FULL)
+        assert not store.is_registered(3, "t1")
+        # المسجّل من قبل بيقدر يضل على خياره
+        assert await register(store, 2, "t1", "o1", name="Same seat") == (other_id, UPDATED)
+
+    with_store(body, capacities={("t1", "o1"): 1})
+
+
+def test_lowered_capacity_only_blocks_new_seats(with_store):
+    async def fill(store):
+        for user_id in (1, 2, 3):
+            await register(store, user_id, "t1", "o1")
+        await register(store, 4, "t1", "o2")
+
+    with_store(fill)
+
+    async def body(store):
+        # الحد صار أقل من المسجلين: اللي مسجّل بيقدر يعدّل اسمه أو يأكّد نفس الخيار
+        assert (await register(store, 1, "t1", "o1", name="Renamed"))[1] == UPDATED
+        assert (await register(store, 2, "t1", "o1"))[1] == UNCHANGED
+        assert (await register(store, 4, "t1", "o2", grade="g5"))[1] == UPDATED
+        # بس ما بياخذ مقعد جديد
+        assert await register(store, 4, "t1", "o1") == (None, FULL)
+        assert await register(store, 5, "t1", "o2") == (None, FULL)
+        assert totals(await store.counts()) == {("t1", "o1"): 3, ("t1", "o2"): 1}
+
+    with_store(body, capacities={("t1", ""): 2, ("t1", "o1"): 1})
+
+
+def test_counts_follow_inserts_and_option_changes(with_store):
+    async def body(store):
+        await register(store, 1, "t1", "o1")
+        await register(store, 2, "t1", "o1", gender="f")
+        await register(store, 3, "t1", "o2")
+        await register(store, 3, "t2")
+        assert sorted(await store.counts()) == [
+            ("f", "g4", "t1", "o1", 1),
+            ("m", "g4", "t1", "o1", 1),
+            ("m", "g4", "t1", "o2", 1),
+            ("m", "g4", "t2", "", 1),
+        ]
+        # التحديث بينقل العدّ من خيار لخيار
+        await register(store, 1, "t1", "o2")
+        assert totals(await store.counts()) == {("t1", "o1"): 1, ("t1", "o2"): 2, ("t2", ""): 1}
+
+    with_store(body)
+
+
+def test_concurrent_confirms_never_overbook(with_store):
+    async def body(replica_a, replica_b):
+        results = await asyncio.gather(*(
+            register(replica_a if user_id % 2 else replica_b, user_id, "t1", "o1")
+            for user_id in range(1, 21)
+        ))
+        statuses = [status for _, status in results]
+        assert statuses.count(CREATED) == 5
+        assert statuses.count(FULL) == 15
+        assert totals(await replica_a.counts()) == {("t1", "o1"): 5}
+
+        # حد المسابقة كلها كمان
+        results = await asyncio.gather(*(register(replica_a, user_id, "t1", "o2") for user_id in range(21, 41)))
+        assert [status for _, status in results].count(CREATED) == 3
+        assert sum(totals(await replica_b.counts()).values()) == 8
+
+    with_store(body, capacities={("t1", ""): 8, ("t1", "o1"): 5}, stores=2)
+
+
+def test_broadcast_claims_requeued_recipients_first_and_skips_blocked(with_store):
+    async def body(store):
+        for user_id in range(1, 7):
+            await register(store, user_id, "t1")
+        await register(store, 1, "t2")
+        broadcast_id = await store.create_broadcast(100, 5, ExportFilters(), created_by=100)
+        assert await store.count_broadcast_recipients(ExportFilters()) == 6
+        assert await store.set_broadcast_status(broadcast_id, RUNNING, ("draft",))
+        assert not await store.set_broadcast_status(broadcast_id, RUNNING, ("draft",))
+        assert await store.broadcasts_with_status(RUNNING) == [broadcast_id]
+
+        assert await store.claim_broadcast_recipients(broadcast_id, ExportFilters(), 3) == [1, 2, 3]
+        await store.record_broadcast_deliveries(
+            broadcast_id, [(1, SENT, None), (2, BLOCKED, "blocked"), (3, QUEUED, None)]
+        )
+        # اللي رجعوا للدور أولاً، وبعدين من مكان الـ cursor
+        assert await store.claim_broadcast_recipients(broadcast_id, ExportFilters(), 3) == [3]
+        assert await store.claim_broadcast_recipients(broadcast_id, ExportFilters(), 3) == [4, 5, 6]
+        assert await store.claim_broadcast_recipients(broadcast_id, ExportFilters(), 3) == []
+        await store.record_broadcast_deliveries(broadcast_id, [(3, SENT, None), (4, SENT, None)])
+
+        assert await store.abandon_pending_deliveries(broadcast_id) == 2
+        assert await store.broadcast_progress(broadcast_id) == {SENT: 3, BLOCKED: 1, UNKNOWN: 2}
+        # المحظور ما بيوصله البث الجاي
+        assert await store.count_broadcast_recipients(ExportFilters()) == 5
+
+    with_store(body)
+
+
+def test_history_pages_newest_first(with_store):
+    async def body(store):
+        ids = [(await register(store, 1, f"t{n}"))[0] for n in range(7)]
+        await register(store, 2, "t0")
+
+        rows, next_before = await store.history_for_user(1, limit=3)
+        assert [row[0] for row in rows] == ids[::-1][:3]
+        pages = [row[0] for row in rows]
+        while next_before is not None:
+            rows, next_before = await store.history_for_user(1, next_before, limit=3)
+            pages += [row[0] for row in rows]
+        assert pages == ids[::-1]
+        assert (await store.latest_for_user(1))[0] == ids[-1]
+        assert await store.history_for_user(3) == ([], None)
+
+    with_store(body)
+
+
+def test_reconcile_reads_rows_after_an_id_and_by_ids(with_store):
+    async def body(store):
+        ids = [(await register(store, user_id, "t1"))[0] for user_id in range(1, 6)]
+        after = await store.registrations_after(ids[1], 2)
+        assert [row[0] for row in after] == ids[2:4]
+        assert [row[0] for row in await store.registrations_by_ids([ids[4], ids[0], 999])] == [ids[0], ids[4]]
+        assert await store.existing_ids([ids[0], 999]) == {ids[0]}
+        await store.set_checkpoint("c", {"verified_id": 3})
+        await store.set_checkpoint("c", {"verified_id": 4})
+        assert await store.get_checkpoint("c") == {"verified_id": 4}
+        assert await store.get_checkpoint("missing") is None
+
+    with_store(body)
+
+
+def test_leases_exclude_other_owners_until_released_or_expired(with_store):
+    async def body(replica_a, replica_b):
+        assert await replica_a.acquire_lease("job", "a", 60)
+        assert await replica_a.acquire_lease("job", "a", 60)
+        assert not await replica_b.acquire_lease("job", "b", 60)
+        await replica_b.release_lease("job", "b")
+        assert not await replica_b.acquire_lease("job", "b", 60)
+        await replica_a.release_lease("job", "a")
+        assert await replica_b.acquire_lease("job", "b", -1)
+        # خلصت مدته: أي حدا بياخذه
+        assert await replica_a.acquire_lease("job", "a", 60)
+
+    with_store(body, stores=2)
+
+
+def test_sheet_pending_is_shared_between_replicas(with_store):
+    async def body(replica_a, replica_b):
+        await replica_a.mark_sheet_pending("reg:1", 1)
+        await replica_a.mark_sheet_pending("reg:1", 1)
+        await replica_b.mark_sheet_pending("reg:1:upd:abc", 1)
+        assert sorted((key, reg_id) for key, reg_id, _ in await replica_b.sheet_pending()) == [
+            ("reg:1", 1), ("reg:1:upd:abc", 1),
+        ]
+        await replica_b.clear_sheet_pending(["reg:1", "reg:9"])
+        assert [key for key, _, _ in await replica_a.sheet_pending()] == ["reg:1:upd:abc"]
+
+    with_store(body, stores=2)
@@ -0,0 +1,63 @@
+# cSpell:disable
+import asyncio
+
+from replica_lease import hold_lease
+
+
+def test_hold_lease_renews_and_notices_a_takeover(with_store):
+    async def body(store):
+        async with hold_lease(store, "job", 0.3, owner="a") as lease:
+            assert lease.held
+            async with hold_lease(store, "job", 0.3, owner="b") as other:
+                assert not other.held
+            # بيتجدد: بعد أكثر من مدته لسه إلنا
+            await asyncio.sleep(0.5)
+            assert not await store.acquire_lease("job", "b", 60)
+
+            await store.release_lease("job", "a")
+            assert await store.acquire_lease("job", "b", 60)
+            await asyncio.sleep(0.2)
+            assert lease.lost
+        # ما منحرّر lease صار لغيرنا
+        assert not await store.acquire_lease("job", "c", 60)
+
+        async with hold_lease(store, "other", 60, owner="a"):
+            pass
+        assert await store.acquire_lease("other", "c", 60)
+
+    with_store(body)
+
+
+class FailingRenewals:
+    """The store's leases, but every renewal after the first acquire raises."""
+
+    def __init__(self, store):
+        self.store = store
+        self.calls = 0
+
+    async def acquire_lease(self, name, owner, seconds):
+        self.calls += 1
+        if self.calls > 1:
+            raise ConnectionError("database unavailable")
+        return await self.store.acquire_lease(name, owner, seconds)
+
+    async def release_lease(self, name, owner):
+        await self.store.release_lease(name, owner)
+
+
+def test_hold_lease_gives_up_before_expiry_when_renewals_fail(with_store):
+    async def body(store):
+        flaky = FailingRenewals(store)
+        async with hold_lease(flaky, "job", 0.3, owner="a") as lease:
+            assert lease.held
+            await asyncio.sleep(0.2)
+            assert not lease.lost
+            # قبل ما يخلص بالقاعدة (0.3) لازم نكون وقفنا
+            await asyncio.sleep(0.08)
+            assert lease.lost
+            assert not await store.acquire_lease("job", "b", 60)
+            await asyncio.sleep(0.05)
+            assert await store.acquire_lease("job", "b", 60)
+        assert flaky.calls >= 3
+
+    with_store(body)
@@ -0,0 +1,123 @@
+# cSpell:disable
+import asyncio
+from datetime import datetime, timedelta
+
+from registration_store import registration_sheet_row
+from sheet_reconcile import STUCK_AFTER_RUNS, SheetReconciler
+
+
+class FakeSheetClient:
+    """Worksheet rows in memory, with SheetClient's batch_get/append_rows."""
+
+    def __init__(self):
+        self.rows: list[list[str]] = []
+        self.wanted: set[str] = set()
+        self.appends = 0
+
+    def batch_get(self, worksheet, ranges):
+        result = []
+        for a1 in ranges:
+            first, last = (int(part[1:]) for part in a1.split(":"))
+            result.append(self.rows[first - 1:last])
+        return result
+
+    def append_rows(self, worksheet, rows):
+        self.appends += 1
+        self.rows += rows
+
+
+async def register(store, client, user_id, on_sheet=True):
+    reg_id, _ = await store.upsert(user_id, None, f"Student {user_id}", "m", "g4", "t1", "T1", None, None)
+    if on_sheet:
+        client.rows.append(registration_sheet_row(reg_id, None, f"Student {user_id}", "m", "g4", "T1", None))
+    return reg_id
+
+
+def reconciler(store, client, **kwargs):
+    return SheetReconciler(store, client, "spreadsheet", "Sheet1", grace=timedelta(0), **kwargs)
+
+
+def test_missing_rows_are_appended_once(with_store):
+    async def body(store):
+        client = FakeSheetClient()
+        ids = [await register(store, client, user_id, on_sheet=user_id != 2) for user_id in range(1, 5)]
+        report = await reconciler(store, client).run_once()
+        assert report.reappended == [ids[1]]
+        assert [row[0] for row in client.rows] == [str(i) for i in (ids[0], ids[2], ids[3], ids[1])]
+
+        report = await reconciler(store, client).run_once()
+        assert report.clean and report.db_rows_checked == 0
+
+    with_store(body)
+
+
+def test_rows_queued_by_another_replica_are_not_appended(with_store):
+    async def body(replica_a, replica_b):
+        client = FakeSheetClient()
+        reg_id = await register(replica_b, client, 1, on_sheet=False)
+        # بـ outbox النسخة b، مش عنا
+        await replica_b.mark_sheet_pending(f"reg:{reg_id}", reg_id)
+
+        for run in range(STUCK_AFTER_RUNS + 1):
+            report = await reconciler(replica_a, client).run_once()
+            assert report.reappended == [] and report.deferred == 1
+        assert report.stuck == [reg_id]
+        assert client.rows == []
+
+        # وصل الصف والـ drainer مسح sheet_pending
+        client.rows.append(registration_sheet_row(reg_id, None, "Student 1", "m", "g4", "T1", None))
+        await replica_b.clear_sheet_pending([f"reg:{reg_id}"])
+        report = await reconciler(replica_a, client).run_once()
+        assert report.clean and report.deferred == 0
+        assert (await replica_a.get_checkpoint("reconcile:spreadsheet:Sheet1"))["deferred"] == {}
+
+    with_store(body, stores=2)
+
+
+def test_long_pending_rows_count_as_lost(with_store):
+    async def body(store):
+        client = FakeSheetClient()
+        reg_id = await register(store, client, 1, on_sheet=False)
+        await store.mark_sheet_pending(f"reg:{reg_id}", reg_id)
+        report = await reconciler(store, client, lost_after=timedelta(0)).run_once()
+        assert report.reappended == [reg_id]
+        assert await store.sheet_pending() == []
+
+    with_store(body)
+
+
+def test_only_one_replica_reconciles_at_a_time(with_store):
+    async def body(replica_a, replica_b):
+        client = FakeSheetClient()
+        for user_id in range(1, 4):
+            await register(replica_a, client, user_id, on_sheet=False)
+        reports = await asyncio.gather(
+            reconciler(replica_a, client, owner="a").run_once(),
+            reconciler(replica_b, client, owner="b").run_once(),
+        )
+        assert sorted(report.skipped for report in reports) == [False, True]
+        assert len(client.rows) == 3 and client.appends == 1
+
+        report = await reconciler(replica_b, client, owner="b").run_once()
+        assert not report.skipped and report.clean
+
+    with_store(body, stores=2)
+
+
+def test_an_update_to_an_old_row_is_checked_until_it_arrives(with_store):
+    async def body(store):
+        client = FakeSheetClient()
+        reg_id = await register(store, client, 1)
+        assert (await reconciler(store, client).run_once()).clean
+
+        await store.upsert(1, None, "Renamed", "m", "g4", "t1", "T1", None, None)
+        await store.mark_sheet_pending(f"reg:{reg_id}:upd:q1", reg_id)
+        report = await reconciler(store, client).run_once()
+        assert report.deferred == 1 and report.clean
+
+        # التحديث ضاع مع outbox النسخة: بعد RECONCILE_LOST_AFTER بينضاف آخر نسخة
+        report = await reconciler(store, client, lost_after=timedelta(0)).run_once()
+        assert report.reappended == [reg_id]
+        assert client.rows[-1][2] == "Renamed"
+
+    with_store(body)
@@ -0,0 +1,71 @@
+# cSpell:disable
+from types import SimpleNamespace
+
+import pytest
+from gspread.exceptions import APIError
+
+from sheets_client import SheetClient
+
+
+def api_error(status, message):
+    response = SimpleNamespace(
+        status_code=status, text=message,
+        json=lambda: {"error": {"code": status, "message": message, "status": ""}},
+    )
+    return APIError(response)
+
+
+class FakeWorksheet:
+    def __init__(self, title, error=None):
+        self.title = title
+        self.error = error
+        self.rows: list[list[str]] = []
+
+    def append_rows(self, rows):
+        if self.error:
+            raise self.error
+        self.rows += rows
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.resolved: list[str] = []
+
+    def worksheet(self, name):
+        self.resolved.append(name)
+        return FakeWorksheet(name)
+
+
+def client_with(stale):
+    """A client whose cached Sheet1 handle raises `stale`; Sheet2 is cached too."""
+    client = SheetClient("creds.json", "spreadsheet")
+    client._sh = FakeSpreadsheet()
+    client._worksheets = {"Sheet1": FakeWorksheet("Sheet1", stale), "Sheet2": FakeWorksheet("Sheet2")}
+    return client
+
+
+@pytest.mark.parametrize("error", [
+    api_error(400, "Unable to parse range: 'Sheet1'!A1"),
+    api_error(404, "Requested entity was not found."),
+])
+def test_a_stale_handle_is_re_resolved_alone(error):
+    client = client_with(error)
+    sheet2 = client._worksheets["Sheet2"]
+    client.append_rows("Sheet1", [["1"]])
+    assert client._sh.resolved == ["Sheet1"]
+    assert client._worksheets["Sheet1"].rows == [["1"]]
+    assert client._worksheets["Sheet2"] is sheet2
+
+
+@pytest.mark.parametrize("error", [
+    api_error(400, "Invalid values[0][1]: list_value"),
+    api_error(429, "Quota exceeded"),
+    api_error(500, "Internal error"),
+])
+def test_other_errors_are_raised_without_a_retry(error):
+    client = client_with(error)
+    cached = dict(client._worksheets)
+    with pytest.raises(APIError):
+        client.append_rows("Sheet1", [["1"]])
+    assert client._sh.resolved == []
+    assert client._worksheets == cached
@@ -0,0 +1,105 @@
+# cSpell:disable
+import time
+import asyncio
+
+import pytest
+
+from sheets_writer import BatchedSheetWriter
+
+
+class FakeSheetClient:
+    """Records append_rows calls (in BatchedSheetWriter's worker thread);
+    raises `error` while it is set."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.error: Exception | None = None
+        self.calls: list[tuple[str, list[list[str]]]] = []
+
+    def append_rows(self, worksheet_name, rows):
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        self.calls.append((worksheet_name, rows))
+
+
+def test_flushes_when_max_rows_are_buffered():
+    async def main():
+        client = FakeSheetClient()
+        writer = BatchedSheetWriter(client, max_rows=3, max_delay=60)
+        # ما بيستنى الـ 60 ثانية
+        await asyncio.wait_for(asyncio.gather(*(writer.append("Sheet1", [str(n)]) for n in range(3))), 1)
+        assert client.calls == [("Sheet1", [["0"], ["1"], ["2"]])]
+
+        late = writer.submit("Sheet1", ["3"])
+        await asyncio.sleep(0.05)
+        assert not late.done()
+        await writer.aclose()
+        assert late.done() and client.calls[-1] == ("Sheet1", [["3"]])
+
+    asyncio.run(main())
+
+
+def test_flushes_after_the_delay_per_worksheet():
+    async def main():
+        client = FakeSheetClient()
+        writer = BatchedSheetWriter(client, max_rows=50, max_delay=0.05)
+        started = time.monotonic()
+        await asyncio.gather(
+            writer.append("Sheet1", ["a"]), writer.append("Sheet2", ["b"]), writer.append("Sheet1", ["c"]),
+        )
+        assert time.monotonic() - started >= 0.05
+        assert sorted(client.calls) == [("Sheet1", [["a"], ["c"]]), ("Sheet2", [["b"]])]
+        await writer.aclose()
+
+    asyncio.run(main())
+
+
+def test_a_failed_append_fails_every_row_of_the_batch():
+    async def main():
+        client = FakeSheetClient()
+        client.error = RuntimeError("quota exceeded")
+        writer = BatchedSheetWriter(client, max_rows=2, max_delay=60)
+        futures = [writer.submit("Sheet1", [str(n)]) for n in range(2)]
+        for fut in futures:
+            with pytest.raises(RuntimeError, match="quota exceeded"):
+                await fut
+
+        # الدفعة الجاية ما بتتأثر
+        client.error = None
+        await asyncio.gather(writer.append("Sheet1", ["2"]), writer.append("Sheet1", ["3"]))
+        assert client.calls == [("Sheet1", [["2"], ["3"]])]
+        await writer.aclose()
+
+    asyncio.run(main())
+
+
+def test_batches_of_one_worksheet_are_written_in_order():
+    async def main():
+        client = FakeSheetClient(latency=0.02)
+        writer = BatchedSheetWriter(client, max_rows=1, max_delay=60)
+        futures = []
+        for n in range(6):
+            futures.append(writer.submit("Sheet1", [str(n)]))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*futures)
+        # اللي وصلوا والكتابة السابقة شغالة بيطلعوا بدفعة وحدة بعدها، بالترتيب
+        assert len(client.calls) > 1
+        assert [row for _, rows in client.calls for row in rows] == [[str(n)] for n in range(6)]
+        await writer.aclose()
+
+    asyncio.run(main())
+
+
+def test_aclose_writes_buffered_rows_and_refuses_new_ones():
+    async def main():
+        client = FakeSheetClient()
+        writer = BatchedSheetWriter(client, max_rows=50, max_delay=60)
+        futures = [writer.submit(name, [name]) for name in ("Sheet1", "Sheet2", "Sheet1")]
+        await writer.aclose()
+        assert all(fut.done() and fut.exception() is None for fut in futures)
+        assert sorted(client.calls) == [("Sheet1", [["Sheet1"], ["Sheet1"]]), ("Sheet2", [["Sheet2"]])]
+        with pytest.raises(RuntimeError):
+            writer.submit("Sheet1", ["late"])
+
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# cSpell:disable
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+
+def update_from(update_id: int, user_id: int) -> Update:
+    message = Message(
+        update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=User(user_id, f"user{user_id}", False)
+    )
+    return Update(update_id, message=message)
+
+
+def test_updates_from_one_user_run_in_order_one_at_a_time():
+    async def main():
+        processor = PerUserUpdateProcessor(4)
+        events = []
+
+        async def handle(n, delay):
+            events.append(("start", n))
+            await asyncio.sleep(delay)
+            events.append(("end", n))
+
+        # الأول أبطأ: لو اشتغلوا مع بعض كان الثاني خلص قبله
+        await asyncio.gather(*(
+            processor.process_update(update_from(n, 1), handle(n, 0.05 - n * 0.01)) for n in range(5)
+        ))
+        assert events == [(kind, n) for n in range(5) for kind in ("start", "end")]
+        assert processor.pending == 0 and not processor._locks
+
+    asyncio.run(main())
+
+
+def test_a_user_waiting_for_its_lock_holds_no_slot():
+    async def main():
+        processor = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+        done = []
+
+        async def blocked(n):
+            await release.wait()
+            done.append((1, n))
+
+        async def quick(user_id):
+            done.append((user_id, 0))
+
+        # مستخدم 1 عنده دفعة updates والأول عالق؛ الباقي ناطرين قفله
+        burst = [asyncio.create_task(processor.process_update(update_from(n, 1), blocked(n))) for n in range(5)]
+        await asyncio.sleep(0.01)
+        # ما ضل إلا مكان واحد فاضي، ولازم يكون لغيره
+        await asyncio.wait_for(processor.process_update(update_from(10, 2), quick(2)), 1)
+        await asyncio.wait_for(processor.process_update(update_from(11, 3), quick(3)), 1)
+        assert done == [(2, 0), (3, 0)]
+        assert processor.pending == 5
+
+        release.set()
+        await asyncio.gather(*burst)
+        assert done[2:] == [(1, n) for n in range(5)]
+
+    asyncio.run(main())
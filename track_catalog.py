@@ -0,0 +1,186 @@
+# cSpell:disable
+import os
+import copy
+import json
+from types import MappingProxyType
+from typing import NamedTuple
+
+TRACK_PREFIX = "t:"
+OPTION_PREFIX = "o:"
+# حد تيليغرام لطول callback_data
+MAX_CALLBACK_BYTES = 64
+
+
+class Option(NamedTuple):
+    key: str
+    title: str
+    track_key: str
+    capacity: int | None = None
+
+    @property
+    def callback_data(self) -> str:
+        return f"{OPTION_PREFIX}{self.track_key}:{self.key}"
+
+
+class Track(NamedTuple):
+    key: str
+    gender: str
+    group: str
+    title: str
+    options: tuple[Option, ...]
+    options_by_key: MappingProxyType
+    capacity: int | None = None
+
+    @property
+    def callback_data(self) -> str:
+        return f"{TRACK_PREFIX}{self.key}"
+
+
+class TrackCatalog:
+    """Read-only, flattened view of a tracks matrix
+    ({gender: {group: {track_key: {"title", "options"}}}}).
+
+    Tracks and options keep matrix order. Callback payloads carry the
+    stable keys ("t:<track>" / "o:<track>:<option>"), not positions, so a
+    keyboard already sent to a student still means the same choice after
+    TRACKS_FILE is edited; a key that no longer exists resolves to None.
+
+    A track spec may set "capacity" (seats for the whole track), and an
+    option may be {"title", "capacity"} instead of a plain title."""
+
+    __slots__ = ("tracks", "options", "by_key", "by_group")
+
+    def __init__(self, matrix: dict):
+        tracks: list[Track] = []
+        options: list[Option] = []
+        by_group: dict[tuple[str, str], tuple[Track, ...]] = {}
+
+        for gender, groups in matrix.items():
+            for group, group_tracks in groups.items():
+                group_list = []
+                for track_key, spec in group_tracks.items():
+                    track_options = []
+                    for opt_key, opt_spec in (spec.get("options") or {}).items():
+                        if isinstance(opt_spec, dict):
+                            option = Option(opt_key, opt_spec["title"], track_key, opt_spec.get("capacity"))
+                        else:
+                            option = Option(opt_key, opt_spec, track_key)
+                        options.append(option)
+                        track_options.append(option)
+                    track = Track(
+                        key=track_key,
+                        gender=gender,
+                        group=group,
+                        title=spec["title"],
+                        options=tuple(track_options),
+                        options_by_key=MappingProxyType({o.key: o for o in track_options}),
+                        capacity=spec.get("capacity"),
+                    )
+                    tracks.append(track)
+                    group_list.append(track)
+                by_group[(gender, group)] = tuple(group_list)
+
+        by_key = {t.key: t for t in tracks}
+        if len(by_key) != len(tracks):
+            raise ValueError("Duplicate track keys in tracks matrix")
+        for item in (*tracks, *options):
+            if ":" in item.key:
+                raise ValueError(f"Track/option key {item.key!r} must not contain ':'")
+            if len(item.callback_data.encode()) > MAX_CALLBACK_BYTES:
+                raise ValueError(f"Callback data {item.callback_data!r} is longer than {MAX_CALLBACK_BYTES} bytes")
+
+        self.tracks: tuple[Track, ...] = tuple(tracks)
+        self.options: tuple[Option, ...] = tuple(options)
+        self.by_key = MappingProxyType(by_key)
+        self.by_group = MappingProxyType(by_group)
+
+    def capacities(self) -> dict[tuple[str, str], int]:
+        """{(track_key, option_key): seats}; option_key is "" for a
+        track-wide limit. Unlimited tracks/options are left out."""
+        caps = {}
+        for track in self.tracks:
+            if track.capacity is not None:
+                caps[(track.key, "")] = track.capacity
+            for option in track.options:
+                if option.capacity is not None:
+                    caps[(track.key, option.key)] = option.capacity
+        return caps
+
+    def for_group(self, gender: str | None, group: str | None) -> tuple[Track, ...]:
+        return self.by_group.get((gender, group), ())
+
+    def track_from_callback(self, data: str) -> Track | None:
+        if not data.startswith(TRACK_PREFIX):
+            return None
+        return self.by_key.get(data[len(TRACK_PREFIX):])
+
+    def option_from_callback(self, data: str) -> tuple[Track, Option] | tuple[None, None]:
+        if not data.startswith(OPTION_PREFIX):
+            return None, None
+        track_key, _, option_key = data[len(OPTION_PREFIX):].partition(":")
+        track = self.by_key.get(track_key)
+        option = track.options_by_key.get(option_key) if track else None
+        if option is None:
+            return None, None
+        return track, option
+
+    @classmethod
+    def from_file(cls, path: str) -> "TrackCatalog":
+        return cls(read_matrix(path))
+
+
+def read_matrix(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise RuntimeError("PyYAML is required to load a YAML tracks file") from e
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def parse_capacities(spec: str) -> dict[tuple[str, str], int]:
+    """"m46_t2=40,f46_t2:o3=10" -> {("m46_t2", ""): 40, ("f46_t2", "o3"): 10}."""
+    caps = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, sep, seats = item.partition("=")
+        track_key, _, option_key = key.strip().partition(":")
+        if not sep or not track_key or not seats.strip().isdigit():
+            raise ValueError(f"Bad capacity {item!r}; expected <track>[:<option>]=<seats>")
+        caps[(track_key, option_key)] = int(seats)
+    return caps
+
+
+def with_capacities(matrix: dict, caps: dict[tuple[str, str], int]) -> dict:
+    """Copy of `matrix` with the given seat limits set on its tracks/options."""
+    matrix = copy.deepcopy(matrix)
+    specs = {key: spec for groups in matrix.values() for tracks in groups.values() for key, spec in tracks.items()}
+    for (track_key, option_key), seats in caps.items():
+        spec = specs.get(track_key)
+        if spec is None:
+            raise ValueError(f"Capacity for unknown track {track_key!r}")
+        if not option_key:
+            spec["capacity"] = seats
+            continue
+        options = spec.get("options") or {}
+        if option_key not in options:
+            raise ValueError(f"Capacity for unknown option {track_key}:{option_key}")
+        option = options[option_key]
+        options[option_key] = {**option, "capacity": seats} if isinstance(option, dict) else {
+            "title": option, "capacity": seats,
+        }
+    return matrix
+
+
+def load_catalog(default_matrix: dict, path: str | None = None, capacities: str | None = None) -> TrackCatalog:
+    """The catalog from TRACKS_FILE (or `default_matrix`), with the seat
+    limits of TRACK_CAPACITIES ("<track>[:<option>]=<seats>,...") on top
+    of any "capacity" already in the matrix."""
+    path = path or os.getenv("TRACKS_FILE")
+    matrix = read_matrix(path) if path else default_matrix
+    capacities = os.getenv("TRACK_CAPACITIES", "") if capacities is None else capacities
+    caps = parse_capacities(capacities)
+    return TrackCatalog(with_capacities(matrix, caps) if caps else matrix)
@@ -0,0 +1,81 @@
+# cSpell:disable
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+log = logging.getLogger("update-processor")
+
+# 1 = الوضع القديم (update ورا update)؛ أكثر من 1 يفعّل المعالجة المتوازية
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `max_concurrent_updates` updates at once, but never two
+    from the same user: each user (or chat, for updates without a user)
+    has a lock held while its update is handled, so conversation state
+    and user_data change in the order Telegram sent them.
+
+    The user's lock is taken before one of the concurrency slots, so a
+    user with a burst of updates (an album, double taps) waits on their
+    own lock and leaves the slots to everyone else. Locks exist only
+    while a user has an update in flight."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # key -> (lock, عدد الـ updates اللي ماسكته أو ناطرته)
+        self._locks: dict[int, tuple[asyncio.Lock, int]] = {}
+        # updates أخذها الـ Application من الطابور وما خلصت (ناطرة أو عم تتعالج)
+        self.pending = 0
+
+    @staticmethod
+    def _key(update: object) -> int | None:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        self.pending += 1
+        try:
+            key = self._key(update)
+            if key is None:
+                await super().process_update(update, coroutine)
+                return
+            lock, users = self._locks.get(key) or (asyncio.Lock(), 0)
+            self._locks[key] = (lock, users + 1)
+            try:
+                # القفل قبل الـ semaphore: اللي ناطر دوره ما بياخذ مكان من غيره
+                async with lock:
+                    await super().process_update(update, coroutine)
+            finally:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+        finally:
+            self.pending -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def update_processor() -> PerUserUpdateProcessor | None:
+    """The processor for ApplicationBuilder.concurrent_updates, or None
+    when CONCURRENT_UPDATES leaves the bots sequential."""
+    if CONCURRENT_UPDATES <= 1:
+        return None
+    return PerUserUpdateProcessor(CONCURRENT_UPDATES)